@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import UserProfile, Comment, Post # If we want to use our models in the admin panel then we need to register them
+from .models import UserProfile, Comment, Post, Tag # If we want to use our models in the admin panel then we need to register them
 
 admin.site.register(UserProfile)
 admin.site.register(Comment)
 admin.site.register(Post)
 
+admin.site.register(Tag)
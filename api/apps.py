@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals # connect the signals that keep the post counters up to date
+        from . import checks # warn when the response cache cant work because the cache isnt shared
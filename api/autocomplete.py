@@ -0,0 +1,109 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Max
+from .models import UserProfile
+
+# Username autocomplete (mentions, looking up a profile) - running an icontains query on every keystroke would hit the database
+# for every letter typed, so every worker keeps the usernames of the users and the profiles in a sorted list in memory instead.
+# The names that start with what was typed sit next to each other in it, so a lookup is one binary search plus reading the
+# next few names, no matter how many users there are.
+# The index is built on the first lookup. The signals call change() when a user or profile is created, renamed or deleted,
+# which updates this worker's index right after the commit. The other workers dont get those calls (and the cache may be per
+# worker too), so every AUTOCOMPLETE_REBUILD_SECONDS each worker compares the counts, newest ids and newest profile `updated`
+# with the ones its index was built from and rebuilds when they moved. A user renamed in the admin moves none of them, every
+# index is built again after AUTOCOMPLETE_MAX_AGE_SECONDS anyway
+
+MAX_LIMIT = 50
+
+# what the index was built from, two small aggregate queries
+def usernames_stamp():
+    users = User.objects.aggregate(total=Count('id'), last=Max('id'))
+    profiles = UserProfile.objects.aggregate(total=Count('id'), last=Max('id'), updated=Max('updated'))
+    return users['total'], users['last'], profiles['total'], profiles['last'], profiles['updated']
+
+class UsernameIndex:
+    def __init__(self, rebuild_seconds=None, max_age=None):
+        self.rebuild_seconds = settings.AUTOCOMPLETE_REBUILD_SECONDS if rebuild_seconds is None else rebuild_seconds
+        self.max_age = settings.AUTOCOMPLETE_MAX_AGE_SECONDS if max_age is None else max_age
+        self.lock = threading.RLock()
+        self.entries = [] # sorted (lowercase name, name), so the lookup doesnt care about case
+        self.counts = Counter() # name -> how many users/profiles have it, a name is only removed when the last one goes
+        self.stamp = None # the usernames_stamp() the index was built from, None until it is built
+        self.built = self.checked = 0
+
+    def build(self):
+        stamp = usernames_stamp() # read before the rows, a change in between just means one more rebuild later
+        counts = Counter(User.objects.values_list('username', flat=True).iterator(chunk_size=5000))
+        counts.update(UserProfile.objects.values_list('username', flat=True).iterator(chunk_size=5000))
+        del counts[''], counts[None]
+        entries = sorted((name.lower(), name) for name in counts)
+        with self.lock:
+            self.entries, self.counts, self.stamp = entries, counts, stamp
+            self.built = self.checked = time.monotonic()
+        return len(entries)
+
+    # build the index on the first lookup, rebuild it when the usernames changed (in any worker) or it got too old
+    def refresh(self):
+        if self.stamp is None:
+            with self.lock:
+                if self.stamp is None: # only one thread builds, the others wait for it
+                    self.build()
+            return
+        now = time.monotonic()
+        if now - self.checked >= self.rebuild_seconds:
+            self.checked = now
+            if now - self.built >= self.max_age or usernames_stamp() != self.stamp:
+                self.build()
+
+    # the first `limit` names (alphabetical) that start with `prefix`
+    def search(self, prefix, limit):
+        self.refresh()
+        prefix = prefix.lower()
+        names = []
+        with self.lock:
+            index = bisect_left(self.entries, (prefix,))
+            while index < len(self.entries) and len(names) < limit and self.entries[index][0].startswith(prefix):
+                names.append(self.entries[index][1])
+                index += 1
+        return names
+
+    def add(self, name):
+        if name:
+            self.counts[name] += 1
+            if self.counts[name] == 1:
+                insort(self.entries, (name.lower(), name))
+
+    def remove(self, name):
+        if self.counts.get(name):
+            self.counts[name] -= 1
+            if not self.counts[name]:
+                del self.counts[name]
+                self.entries.pop(bisect_left(self.entries, (name.lower(), name)))
+
+    # called by the signals, nothing changes until the transaction commits. The stamp moves too, so the next check rebuilds the
+    # index once, with whatever the other workers changed in the meantime
+    def change(self, added=(), removed=()):
+        def apply():
+            with self.lock:
+                for name in removed:
+                    self.remove(name)
+                for name in added:
+                    self.add(name)
+        transaction.on_commit(apply)
+
+
+# ?limit= for the autocomplete route
+def get_limit(request):
+    try:
+        limit = int(request.query_params['limit'])
+    except (KeyError, ValueError):
+        return settings.AUTOCOMPLETE_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+username_index = UsernameIndex()
@@ -0,0 +1,63 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import BlobDeletion
+from .storage import get_container_client
+
+# Add blobs to the deletion queue. Call this inside the same transaction that deletes the row, so either both happen or neither
+def queue_blob_deletion(*blob_names):
+    BlobDeletion.objects.bulk_create([BlobDeletion(blob_name=blob_name) for blob_name in blob_names])
+
+
+# Delete one batch of the blobs that are due. Returns (deleted, failed)
+def drain_blob_deletions(batch_size=None, batch_delete=True):
+    batch_size = min(batch_size or settings.BLOB_DELETION_BATCH_SIZE, 256) # azure accepts at most 256 deletes in one batch call
+    now = timezone.now()
+
+    # Claim the rows first by pushing their next_attempt into the future, so another worker running at the same time skips them.
+    # The storage calls happen after this transaction so no database locks are held while we wait on azure
+    with transaction.atomic():
+        claimed = list(BlobDeletion.objects.select_for_update(skip_locked=True).filter(next_attempt__lte=now).order_by('next_attempt')[:batch_size])
+        BlobDeletion.objects.filter(id__in=[row.id for row in claimed]).update(next_attempt=now + timedelta(seconds=settings.BLOB_DELETION_LEASE_SECONDS))
+    if not claimed:
+        return 0, 0
+
+    errors = delete_blobs([row.blob_name for row in claimed], batch_delete)
+    done = [row.id for row in claimed if row.blob_name not in errors]
+    BlobDeletion.objects.filter(id__in=done).delete()
+
+    for row in claimed:
+        if row.blob_name in errors:
+            row.attempts += 1
+            row.last_error = errors[row.blob_name][:1000]
+            backoff = min(settings.BLOB_DELETION_BACKOFF_SECONDS * 2 ** (row.attempts - 1), settings.BLOB_DELETION_MAX_BACKOFF_SECONDS)
+            row.next_attempt = timezone.now() + timedelta(seconds=backoff)
+            row.save(update_fields=['attempts', 'last_error', 'next_attempt'])
+    return len(done), len(claimed) - len(done)
+
+
+# Returns {blob name: error} for the blobs that could not be deleted. A blob that is already gone counts as deleted
+def delete_blobs(blob_names, batch_delete=True):
+    container_client = get_container_client()
+    blob_names = list(dict.fromkeys(blob_names)) # the same blob can be queued twice, azure rejects a batch with duplicates
+    if batch_delete:
+        try:
+            responses = container_client.delete_blobs(*blob_names, raise_on_any_failure=False)
+        except Exception as e: # the whole batch failed (network, azure down...), every blob is retried later
+            return {blob_name: str(e) for blob_name in blob_names}
+        return {
+            blob_name: f'{response.status_code} {response.reason}'
+            for blob_name, response in zip(blob_names, responses)
+            if response.status_code not in (200, 202, 404)
+        }
+
+    errors = {}
+    for blob_name in blob_names: # one call per blob, for storage emulators that dont support batches
+        try:
+            container_client.delete_blob(blob_name)
+        except Exception as e:
+            if getattr(e, 'status_code', None) != 404:
+                errors[blob_name] = str(e)
+    return errors
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core import checks
+
+# The response cache (api/response_cache.py) and its single flight only work when every worker process reads and writes the same
+# cache. With the default local memory cache RESPONSE_CACHE_SECONDS is 0, so both are off and every read goes to the database
+
+@checks.register(checks.Tags.caches)
+def check_response_cache(app_configs, **kwargs):
+    if settings.SHARED_CACHE or not settings.RESPONSE_CACHE_SECONDS:
+        return []
+    return [checks.Warning(
+        'RESPONSE_CACHE_SECONDS is set but the cache is not shared by the worker processes.',
+        hint='A write only moves the version in the cache of the worker that made it, the others keep sending the old responses. '
+            'Set CACHE_BACKEND to a shared cache (redis, memcached, file based) or RESPONSE_CACHE_SECONDS=0.',
+        id='api.W001',
+    )]
+
+# only with "manage.py check --deploy", a development server with one process doesnt need a shared cache
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.SHARED_CACHE:
+        return []
+    return [checks.Warning(
+        'The cache is local to each worker process, so the response cache and single flight are off.',
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared cache, e.g. django.core.cache.backends.redis.RedisCache.',
+        id='api.W002',
+    )]
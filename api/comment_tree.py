@@ -0,0 +1,30 @@
+from collections import defaultdict
+from .models import Comment
+
+# The comment tree loader lets us fetch every comment for a group of posts in ONE query and then build the replies in memory
+# This replaces calling comment.replies.all() for every single comment, which was one query per comment
+class CommentTree:
+    def __init__(self, comments):
+        self.post_comments = defaultdict(list) # post id -> every comment of that post (top level AND replies), in created order
+        self.replies = defaultdict(list) # parent comment id -> the direct replies to that comment, in created order
+        for comment in comments:
+            self.post_comments[comment.post_id].append(comment)
+            if comment.parent_id is not None:
+                self.replies[comment.parent_id].append(comment)
+
+    # Load the comments of all the given posts with a single query
+    @classmethod
+    def for_posts(cls, post_ids):
+        return cls(Comment.objects.filter(post_id__in=list(post_ids)))
+
+    # Build the tree out of a queryset (or list) of comments we already have, along with the comments of the posts they belong to
+    @classmethod
+    def for_comments(cls, comments):
+        post_ids = {comment.post_id for comment in comments}
+        return cls.for_posts(post_ids)
+
+    def comments_for_post(self, post_id):
+        return self.post_comments.get(post_id, [])
+
+    def replies_for(self, comment_id):
+        return self.replies.get(comment_id, [])
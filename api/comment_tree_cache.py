@@ -0,0 +1,113 @@
+import bisect
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from .fast_serializers import FastCommentSerializer
+from .models import Comment
+from .response_cache import cache_lock
+
+# Comment tree cache for getPostComments. Every post gets ONE cache entry with all of its comments, already serialized
+# (without their replies) plus the (created, id, parent) of each one, so the nested `replies` can be put together without
+# the database. Comments are added, edited and deleted one at a time, so instead of throwing the tree away on every change
+# the signals PATCH it: a new comment is inserted in created order, an edited one is replaced and a deleted one is removed
+# with all of its replies. The tree is only built from the database when it is not in the cache.
+#
+# A patch and a rebuild both hold the post's cache lock, and a patch only runs after its transaction committed. So a rebuild
+# that read the database before the commit has stored its tree before the patch runs, and the patch fixes it. When the lock
+# cant be had in time the tree is deleted instead, the next read builds it again. "manage.py check_comment_trees" compares
+# the cached trees with fresh ones.
+#
+# The patches only reach the cache of the worker that made the change, with a per process cache (LocMem, the default) the other
+# workers still have the old tree. So the tree also keeps the `updated` of every comment in it, and a read only uses it when its
+# newest `updated` and its number of comments are the same as the post's comments in the database (the stats getPostComments
+# already has for its ETag). Any other tree is built again
+
+TREE_PREFIX = 'comment-tree:'
+LOCK_PREFIX = 'comment-tree-lock:'
+
+
+def build_tree(post_id):
+    serializer = FastCommentSerializer()
+    rows = list(serializer.queryset(Comment.objects.filter(post_id=post_id)))
+    return {
+        'rows': sorted((row['created'], row['id'], row['parent']) for row in rows),
+        'comments': serializer.build_own_fields(rows),
+        'updated': {row['id']: row['updated'] for row in rows},
+    }
+
+# the newest `updated` and the number of comments, of the post in the database and of the tree
+def comment_stats(post_id):
+    return Comment.objects.filter(post_id=post_id).aggregate(last=Max('updated'), total=Count('id'))
+
+def is_current(tree, stats):
+    return (max(tree['updated'].values(), default=None), len(tree['updated'])) == (stats['last'], stats['total'])
+
+# The cached tree of the post, built (and stored) when it is missing, doesnt have every comment in `ids` yet (the comment was
+# just added and its patch hasnt run yet) or doesnt match the `stats` of the post's comments (changed by another worker)
+def get_tree(post_id, ids=(), stats=None):
+    tree = cache.get(TREE_PREFIX + str(post_id))
+    if tree is not None and all(id in tree['comments'] for id in ids) and is_current(tree, stats or comment_stats(post_id)):
+        return tree
+    with cache_lock(LOCK_PREFIX + str(post_id)) as locked: # readers never wait, without the lock the tree is built but not stored
+        tree = build_tree(post_id)
+        if locked:
+            cache.set(TREE_PREFIX + str(post_id), tree, settings.COMMENT_TREE_CACHE_SECONDS)
+    return tree
+
+# The page of comments (rows with their ids) the same way CommentSerializer sends them, replies included. `stats` are the
+# comment_stats() of the post when the caller already has them
+def serialize_page(post_id, rows, stats=None):
+    ids = [row['id'] for row in rows]
+    tree = get_tree(post_id, ids, stats)
+    serializer = FastCommentSerializer()
+    serializer.set_tree([{'id': id, 'post': post_id, 'parent': parent} for _, id, parent in tree['rows']], tree['comments'])
+    return [serializer.to_representation({'id': id}) for id in ids]
+
+
+# Patches the cached tree once the transaction commits, `patch(tree)` changes the tree in place
+def patch_tree(post_id, patch):
+    def apply():
+        key = TREE_PREFIX + str(post_id)
+        with cache_lock(LOCK_PREFIX + str(post_id), wait=settings.COMMENT_TREE_LOCK_WAIT) as locked:
+            if not locked:
+                cache.delete(key) # we cant patch it safely, the next read builds it again
+                return
+            tree = cache.get(key)
+            if tree is None: # nothing cached, the next read builds it with this change in it
+                return
+            patch(tree)
+            cache.set(key, tree, settings.COMMENT_TREE_CACHE_SECONDS)
+    transaction.on_commit(apply)
+
+# A new or edited comment, read back from the database. This is also fine when the comment is already in the tree
+# (a rebuild that ran after the commit)
+def comment_saved(comment):
+    def patch(tree):
+        serializer = FastCommentSerializer()
+        rows = list(serializer.queryset(Comment.objects.filter(id=comment.id)))
+        if not rows: # deleted again in the meantime
+            return
+        row = rows[0]
+        tree['rows'] = [position for position in tree['rows'] if position[1] != comment.id] # an edit can give it another parent
+        bisect.insort(tree['rows'], (row['created'], row['id'], row['parent']))
+        tree['comments'].update(serializer.build_own_fields(rows))
+        tree['updated'][row['id']] = row['updated']
+    patch_tree(comment.post_id, patch)
+
+# A deleted comment goes with all of its replies (the database deletes them by CASCADE too)
+def comment_deleted(comment):
+    def patch(tree):
+        removed = {comment.id}
+        for _, id, parent in tree['rows']: # the rows are in created order, so a reply always comes after its parent
+            if parent in removed:
+                removed.add(id)
+        tree['rows'] = [row for row in tree['rows'] if row[1] not in removed]
+        for id in removed:
+            tree['comments'].pop(id, None)
+            tree['updated'].pop(id, None)
+    patch_tree(comment.post_id, patch)
+
+def post_deleted(post_id):
+    transaction.on_commit(lambda: cache.delete(TREE_PREFIX + str(post_id)))
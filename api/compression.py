@@ -0,0 +1,88 @@
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError: # brotli is optional, without it we only send gzip
+    brotli = None
+
+# Response compression. Brotli is picked over gzip when the client accepts it (it usually packs json tighter than gzip),
+# responses under COMPRESS_MIN_BYTES are sent as they are. Responses from the read cache come with their compressed bytes
+# already made (see response_cache.py), so they are never compressed twice
+re_accepts_gzip = re.compile(r'\bgzip\b')
+re_accepts_br = re.compile(r'\bbr\b')
+MAX_RANDOM_BYTES = 100 # like django's GZipMiddleware, a few random bytes in every gzip header make the BREACH attack harder
+
+def choose_encoding(request):
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if brotli is not None and re_accepts_br.search(accept_encoding):
+        return 'br'
+    if re_accepts_gzip.search(accept_encoding):
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=settings.BROTLI_QUALITY)
+    return compress_string(body, max_random_bytes=MAX_RANDOM_BYTES)
+
+def compress_stream(chunks, encoding):
+    if encoding == 'gzip':
+        yield from compress_sequence(chunks, max_random_bytes=MAX_RANDOM_BYTES)
+        return
+    compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush() # flush so every chunk goes out right away instead of waiting in the compressor
+        if data:
+            yield data
+    yield compressor.finish()
+
+# Every encoding we can send for a body, made once so a cached response can be sent compressed without compressing it again
+def precompress(body):
+    variants = {}
+    if len(body) >= settings.COMPRESS_MIN_BYTES:
+        for encoding in ('br', 'gzip') if brotli is not None else ('gzip',):
+            compressed = compress(body, encoding)
+            if len(compressed) < len(body):
+                variants[encoding] = compressed
+    return variants
+
+# A strong ETag has to change with the bytes, so it becomes weak when we compress (this is what django's GZipMiddleware does too).
+# Conditional GETs still work because If-None-Match is compared weakly
+def mark_encoded(response, encoding):
+    patch_vary_headers(response, ('Accept-Encoding',))
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response.headers['ETag'] = 'W/' + etag
+    response.headers['Content-Encoding'] = encoding
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            if not response.streaming and response.get('X-Cache') in ('HIT', 'STALE'): # a cached body that was sent precompressed
+                mark_encoded(response, response['Content-Encoding'])
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESS_MIN_BYTES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length'] # we wont know the compressed size until it has all been sent
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+        mark_encoded(response, encoding)
+        return response
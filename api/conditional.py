@@ -0,0 +1,72 @@
+import hashlib
+
+from django.db.models import Count, F, Max, Sum, Value
+from django.utils import timezone
+from django.views.decorators.http import condition
+from .models import Post, Comment, UserProfile, PostRanking
+
+# Conditional GET for the read routes. The ETag and Last-Modified headers come from ONE aggregate query (the newest `updated`
+# and the number of rows), so when the client sends If-None-Match/If-Modified-Since and nothing changed we answer 304 Not Modified
+# without running the view or the serializers at all. The posts are "touched" (updated = now) by the counters whenever their
+# likes or comments change, so the posts' `updated` covers everything that is shown in a post
+
+# The stats for each route: a dict with `last` (newest updated) and `total` (row count), or None when the view should decide (404s)
+def posts_stats(request):
+    stats = Post.objects.aggregate(last=Max('updated'), total=Count('id'))
+    if request.GET.get('sort') == 'trending': # the order changes when refresh_trending runs, the posts dont
+        refreshed = PostRanking.objects.aggregate(last=Max('refreshed'))['last']
+        stats['version'] = refreshed.isoformat() if refreshed else None # every refresh gets a new etag
+        if refreshed and (stats['last'] is None or refreshed > stats['last']):
+            stats['last'] = refreshed
+    return stats
+
+def post_stats(request, id):
+    return Post.objects.filter(pk=id).values(last=F('updated'), total=Value(1)).first()
+
+def post_comments_stats(request, id):
+    stats = Post.objects.filter(pk=id).aggregate(found=Count('id', distinct=True), last=Max('comments__updated'), total=Count('comments'))
+    return stats if stats['found'] else None
+
+def comment_replies_stats(request, id, comment_id):
+    return post_comments_stats(request, id) # the replies are comments of the post, its stats cover them
+
+def comments_stats(request):
+    return Comment.objects.aggregate(last=Max('updated'), total=Count('id'))
+
+def profiles_stats(request):
+    return UserProfile.objects.aggregate(last=Max('updated'), total=Count('id'), version=Sum('version'))
+
+def profile_stats(request, id):
+    return UserProfile.objects.filter(pk=id).values('version', last=F('updated'), total=Value(1)).first()
+
+
+# Wraps the stats function so it only runs once per request, both the etag and the last modified functions need it.
+# Last-Modified (and so If-Modified-Since) is only sent with last_modified=True, for the routes of ONE post/profile. A list
+# loses a row without its newest `updated` moving, and the row count is only in the etag, so a list is only ever answered
+# with 304 for a matching If-None-Match
+def conditional(stats_func, last_modified=False):
+    def get_stats(request, *args, **kwargs):
+        if not hasattr(request, 'conditional_stats'):
+            try:
+                request.conditional_stats = stats_func(request, *args, **kwargs)
+            except (ValueError, TypeError): # ids that are not numbers, the view sends back its normal error
+                request.conditional_stats = None
+        return request.conditional_stats
+
+    # The url (with the cursor/page size) is part of the etag, every page of a list gets its own
+    def etag(request, *args, **kwargs):
+        stats = get_stats(request, *args, **kwargs)
+        if stats is None:
+            return None
+        last = stats['last'].isoformat() if stats['last'] else ''
+        return hashlib.md5(f"{request.get_full_path()}|{last}|{stats['total']}|{stats.get('version') or ''}".encode()).hexdigest()
+
+    # Last-Modified only has whole seconds, a change later in the same second would get the same one and the client would get a
+    # 304 for the old response. So it is only sent once that second is over, until then the client has the etag
+    def get_last_modified(request, *args, **kwargs):
+        stats = get_stats(request, *args, **kwargs)
+        if not stats or not stats['last'] or stats['last'] >= timezone.now().replace(microsecond=0):
+            return None
+        return stats['last']
+
+    return condition(etag_func=etag, last_modified_func=get_last_modified if last_modified else None)
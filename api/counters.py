@@ -0,0 +1,53 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Post, Comment
+from .response_cache import bump_versions
+
+# The like_count and comment_count columns on Post are changed with F expressions, so the database does "count = count + 1"
+# in a single UPDATE. Two requests changing the same post at the same time can never overwrite each other's count.
+# The same UPDATE moves the post's `updated` on, the post shows its likes and comments so the ETag/Last-Modified has to change too
+def change_comment_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(comment_count=F('comment_count') + delta, updated=timezone.now())
+
+def change_like_count(post_ids, delta):
+    Post.objects.filter(pk__in=post_ids).update(like_count=F('like_count') + delta, updated=timezone.now())
+
+# Comment.reply_count works the same way, it is only shown in the threads so the comment's `updated` is left alone
+def change_reply_count(comment_id, delta):
+    Comment.objects.filter(pk=comment_id).update(reply_count=F('reply_count') + delta)
+
+# for the changes that dont change a count (a comment was edited, one user liked while another unliked)
+def touch_posts(post_ids):
+    Post.objects.filter(pk__in=post_ids).update(updated=timezone.now())
+
+
+# Recount the posts in ONE update statement using subqueries, this is used to fix the counts if they ever drift.
+# Only the posts whose counts are wrong are written (and touched), returns how many were fixed
+def recount_posts(queryset=None):
+    queryset = Post.objects.all() if queryset is None else queryset
+    likes = (Post.likes.through.objects.filter(post_id=OuterRef('pk'))
+        .order_by().values('post_id').annotate(total=Count('*')).values('total'))
+    comments = (Comment.objects.filter(post_id=OuterRef('pk'))
+        .order_by().values('post_id').annotate(total=Count('*')).values('total'))
+    queryset = queryset.annotate(
+        real_like_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0)),
+        real_comment_count=Coalesce(Subquery(comments, output_field=IntegerField()), Value(0)),
+    ).filter(~Q(like_count=F('real_like_count')) | ~Q(comment_count=F('real_comment_count')))
+    post_ids = list(queryset.values_list('pk', flat=True))
+    bump_versions('posts', *[f'post:{post_id}' for post_id in post_ids])
+    return Post.objects.filter(pk__in=post_ids).update(
+        like_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0)),
+        comment_count=Coalesce(Subquery(comments, output_field=IntegerField()), Value(0)),
+        updated=timezone.now(),
+    )
+
+# Same for Comment.reply_count, returns how many comments were fixed
+def recount_replies(queryset=None):
+    queryset = Comment.objects.all() if queryset is None else queryset
+    replies = (Comment.objects.filter(parent_id=OuterRef('pk'))
+        .order_by().values('parent_id').annotate(total=Count('*')).values('total'))
+    queryset = queryset.annotate(real_reply_count=Coalesce(Subquery(replies, output_field=IntegerField()), Value(0))).filter(~Q(reply_count=F('real_reply_count')))
+    comments = list(queryset.values_list('pk', 'post_id'))
+    bump_versions(*{f'post-comments:{post_id}' for _, post_id in comments})
+    return Comment.objects.filter(pk__in=[pk for pk, _ in comments]).update(reply_count=Coalesce(Subquery(replies, output_field=IntegerField()), Value(0)))
@@ -0,0 +1,73 @@
+import logging
+import math
+
+from django.db.models import FloatField, OuterRef, Subquery
+from django.db.models.functions import ASin, Cos, Power, Radians, Round, Sin, Sqrt
+from .models import UserProfile, ZipCentroid
+from .pagination import KeysetPagination
+
+logger = logging.getLogger(__name__)
+
+# The practitioner directory - the profiles filtered by martial art, belt, state and zip code, a page at a time. Every filter
+# combination of state, martial art and belt has a composite index (see UserProfile.Meta) that ends with the id, so a page is one
+# index range read. ?zip_code= reads the profiles of that zip code from the (zip5, id) index and checks the other filters on them.
+# ?near=<zip>&radius=<miles> finds the profiles around a zip code: the zip codes inside a box around its center are read with
+# the (latitude, longitude) index, the database works out their exact (haversine) distance, and the profiles of the zip codes
+# inside the circle are found with the zip5 index and sorted by it. It is all one query, no step loads more than a page of profiles
+
+FILTERS = {'martialArt': 'martialArt', 'beltLevel': 'beltLevel', 'state': 'state'} # query param -> field, matched exactly
+DEFAULT_RADIUS = 25 # miles
+MAX_RADIUS = 100 # every profile of every zip code in the circle is sorted by its distance, so it cant be any size
+EARTH_RADIUS = 3958.8 # miles
+MILES_PER_DEGREE = 69.0 # of latitude, a degree of longitude is this times cos(latitude)
+
+class DirectoryError(ValueError):
+    pass
+
+def directory_queryset(params):
+    profiles = UserProfile.objects.all()
+    for param, field in FILTERS.items():
+        if params.get(param):
+            profiles = profiles.filter(**{field: params[param]})
+    if params.get('zip_code'):
+        profiles = profiles.filter(zip5=params['zip_code'][:5])
+    if params.get('near'):
+        profiles = near(profiles, params['near'][:5], params.get('radius', DEFAULT_RADIUS))
+    return profiles
+
+# The profiles within `radius` miles of the zip code, with their `distance` in miles
+def near(profiles, zip_code, radius):
+    try:
+        radius = float(radius)
+    except (TypeError, ValueError):
+        raise DirectoryError('The radius has to be a number of miles')
+    if not 0 < radius <= MAX_RADIUS:
+        raise DirectoryError(f'The radius has to be between 0 and {MAX_RADIUS} miles')
+    center = ZipCentroid.objects.filter(zip_code=zip_code).first()
+    if center is None:
+        if not ZipCentroid.objects.exists(): # the migrations load them, so somebody emptied the table
+            logger.warning('The zip code centers are not loaded, run manage.py load_zip_centroids')
+            raise DirectoryError('Searching near a zip code is not available yet')
+        raise DirectoryError(f'Unknown zip code {zip_code}')
+
+    lat_delta = radius / MILES_PER_DEGREE
+    lon_delta = radius / (MILES_PER_DEGREE * max(math.cos(math.radians(center.latitude)), 0.01))
+    box = ZipCentroid.objects.filter(latitude__range=(center.latitude - lat_delta, center.latitude + lat_delta),
+        longitude__range=(center.longitude - lon_delta, center.longitude + lon_delta)) # the box is a bit bigger than the circle
+    circle = box.annotate(miles=haversine(center.latitude, center.longitude)).filter(miles__lte=radius)
+    # the distance of a profile is read from its own zip code's row, so the query is the same size for any number of zip codes
+    distance = Subquery(circle.filter(zip_code=OuterRef('zip5')).values('miles')[:1], output_field=FloatField())
+    return profiles.filter(zip5__in=circle.values('zip_code')).annotate(distance=Round(distance, 2))
+
+# The haversine distance in miles from (latitude, longitude) to the center of a ZipCentroid row, worked out by the database
+def haversine(latitude, longitude):
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = Radians('latitude'), Radians('longitude')
+    a = Power(Sin((lat2 - lat1) / 2), 2) + math.cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    return 2 * EARTH_RADIUS * ASin(Sqrt(a))
+
+class DirectoryPagination(KeysetPagination):
+    ordering = ('id',)
+
+class NearPagination(KeysetPagination):
+    ordering = ('distance', 'id') # closest first
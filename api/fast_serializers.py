@@ -0,0 +1,188 @@
+import hashlib
+from collections import defaultdict
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from .models import Comment
+from .serializers import PostSerializer, CommentSerializer, UserProfileSerializer
+
+# Read only fast path for the list routes. A DRF ModelSerializer builds a model instance for every row and then walks its field
+# tree for every one of them, which is most of the CPU time of getPosts/getComments/getUserProfiles. These serializers read plain
+# dicts from .values() instead and turn each row into the response with a list of small getter functions that is worked out ONCE.
+# The fields (and their order) come from the real DRF serializer, so ?fields=/?expand= and any new model field just work, and
+# the tests (SerializerParityTests) compare the output with the DRF serializers byte for byte.
+#
+# Fragment cache: the finished dict of every post (and the own fields of every comment) is also kept in the cache under
+# (id, updated). A row that changes gets a new `updated` and so a new key, nothing is ever invalidated. A list is put together
+# from ONE get_many, and only the rows that missed are loaded and serialized, so a feed where one post changed only serializes
+# that one post. The posts' `updated` moves on whenever their likes or comments change (see counters.py), so a post fragment
+# can hold its likes and whole comment tree
+class FastSerializer:
+    serializer_class = None
+    fragment_name = None # set to cache the rows as fragments
+    # DRF fields whose value from .values() is already exactly what the serializer would send
+    plain_fields = (serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.PrimaryKeyRelatedField)
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        serializer = self.serializer_class(context=self.context)
+        self.model = serializer.Meta.model
+        self.columns = ['id'] # the columns for .values(), the id is always needed to find the related rows
+        self.many_to_many = [] # (field name, model field) of the many to many fields that are sent
+        self.getters = []
+        self.method_fields = set()
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.getters.append((name, self.getter(name, field)))
+
+        self.use_fragments = bool(self.fragment_name and settings.FRAGMENT_CACHE_SECONDS)
+        if self.use_fragments:
+            self.columns += [] if 'updated' in self.columns else ['updated'] # the fragment key is (id, updated)
+            signature = hashlib.md5(','.join(name for name, _ in self.getters).encode()).hexdigest()[:8] # ?fields= gives other fragments
+            self.fragment_prefix = f'fragment:{self.fragment_name}:{signature}:'
+
+    def getter(self, name, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            self.method_fields.add(name)
+            return getattr(self, 'get_' + name) # the subclass builds these from the related rows it loaded
+        if isinstance(field, serializers.ManyRelatedField):
+            self.many_to_many.append((field.source, self.model._meta.get_field(field.source)))
+            return lambda row, source=field.source: self.related[source].get(row['id'], [])
+
+        self.columns.append(field.source)
+        if isinstance(field, self.plain_fields):
+            return itemgetter(field.source)
+        if isinstance(field, serializers.FileField): # the same url FieldFile.url would give (or the name, like DRF's FileField)
+            storage = self.model._meta.get_field(field.source).storage
+            use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+            request = self.context.get('request')
+            def file_url(row, source=field.source):
+                if not row[source]:
+                    return None
+                if not use_url:
+                    return row[source]
+                url = storage.url(row[source])
+                return request.build_absolute_uri(url) if request is not None else url
+            return file_url
+        convert = field.to_representation # e.g. datetimes, formatted the same way DRF does it
+        return lambda row, source=field.source: None if row[source] is None else convert(row[source])
+
+    # the queryset for the rows, `keep` are extra columns that are needed but not sent (like the pagination cursor columns)
+    def queryset(self, queryset, keep=()):
+        return queryset.values(*dict.fromkeys(self.columns + [name.lstrip('-') for name in keep]))
+
+    def serialize(self, rows):
+        rows = list(rows)
+        data = self.fragments(rows, self.build)
+        return [data[row['id']] for row in rows]
+
+    def build(self, rows):
+        self.load_related(rows)
+        return {row['id']: self.to_representation(row) for row in rows}
+
+    def to_representation(self, row):
+        return {name: get(row) for name, get in self.getters}
+
+    # id -> dict for every row, from the fragment cache where we can. `build` makes the dicts of the rows that missed
+    def fragments(self, rows, build):
+        if not self.use_fragments:
+            return build(rows)
+        keys = {row['id']: f"{self.fragment_prefix}{row['id']}:{row['updated'].isoformat()}" for row in rows}
+        cached = cache.get_many(list(keys.values()))
+        misses = [row for row in rows if keys[row['id']] not in cached]
+        fresh = build(misses) if misses else {}
+        if fresh:
+            cache.set_many({keys[id]: data for id, data in fresh.items()}, settings.FRAGMENT_CACHE_SECONDS)
+        return {id: fresh[id] if id in fresh else cached[key] for id, key in keys.items()}
+
+    # One query per many to many field for all the rows, e.g. post id -> the ids of the users that liked it
+    def load_related(self, rows):
+        ids = [row['id'] for row in rows]
+        self.related = {}
+        for source, model_field in self.many_to_many:
+            related_ids = defaultdict(list)
+            lookup = model_field.related_query_name()
+            for owner_id, related_id in model_field.related_model.objects.filter(**{lookup + '__in': ids}).values_list(lookup, 'pk'):
+                related_ids[owner_id].append(related_id)
+            self.related[source] = related_ids
+
+
+class FastCommentSerializer(FastSerializer):
+    serializer_class = CommentSerializer
+    fragment_name = 'comment'
+    # The replies of a comment can change without the comment's `updated` changing, so a comment fragment only holds its own
+    # fields and the replies are put in from the comment tree. The tree itself only needs these few columns
+    tree_columns = ['id', 'post', 'parent', 'created', 'updated']
+
+    def __init__(self, context=None):
+        super().__init__(context)
+        self.columns += [name for name in ('post', 'parent') if name not in self.columns] # needed to build the comment tree
+
+    def queryset(self, queryset, keep=()):
+        if not self.use_fragments:
+            return super().queryset(queryset, keep)
+        return queryset.values(*dict.fromkeys(self.tree_columns + [name.lstrip('-') for name in keep])) # the rest comes from the fragments
+
+    # Load every comment of the given posts in one query, like CommentTree does, and keep the rows by post and by parent
+    def load_tree(self, post_ids):
+        rows = list(self.queryset(Comment.objects.filter(post_id__in=list(post_ids))))
+        self.set_tree(rows, self.fragments(rows, self.build_own_fields))
+
+    # rows need the id, post and parent, own_fields is comment id -> the comment's fields without its replies
+    def set_tree(self, rows, own_fields):
+        self.post_comments = defaultdict(list)
+        self.replies = defaultdict(list)
+        self.done = {} # comment id -> its finished dict, a reply shows up both in the post's list and under its parent
+        for row in rows:
+            self.post_comments[row['post']].append(row)
+            if row['parent'] is not None:
+                self.replies[row['parent']].append(row)
+        self.own_fields = own_fields
+
+    def build_own_fields(self, rows):
+        if self.use_fragments: # the tree rows only have the tree columns
+            rows = FastSerializer.queryset(self, Comment.objects.filter(id__in=[row['id'] for row in rows]).order_by())
+        rows = list(rows)
+        self.load_related(rows)
+        return {row['id']: {name: get(row) for name, get in self.getters if name not in self.method_fields} for row in rows}
+
+    def to_representation(self, row):
+        data = self.done.get(row['id'])
+        if data is None:
+            own_fields = self.own_fields[row['id']]
+            data = self.done[row['id']] = {name: get(row) if name in self.method_fields else own_fields[name] for name, get in self.getters}
+        return data
+
+    def get_replies(self, row):
+        return [self.to_representation(reply) for reply in self.replies.get(row['id'], [])]
+
+    def comments_for_post(self, post_id):
+        return [self.to_representation(row) for row in self.post_comments.get(post_id, [])]
+
+    # a page of comments, the replies come from the comments of the posts on this page (same as CommentTree.for_comments)
+    def serialize(self, rows):
+        rows = list(rows)
+        self.load_tree({row['post'] for row in rows})
+        return [self.to_representation(row) for row in rows]
+
+
+class FastPostSerializer(FastSerializer):
+    serializer_class = PostSerializer
+    fragment_name = 'post'
+
+    def load_related(self, rows):
+        super().load_related(rows)
+        if any(name == 'comments' for name, _ in self.getters): # the comment tree is only loaded when comments are sent
+            self.comments = FastCommentSerializer(self.context)
+            self.comments.load_tree(row['id'] for row in rows)
+
+    def get_comments(self, row):
+        return self.comments.comments_for_post(row['id'])
+
+
+class FastUserProfileSerializer(FastSerializer):
+    serializer_class = UserProfileSerializer
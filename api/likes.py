@@ -0,0 +1,114 @@
+import atexit
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from .models import LikeIntent, Post
+from .counters import change_like_count, touch_posts
+from .response_cache import bump_versions, post_scopes
+
+# Likes on a hot post would mean lots of tiny INSERTs/DELETEs fighting over the same rows, so instead the like/unlike views only
+# record what the user wants as a LikeIntent row. Every LIKE_BUFFER_SECONDS the buffer is flushed: all the likes for a post are written
+# with one bulk_create, all the unlikes with one delete, and the like_count is changed once by the total difference.
+# The intents are in the database and not in this process, so they survive the worker being killed (the next flush of any worker
+# writes them) and they are applied in the order they came in even when different workers took the requests
+class LikeBuffer:
+    def __init__(self, window=None, max_pending=None, auto_flush=True):
+        self.window = settings.LIKE_BUFFER_SECONDS if window is None else window
+        self.max_pending = settings.LIKE_BUFFER_MAX_PENDING if max_pending is None else max_pending
+        self.auto_flush = auto_flush # when False nothing is written until flush() is called (used by the benchmark)
+        self.lock = threading.Lock()
+        self.recorded = 0 # intents recorded by this process since its last flush, a full buffer is flushed right away
+        self.timer = None
+
+    def record(self, post_id, user_id, liked):
+        LikeIntent.objects.create(post_id=post_id, user_id=user_id, liked=liked)
+        with self.lock:
+            self.recorded += 1
+            full = self.recorded >= self.max_pending
+            if self.auto_flush and not full and self.timer is None: # the first write after a flush starts the countdown
+                self.timer = threading.Timer(self.window, self.flush_in_background)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def reset(self):
+        with self.lock:
+            self.recorded = 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    # writes every waiting intent (also the ones other workers recorded), max_pending of them per transaction
+    def flush(self):
+        self.reset()
+        flushed = 0
+        while True:
+            count = flush_intents(self.max_pending)
+            flushed += count
+            if count < self.max_pending:
+                return flushed
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print("Error flushing the buffered likes:", str(e))
+        finally:
+            connection.close() # the timer thread has its own database connection, so we close it when we are done
+
+    def flush_at_exit(self):
+        if self.recorded: # only when this worker recorded something since its last flush
+            self.flush_in_background()
+
+
+# Take the oldest intents off the queue and write them. The rows are locked in id order without skip_locked, so a second
+# worker flushing at the same time waits for this one and then gets the later intents, never an older intent after a newer one.
+# The intents are deleted in the same transaction they are written in, so a flush that dies halfway is simply done again
+def flush_intents(limit):
+    with transaction.atomic():
+        rows = list(LikeIntent.objects.select_for_update().order_by('id').values_list('id', 'post_id', 'user_id', 'liked')[:limit])
+        if not rows:
+            return 0
+        by_post = defaultdict(dict)
+        for _, post_id, user_id, liked in rows: # in id order, so only the latest one per user is left
+            by_post[post_id][user_id] = liked
+        for post_id, intents in by_post.items():
+            flush_post_likes(post_id, intents)
+        LikeIntent.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+# Write the buffered likes/unlikes of ONE post. The post row is locked so two workers flushing the same post take turns,
+# which keeps the like_count delta exact
+def flush_post_likes(post_id, intents):
+    Like = Post.likes.through
+    with transaction.atomic():
+        if not Post.objects.select_for_update().filter(pk=post_id).values_list('pk', flat=True):
+            return 0 # the post was deleted before the flush
+
+        existing = set(Like.objects.filter(post_id=post_id, user_id__in=list(intents)).values_list('user_id', flat=True))
+        to_remove = [user_id for user_id, liked in intents.items() if not liked and user_id in existing]
+        to_add = [user_id for user_id, liked in intents.items() if liked and user_id not in existing]
+        if to_add: # skip any user that was deleted in the meantime
+            to_add = list(User.objects.filter(pk__in=to_add).values_list('pk', flat=True))
+
+        Like.objects.bulk_create([Like(post_id=post_id, user_id=user_id) for user_id in to_add], ignore_conflicts=True)
+        if to_remove:
+            Like.objects.filter(post_id=post_id, user_id__in=to_remove).delete()
+
+        delta = len(to_add) - len(to_remove)
+        if delta:
+            change_like_count([post_id], delta)
+        elif to_add or to_remove:
+            touch_posts([post_id])
+        if to_add or to_remove: # one user liking and another unliking is a delta of 0, but the likes list still changed
+            bump_versions(*post_scopes(post_id))
+        return delta
+
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.flush_at_exit) # write whatever is left when the worker shuts down
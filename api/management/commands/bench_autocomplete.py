@@ -0,0 +1,49 @@
+import random
+import string
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.autocomplete import UsernameIndex
+
+# python manage.py bench_autocomplete - creates --users users, builds the username index from them and measures the p50/p95
+# of a lookup for prefixes of 1 to 4 letters (what the client sends while someone types), next to the istartswith query it
+# replaces. Everything runs inside a transaction that is rolled back at the end
+class Command(BaseCommand):
+    help = 'Benchmark username autocomplete latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--limit', type=int, default=10)
+
+    def handle(self, *args, **options):
+        names = random.Random(1)
+        with transaction.atomic():
+            existing = User.objects.count()
+            usernames = {''.join(names.choices(string.ascii_lowercase + string.digits, k=names.randint(5, 12))) for _ in range(options['users'])}
+            User.objects.bulk_create([User(username=f'{name}{existing}', password='!') for name in usernames], batch_size=5000)
+
+            index = UsernameIndex(rebuild_seconds=float('inf'))
+            start = time.perf_counter()
+            size = index.build()
+            self.stdout.write(f'built the index of {size} names in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+            prefixes = [''.join(names.choices(string.ascii_lowercase, k=names.randint(1, 4))) for _ in range(options['queries'])]
+            self.report('index', [self.time(index.search, prefix, options['limit']) for prefix in prefixes])
+            self.report('database', [self.time(self.query, prefix, options['limit']) for prefix in prefixes[:200]])
+            transaction.set_rollback(True)
+
+    def query(self, prefix, limit):
+        return list(User.objects.filter(username__istartswith=prefix).order_by('username').values_list('username', flat=True)[:limit])
+
+    def time(self, search, prefix, limit):
+        start = time.perf_counter()
+        search(prefix, limit)
+        return time.perf_counter() - start
+
+    def report(self, name, timings):
+        timings.sort()
+        p50, p95 = timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+        self.stdout.write(f'{name}: p50 {p50 * 1000:.3f} ms, p95 {p95 * 1000:.3f} ms')
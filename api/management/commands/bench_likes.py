@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.likes import LikeBuffer
+from api.models import Post
+
+# python manage.py bench_likes - measures how many likes per second ONE post can take through the like buffer. Recording a like is
+# the INSERT of its intent row (what the view waits for), the flush is the write into the likes table and the like_count. Both are timed
+# Everything runs inside a transaction that is rolled back at the end, so the benchmark never leaves any rows behind
+class Command(BaseCommand):
+    help = 'Benchmark sustained likes/sec on a single post through the like buffer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000, help='How many different users like the post')
+        parser.add_argument('--seconds', type=float, default=5.0, help='How long to keep liking for')
+        parser.add_argument('--window', type=float, default=0.5, help='Seconds between buffer flushes')
+        parser.add_argument('--compare', action='store_true', help='Also time one post.likes.add()/remove() per like without the buffer')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            User.objects.bulk_create([User(username=f'bench-like-{i}') for i in range(options['users'])])
+            user_ids = list(User.objects.filter(username__startswith='bench-like-').values_list('id', flat=True))
+            post = Post.objects.create(title='bench', upload='uploads/bench.mp4')
+
+            self.report('buffered', *self.run_buffered(post, user_ids, options['seconds'], options['window']))
+            post.refresh_from_db()
+            self.stdout.write(f'  like_count={post.like_count} rows={post.likes.count()}')
+            if options['compare']:
+                self.report('unbuffered', *self.run_unbuffered(post, user_ids, options['seconds']))
+
+            transaction.set_rollback(True)
+
+    # users keep liking and unliking the post as fast as we can record it, the buffer is flushed every window seconds
+    def run_buffered(self, post, user_ids, seconds, window):
+        buffer = LikeBuffer(window=window, max_pending=len(user_ids) * 2, auto_flush=False)
+        likes = flushes = written = 0
+        flush_time = 0.0
+        start = last_flush = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for user_id in user_ids[:1000]:
+                buffer.record(post.id, user_id, (likes // len(user_ids)) % 2 == 0)
+                likes += 1
+            user_ids = user_ids[1000:] + user_ids[:1000]
+            if time.perf_counter() - last_flush >= window:
+                flush_start = time.perf_counter()
+                written += buffer.flush()
+                last_flush = time.perf_counter()
+                flush_time += last_flush - flush_start
+                flushes += 1
+        flush_start = time.perf_counter()
+        written += buffer.flush()
+        flush_time += time.perf_counter() - flush_start
+        flushes += 1
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'  recording: {likes / (elapsed - flush_time):,.0f} intents/sec inserted into the queue')
+        self.stdout.write(f'  flushing: {written} intents written in {flush_time:.2f}s = {written / flush_time:,.0f} intents/sec into the likes table')
+        return likes, elapsed, flushes, flush_time
+
+    def run_unbuffered(self, post, user_ids, seconds):
+        likes = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            user_id = user_ids[likes % len(user_ids)]
+            if (likes // len(user_ids)) % 2 == 0:
+                post.likes.add(user_id)
+            else:
+                post.likes.remove(user_id)
+            likes += 1
+        return likes, time.perf_counter() - start, likes, time.perf_counter() - start
+
+    def report(self, name, likes, elapsed, flushes, flush_time):
+        self.stdout.write(f'{name}: {likes} likes in {elapsed:.2f}s = {likes / elapsed:,.0f} likes/sec, '
+            f'{flushes} writes taking {flush_time * 1000 / max(flushes, 1):.1f} ms each')
@@ -0,0 +1,64 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from api.compression import brotli, compress
+from api.fast_serializers import FastPostSerializer
+from api.models import Post, Comment
+from api.renderers import FastJSONRenderer, orjson
+
+# python manage.py bench_renderer - builds a feed page like getPosts sends it (posts with their likes and nested comments) and
+# measures 1) how long DRF's JSONRenderer and FastJSONRenderer take to encode it and 2) how many bytes go over the wire raw,
+# gzipped and with brotli. Everything runs inside a transaction that is rolled back at the end, so no rows are left behind
+class Command(BaseCommand):
+    help = 'Benchmark json encode time and compressed sizes on a representative feed payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, nargs='+', default=[20, 100], help='Posts per feed page')
+        parser.add_argument('--comments', type=int, default=15, help='Comments per post (every third one is a reply)')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed, FastJSONRenderer falls back to the json module'))
+        with transaction.atomic():
+            users = User.objects.bulk_create([User(username=f'bench-renderer-{i}') for i in range(10)])
+            for page_size in options['posts']:
+                data = self.feed_page(page_size, options['comments'], users)
+                drf_body, drf_time = self.time_render(JSONRenderer(), data, options['repeat'])
+                fast_body, fast_time = self.time_render(FastJSONRenderer(), data, options['repeat'])
+                if drf_body != fast_body:
+                    raise CommandError('FastJSONRenderer did not give the same bytes as JSONRenderer')
+
+                self.stdout.write(f'{page_size} posts x {options["comments"]} comments ({len(drf_body):,} bytes of json):')
+                self.stdout.write(f'  encode: JSONRenderer {drf_time * 1000:.2f} ms, FastJSONRenderer {fast_time * 1000:.2f} ms ({drf_time / fast_time:.1f}x)')
+                for encoding in ('gzip', 'br') if brotli is not None else ('gzip',):
+                    start = time.perf_counter()
+                    compressed = compress(drf_body, encoding)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f'  {encoding}: {len(compressed):,} bytes on the wire ({len(compressed) / len(drf_body):.1%}), {elapsed * 1000:.2f} ms to compress')
+            if brotli is None:
+                self.stdout.write('brotli is not installed, only gzip was measured')
+            transaction.set_rollback(True)
+
+    def feed_page(self, page_size, comments_per_post, users):
+        posts = Post.objects.bulk_create([
+            Post(title=f'bench-renderer-{i}', category='Kicks, Forms', postDesc='Working on my spinning hook kick, any tips? ' * 3,
+                upload=f'https://x.blob.core.windows.net/c/uploads/bench-{i}.mp4', username=users[i % len(users)].username, userId=users[i % len(users)])
+            for i in range(page_size)])
+        Post.likes.through.objects.bulk_create([Post.likes.through(post_id=post.id, user_id=user.id) for i, post in enumerate(posts) for user in users[:i % len(users)]])
+        for post in posts:
+            parent = None
+            for j in range(comments_per_post):
+                parent = Comment.objects.create(post=post, parent=parent if j % 3 == 2 else None, commentDesc=f'Great form! Keep your guard up {j}',
+                    userId=users[j % len(users)], username=users[j % len(users)].username)
+        serializer = FastPostSerializer()
+        return serializer.serialize(serializer.queryset(Post.objects.filter(id__in=[post.id for post in posts]).order_by('created', 'id')))
+
+    def time_render(self, renderer, data, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            body = renderer.render(data)
+        return body, (time.perf_counter() - start) / repeat
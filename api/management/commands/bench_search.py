@@ -0,0 +1,48 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.fast_serializers import FastPostSerializer
+from api.models import Post
+from api.search import SearchPagination, search_posts
+
+# python manage.py bench_search - measures the latency of the search (one page of results, serialized like searchPosts does it)
+# at every --posts size, to check it stays flat as the number of posts grows. The posts are made of words from a vocabulary
+# that grows with them (like real text, most words are rare), so a search matches about the same number of posts at every
+# size. Ranking has to look at every match, a word that is in half of all posts gets slower with them on any database.
+# Everything runs inside a transaction that is rolled back at the end, the search index triggers roll back with it
+class Command(BaseCommand):
+    help = 'Benchmark p50/p95 full text search latency at growing post counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--page', type=int, default=20)
+
+    def handle(self, *args, **options):
+        words = random.Random(1)
+        with transaction.atomic():
+            for size in sorted(options['posts']):
+                self.create_posts(size, words)
+                queries = [' '.join(f'w{words.randrange(size)}' for _ in range(words.choice((1, 2)))) for _ in range(options['queries'])]
+                timings = sorted(self.time_search(text, options['page']) for text in queries)
+                p50, p95 = timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+                self.stdout.write(f'{size} posts: p50 {p50 * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms')
+            transaction.set_rollback(True)
+
+    def create_posts(self, size, words):
+        existing = Post.objects.filter(title__startswith='bench-search').count()
+        def text(count):
+            return ' '.join(f'w{words.randrange(size)}' for _ in range(count))
+        Post.objects.bulk_create([
+            Post(title=f'bench-search {text(3)}', category=text(2), postDesc=text(20), upload='uploads/bench.mp4')
+            for _ in range(existing, size)], batch_size=5000)
+
+    def time_search(self, text, page_size):
+        start = time.perf_counter()
+        paginator = SearchPagination()
+        serializer = FastPostSerializer({'fields': {'id', 'title', 'category'}})
+        queryset = serializer.queryset(search_posts(text), keep=paginator.ordering).order_by(*paginator.ordering)
+        serializer.serialize(queryset[:page_size])
+        return time.perf_counter() - start
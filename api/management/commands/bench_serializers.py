@@ -0,0 +1,97 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from api.comment_tree import CommentTree
+from api.counters import touch_posts
+from api.fast_serializers import FastPostSerializer, FastCommentSerializer, FastUserProfileSerializer
+from api.models import Post, Comment, UserProfile
+from api.serializers import PostSerializer, CommentSerializer, UserProfileSerializer
+
+# python manage.py bench_serializers - measures rows/sec for the DRF serializers and the fast .values() serializers at every
+# --rows size (1k, 10k and 100k by default), that both send the same json is checked by "manage.py test api".
+# The rows are serialized one page (--page rows) at a time, the same way the list routes do it, queries included. The fast path is timed three times: with an
+# empty fragment cache, with every row in it, and after 1% of the rows changed.
+# Everything runs inside a transaction that is rolled back at the end, so the benchmark never leaves any rows behind
+class Command(BaseCommand):
+    help = 'Benchmark rows/sec of the fast list serializers against the DRF serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='Posts/comments/profiles to benchmark with')
+        parser.add_argument('--page', type=int, default=100, help='Rows serialized per call, like one page of a list route')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = User.objects.bulk_create([User(username=f'bench-serializer-{i}') for i in range(5)])
+            for size in sorted(options['rows']):
+                self.create_rows(size, users)
+                self.stdout.write(f'{size} rows:')
+                for label, drf, fast, rows in self.resources():
+                    ids = list(rows.values_list('id', flat=True))
+                    pages = [ids[start:start + options['page']] for start in range(0, len(ids), options['page'])]
+                    drf_rate = self.rows_per_second(pages, drf)
+                    self.touch(rows)
+                    cold_rate = self.rows_per_second(pages, fast)
+                    warm_rate = self.rows_per_second(pages, fast)
+                    self.touch(rows.filter(id__in=ids[::100]))
+                    changed_rate = self.rows_per_second(pages, fast)
+                    self.stdout.write(f'  {label}: DRF {drf_rate:,.0f} rows/sec, fast path {cold_rate:,.0f} rows/sec ({cold_rate / drf_rate:.1f}x)')
+                    self.stdout.write(f'    fragment cache: all cached {warm_rate:,.0f} rows/sec ({warm_rate / drf_rate:.1f}x), 1% changed {changed_rate:,.0f} rows/sec ({changed_rate / drf_rate:.1f}x)')
+            transaction.set_rollback(True)
+
+    # Adds rows until there are `size` bench posts, comments and profiles. Every other comment is a reply, every post has 0-4 likes
+    def create_rows(self, size, users):
+        existing = Post.objects.filter(title__startswith='bench-').count()
+        posts = Post.objects.bulk_create([
+            Post(title=f'bench-{i}', category='Kicks, Forms', postDesc='Bench post é', upload=f'https://x.blob.core.windows.net/c/uploads/bench-{i}.mp4' if i % 10 else '',
+                username='bench', userId=users[i % len(users)], like_count=i % 5, comment_count=2)
+            for i in range(existing, size)])
+        if not posts:
+            return
+        Post.likes.through.objects.bulk_create([Post.likes.through(post_id=post.id, user_id=user.id) for i, post in enumerate(posts) for user in users[:i % 5]])
+        comments = Comment.objects.bulk_create([Comment(post=post, commentDesc=f'bench comment {post.id}', userId=users[0], username='bench') for post in posts[:(len(posts) + 1) // 2]])
+        Comment.objects.bulk_create([Comment(post=comment.post, parent=comment, commentDesc='bench reply', userId=users[1], username='bench', checked=False) for comment in comments[:len(posts) // 2]])
+        UserProfile.objects.bulk_create([
+            UserProfile(username=f'bench-{i}', first_name=None if i % 3 else 'First', picture=f'https://x.blob.core.windows.net/c/pictures/bench-{i}.png', state='NY', zip_code='10001')
+            for i in range(existing, size)])
+
+    # (label, drf serializer, fast serializer, the bench rows in page order) - each serializer takes a page of ids and a context
+    def resources(self):
+        def drf_posts(ids, context):
+            posts = PostSerializer.sparse_queryset(Post.objects.filter(id__in=ids).order_by('created', 'id'), context)
+            return PostSerializer(posts, many=True, context=context).data
+        def fast_posts(ids, context):
+            serializer = FastPostSerializer(context)
+            return serializer.serialize(serializer.queryset(Post.objects.filter(id__in=ids).order_by('created', 'id')))
+        def drf_comments(ids, context):
+            comments = list(Comment.objects.filter(id__in=ids).order_by('created', 'id'))
+            return CommentSerializer(comments, many=True, context={'comment_tree': CommentTree.for_comments(comments)}).data
+        def fast_comments(ids, context):
+            serializer = FastCommentSerializer()
+            return serializer.serialize(serializer.queryset(Comment.objects.filter(id__in=ids).order_by('created', 'id')))
+        def drf_profiles(ids, context):
+            return UserProfileSerializer(UserProfileSerializer.sparse_queryset(UserProfile.objects.filter(id__in=ids).order_by('id'), context), many=True, context=context).data
+        def fast_profiles(ids, context):
+            serializer = FastUserProfileSerializer(context)
+            return serializer.serialize(serializer.queryset(UserProfile.objects.filter(id__in=ids).order_by('id')))
+        return [
+            ('getPosts', drf_posts, fast_posts, Post.objects.filter(title__startswith='bench-').order_by('created', 'id')),
+            ('getComments', drf_comments, fast_comments, Comment.objects.filter(post__title__startswith='bench-').order_by('created', 'id')),
+            ('getUserProfiles', drf_profiles, fast_profiles, UserProfile.objects.filter(username__startswith='bench-').order_by('id')),
+        ]
+
+    # new `updated` on the rows, so their fragments are not in the cache anymore (like a post that got a like).
+    # Touched comments touch their posts too, the same as the post_save signal of an edited comment
+    def touch(self, rows):
+        rows.model.objects.filter(id__in=rows.values('id')).update(updated=timezone.now())
+        if rows.model is Comment:
+            touch_posts(rows.values('post'))
+
+    def rows_per_second(self, pages, serialize):
+        start = time.perf_counter()
+        for page in pages:
+            JSONRenderer().render(serialize(page, {}))
+        return sum(map(len, pages)) / (time.perf_counter() - start)
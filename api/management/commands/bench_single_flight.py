@@ -0,0 +1,83 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.models import Post, Comment
+from api.response_cache import bump_now, get_stats, reset_stats
+
+# python manage.py bench_single_flight - a small load test for the single flight routes. --clients threads ask for the same
+# post (getPost) or its comments (getPostComments) at the same moment, right after the cached entry went away, and we count
+# how many times the view ran and how many database queries that took. The queries every request runs anyway (the user of
+# the JWT and the ETag/Last-Modified query of conditional.py) are measured on a cache hit first and not counted. While the
+# view runs the other clients get the previous response, the ones that come after it finished get the new one.
+# The threads need committed rows, so the bench user and post are created for real and deleted again at the end.
+# The threads share this process's cache, so the response cache is turned on for the bench even when it is off by default
+class Command(BaseCommand):
+    help = 'Load test the single flight cache: DB work per cache expiry under concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent requests per expiry')
+        parser.add_argument('--expiries', type=int, default=3, help='How many times the cached entry goes away')
+        parser.add_argument('--comments', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with override_settings(RESPONSE_CACHE_SECONDS=settings.RESPONSE_CACHE_SECONDS or 5 * 60):
+            self.run(options)
+
+    def run(self, options):
+        user = User.objects.create(username='bench-single-flight')
+        post = Post.objects.create(title='bench-single-flight', upload='uploads/bench.mp4', username=user.username, userId=user)
+        try:
+            parent = None
+            for i in range(options['comments']):
+                parent = Comment.objects.create(post=post, parent=parent if i % 3 else None, commentDesc=f'bench {i}', userId=user, username=user.username)
+            token = str(RefreshToken.for_user(user).access_token)
+            for view, url in (('getPost', f'/api/posts/{post.id}'), ('getPostComments', f'/api/posts/{post.id}/comments/')):
+                self.burst(url, token, 1)
+                _, per_request = self.burst(url, token, 1) # a cache hit: the user lookup of the JWT auth and the ETag query
+                self.stdout.write(f'{view}, {options["clients"]} clients ({per_request} queries for every request, even a cache hit):')
+                for expiry in range(options['expiries']):
+                    bump_now(f'post:{post.id}', f'post-comments:{post.id}') # the cached entry is gone, like after its timeout or a write
+                    reset_stats([view])
+                    statuses, queries = self.burst(url, token, options['clients'])
+                    if statuses != {200}:
+                        raise CommandError(f'{url} answered with {statuses}')
+                    stats = get_stats([view])[view]
+                    rebuild_queries = queries - options['clients'] * per_request
+                    self.stdout.write(f'  expiry {expiry + 1}: the view ran {stats["misses"]} time(s) with {rebuild_queries} queries, '
+                        f'{stats["stale"]} clients got the previous response, {stats["hits"]} got the new one from the cache')
+        finally:
+            post.delete()
+            user.delete()
+
+    # every client sends one request at the same moment, returns the status codes and the number of queries they ran
+    def burst(self, url, token, clients):
+        barrier = threading.Barrier(clients)
+        statuses, queries = set(), []
+        lock = threading.Lock()
+
+        def count_query(execute, sql, params, many, context):
+            with lock:
+                queries.append(sql)
+            return execute(sql, params, many, context)
+
+        def client():
+            try:
+                with connection.execute_wrapper(count_query):
+                    barrier.wait()
+                    response = Client(HTTP_AUTHORIZATION=f'Bearer {token}').get(url)
+                with lock:
+                    statuses.add(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses, len(queries)
@@ -0,0 +1,93 @@
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from azure.storage.blob import BlobServiceClient
+from django.core.management.base import BaseCommand
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from api.storage import build_container_client, upload_in_blocks
+
+# The well known development account that Azurite (the local azure storage emulator) uses
+AZURITE_ACCOUNT = 'devstoreaccount1'
+AZURITE_KEY = 'Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=='
+
+
+# A tiny stand-in for Azurite, it answers every blob lookup with "not found", accepts (and throws away) every block upload after
+# `latency` seconds like a far away server would, and counts how many connections were opened
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, just like azure
+    connections = 0
+    latency = 0.0
+
+    def setup(self):
+        super().setup()
+        StandInHandler.connections += 1
+
+    def do_HEAD(self):
+        self.send_response(404)
+        self.send_header('x-ms-error-code', 'BlobNotFound')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(StandInHandler.latency)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+# python manage.py bench_storage - compares building a new BlobServiceClient per request (the old views) with the shared pooled client
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of creating a blob client vs reusing the pooled one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--connection-string', help='Run against a real Azurite/Azure instead of the built in stand-in')
+        parser.add_argument('--container', default='bench')
+        parser.add_argument('--upload-mb', type=int, default=0, help='Also time uploading a file this big in blocks, with 1 block at a time vs --concurrency')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--latency-ms', type=float, default=100, help='How long the stand-in takes to answer each block upload')
+
+    def handle(self, *args, **options):
+        server = None
+        connection_string = options['connection_string']
+        if not connection_string:
+            server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            connection_string = (f'DefaultEndpointsProtocol=http;AccountName={AZURITE_ACCOUNT};AccountKey={AZURITE_KEY};'
+                f'BlobEndpoint=http://127.0.0.1:{server.server_port}/{AZURITE_ACCOUNT};')
+
+        def per_request(name):
+            container_client = BlobServiceClient.from_connection_string(connection_string).get_container_client(options['container'])
+            return container_client.get_blob_client(name).exists()
+
+        pooled_client = build_container_client(connection_string, options['container'])
+        def pooled(name):
+            return pooled_client.get_blob_client(name).exists()
+
+        try:
+            for label, lookup in (('new client per request', per_request), ('pooled client', pooled)):
+                StandInHandler.connections = 0
+                start = time.perf_counter()
+                for i in range(options['requests']):
+                    lookup(f'uploads/bench-{i}.mp4')
+                elapsed = time.perf_counter() - start
+                connections = f', {StandInHandler.connections} connections opened' if server else ''
+                self.stdout.write(f'{label}: {elapsed * 1000 / options["requests"]:.2f} ms per request{connections}')
+
+            if options['upload_mb']:
+                StandInHandler.latency = options['latency_ms'] / 1000 if server else 0.0
+                data = b'\0' * options['upload_mb'] * 1024 * 1024
+                for concurrency in (1, options['concurrency']):
+                    file = InMemoryUploadedFile(io.BytesIO(data), 'upload', 'bench.mp4', 'video/mp4', len(data), None)
+                    start = time.perf_counter()
+                    upload_in_blocks(pooled_client.get_blob_client('uploads/bench.mp4'), file, concurrency=concurrency)
+                    self.stdout.write(f'{options["upload_mb"]} MB upload with {concurrency} block(s) at a time: {time.perf_counter() - start:.2f}s')
+        finally:
+            if server:
+                server.shutdown()
@@ -0,0 +1,26 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from api.comment_tree_cache import TREE_PREFIX, build_tree
+from api.models import Post
+
+# python manage.py check_comment_trees - compares the cached (patched) comment tree of every post with a tree built fresh
+# from the database. A tree that differs is deleted, so the next read of that post's comments builds it again
+class Command(BaseCommand):
+    help = 'Check the cached comment trees against the database and drop the ones that differ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='posts', help='Only check these post ids (can be repeated)')
+
+    def handle(self, *args, **options):
+        post_ids = options['posts'] or list(Post.objects.values_list('id', flat=True))
+        checked = wrong = 0
+        for post_id in post_ids:
+            cached = cache.get(TREE_PREFIX + str(post_id))
+            if cached is None:
+                continue
+            checked += 1
+            if cached != build_tree(post_id):
+                wrong += 1
+                cache.delete(TREE_PREFIX + str(post_id))
+                self.stdout.write(self.style.WARNING(f'The cached comment tree of post {post_id} was wrong, it was deleted'))
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} cached comment trees, {wrong} were wrong'))
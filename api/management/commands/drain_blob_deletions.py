@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from api.blob_deletions import drain_blob_deletions
+
+# python manage.py drain_blob_deletions - deletes the queued blobs from azure in batches. With --loop it keeps running
+# (this can be a worker dyno), otherwise it empties whatever is due right now and stops (this can be a scheduled job)
+class Command(BaseCommand):
+    help = 'Delete the blobs waiting in the blob deletion queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Blobs per batch call (at most 256)')
+        parser.add_argument('--loop', action='store_true', help='Keep running and check the queue again every --sleep seconds')
+        parser.add_argument('--sleep', type=float, default=10.0)
+        parser.add_argument('--no-batch', action='store_true', help='Delete one blob per call, for storage emulators without batch support')
+
+    def handle(self, *args, **options):
+        total_deleted = total_failed = 0
+        while True:
+            deleted, failed = drain_blob_deletions(options['batch_size'], batch_delete=not options['no_batch'])
+            total_deleted += deleted
+            total_failed += failed
+            if deleted or failed:
+                continue # there might be more due right away
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total_deleted} blobs, {total_failed} failed and will be retried'))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from api.blob_deletions import queue_blob_deletion
+from api.models import FinishedUpload, UploadSession
+
+# python manage.py expire_upload_sessions - run this every so often (e.g. with the heroku scheduler) to remove the upload
+# sessions that were never finished, the half uploaded blob of each one goes into the blob deletion queue. It also forgets the
+# finished direct uploads whose tokens have expired, those tokens are refused by their age anyway
+class Command(BaseCommand):
+    help = 'Delete expired resumable upload sessions and their partial blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        removed = 0
+        while True:
+            sessions = list(UploadSession.objects.filter(expires__lte=timezone.now())[:options['batch_size']])
+            if not sessions:
+                break
+            with transaction.atomic():
+                UploadSession.objects.filter(id__in=[session.id for session in sessions]).delete()
+                queue_blob_deletion(*[session.blob_name for session in sessions])
+            removed += len(sessions)
+        forgotten, _ = FinishedUpload.objects.filter(created__lte=timezone.now() - timedelta(seconds=settings.DIRECT_UPLOAD_FINALIZE_SECONDS)).delete()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired upload sessions and {forgotten} finished direct uploads'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from api.likes import like_buffer
+
+# python manage.py flush_likes - writes the likes still waiting in the like intent queue. The workers flush by themselves after
+# every like, this is for the intents a killed worker left behind when nobody likes anything afterwards (it can be a scheduled job)
+class Command(BaseCommand):
+    help = 'Write the buffered likes/unlikes waiting in the queue'
+
+    def handle(self, *args, **options):
+        flushed = like_buffer.flush()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {flushed} buffered likes/unlikes'))
@@ -0,0 +1,50 @@
+import csv
+import gzip
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.models import ZipCentroid
+from api.response_cache import bump_versions
+
+# python manage.py load_zip_centroids [file] - fills the ZipCentroid table that the "near a zip code" search of the directory
+# reads. Without a file it loads the one that comes with the app (api/data/zip_centroids.csv.gz, the migrations load it too).
+# Takes the Census ZCTA gazetteer file as it is downloaded (2020_Gaz_zcta_national.txt, tab separated with GEOID, INTPTLAT and
+# INTPTLONG columns) or a csv with zip_code,latitude,longitude columns, either one can be gzipped. The table is replaced in one
+# transaction
+BUNDLED_CENTROIDS = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'zip_centroids.csv.gz'))
+
+class Command(BaseCommand):
+    help = 'Load the center of every ZIP code for the directory near search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=BUNDLED_CENTROIDS, help='Census ZCTA gazetteer file or zip_code,latitude,longitude csv (default: the bundled file)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            centroids = list(self.read(options['path']))
+        except OSError as error:
+            raise CommandError(f'Could not read {options["path"]}: {error}')
+        if not centroids:
+            raise CommandError(f'No zip codes found in {options["path"]}')
+        with transaction.atomic():
+            ZipCentroid.objects.all().delete()
+            ZipCentroid.objects.bulk_create(centroids, batch_size=options['batch_size'])
+            bump_versions('userProfiles') # cached near searches used the old centers
+        self.stdout.write(self.style.SUCCESS(f'Loaded {len(centroids)} zip codes'))
+
+    def read(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', newline='', encoding='utf-8-sig') as file:
+            dialect = 'excel-tab' if '\t' in file.readline() else 'excel'
+            file.seek(0)
+            for row in csv.DictReader(file, dialect=dialect):
+                row = {name.strip().lower(): value.strip() for name, value in row.items() if name}
+                zip_code = row.get('geoid') or row.get('zip_code') or row.get('zip')
+                latitude = row.get('intptlat') or row.get('latitude') or row.get('lat')
+                longitude = row.get('intptlong') or row.get('longitude') or row.get('lon')
+                try:
+                    yield ZipCentroid(zip_code=zip_code.zfill(5)[:5], latitude=float(latitude), longitude=float(longitude))
+                except (AttributeError, TypeError, ValueError):
+                    raise CommandError(f'Bad row in {path}: {row}')
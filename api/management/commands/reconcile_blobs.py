@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from api.blob_deletions import queue_blob_deletion
+from api.models import BlobDeletion, Post, UploadSession, UserProfile
+from api.storage import blob_name_from_url, get_container_client
+
+# python manage.py reconcile_blobs - finds blobs under uploads/ and pictures/ that no post, profile or upload session uses
+# anymore (for example when a request died half way) and adds them to the deletion queue. Blobs newer than --min-age-hours
+# are left alone because a direct upload can sit in azure for a while before it is finalized
+class Command(BaseCommand):
+    help = 'Queue the deletion of orphaned blobs under uploads/ and pictures/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age-hours', type=float, default=24.0)
+        parser.add_argument('--dry-run', action='store_true', help='Only print the orphaned blobs')
+
+    def handle(self, *args, **options):
+        in_use = set(BlobDeletion.objects.values_list('blob_name', flat=True)) # already queued
+        in_use.update(UploadSession.objects.values_list('blob_name', flat=True))
+        in_use.update(blob_name_from_url('uploads/', url) for url in Post.objects.values_list('upload', flat=True).iterator())
+        in_use.update(blob_name_from_url('pictures/', url) for url in UserProfile.objects.values_list('picture', flat=True).iterator())
+
+        cutoff = timezone.now() - timedelta(hours=options['min_age_hours'])
+        container_client = get_container_client()
+        orphans = []
+        for folder in ('uploads/', 'pictures/'):
+            for blob in container_client.list_blobs(name_starts_with=folder):
+                if blob.name not in in_use and blob.last_modified < cutoff:
+                    orphans.append(blob.name)
+                    self.stdout.write(blob.name)
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                for start in range(0, len(orphans), 1000):
+                    queue_blob_deletion(*orphans[start:start + 1000])
+        self.stdout.write(self.style.SUCCESS(f'{len(orphans)} orphaned blobs' + (' (dry run, nothing queued)' if options['dry_run'] else ' queued for deletion')))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from api.counters import recount_posts, recount_replies
+from api.tags import recount_tags
+from api.models import Post, Comment
+
+# python manage.py recount_post_counters - recomputes like_count and comment_count for every post (and reply_count for
+# every comment, post_count for every tag) from the real rows
+class Command(BaseCommand):
+    help = 'Recompute the like_count and comment_count columns on every post, reply_count on every comment and post_count on every tag'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='posts', help='Only recount these post ids (can be repeated)')
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.filter(pk__in=options['posts']) if options['posts'] else None
+        fixed = recount_posts(queryset)
+        comments = Comment.objects.filter(post__in=options['posts']) if options['posts'] else None
+        fixed_comments = recount_replies(comments)
+        fixed_tags = recount_tags()
+        self.stdout.write(self.style.SUCCESS(f'Recounted the posts, {fixed} had the wrong counts, {fixed_comments} comments had the wrong reply count and {fixed_tags} tags had the wrong post count'))
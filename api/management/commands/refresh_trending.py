@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.trending import refresh_rankings
+
+# python manage.py refresh_trending - writes the trending score of every post that got likes or comments (or was created or
+# edited) since the last run, see api/trending.py. Run it every few minutes (cron), --full scores every post again
+class Command(BaseCommand):
+    help = 'Refresh the trending scores of the posts that changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Score every post, not just the ones that changed')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts per query')
+
+    def handle(self, *args, **options):
+        refreshed = refresh_rankings(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed the trending score of {refreshed} posts'))
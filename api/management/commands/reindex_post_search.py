@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from api.search import reindex_posts
+
+# python manage.py reindex_post_search - rebuilds the full text search index of the posts (see api/search.py). The triggers
+# keep it up to date on their own, this is for after a bulk import, a change to the search configuration or a restore
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of the posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts per UPDATE (postgres)')
+
+    def handle(self, *args, **options):
+        indexed = reindex_posts(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {indexed} posts'))
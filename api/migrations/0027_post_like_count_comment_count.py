@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 13:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# fill in the counts for the posts that already exist
+def count_existing(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Comment = apps.get_model('api', 'Comment')
+    likes = (Post.likes.through.objects.filter(post_id=OuterRef('pk'))
+        .order_by().values('post_id').annotate(total=Count('*')).values('total'))
+    comments = (Comment.objects.filter(post_id=OuterRef('pk'))
+        .order_by().values('post_id').annotate(total=Count('*')).values('total'))
+    Post.objects.update(
+        like_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0)),
+        comment_count=Coalesce(Subquery(comments, output_field=IntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_post_comment_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0027_post_like_count_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('blob_name', models.CharField(max_length=255)),
+                ('file_name', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=50)),
+                ('length', models.PositiveIntegerField()),
+                ('offset', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('userId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlobDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blob_name', models.CharField(max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_blobdeletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
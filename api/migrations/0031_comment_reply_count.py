@@ -0,0 +1,33 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:31
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# fill in the reply counts for the comments that already exist
+def count_existing(apps, schema_editor):
+    Comment = apps.get_model('api', 'Comment')
+    replies = (Comment.objects.filter(parent_id=OuterRef('pk'))
+        .order_by().values('parent_id').annotate(total=Count('*')).values('total'))
+    Comment.objects.update(reply_count=Coalesce(Subquery(replies, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_userprofile_updated_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', 'created', 'id'], name='comment_post_parent_idx'),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
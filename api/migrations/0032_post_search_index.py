@@ -0,0 +1,82 @@
+from django.db import migrations
+
+
+# The search index is database specific (a tsvector column + GIN index on postgres, an FTS5 table on sqlite). The SQL is a copy
+# of what api/search.py had when this migration was written, so changing search.py later never changes what this migration does
+POSTGRES_SQL = [
+    '''CREATE OR REPLACE FUNCTION api_post_search_document(title text, category text, description text) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(category, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    $$ LANGUAGE sql IMMUTABLE''',
+    '''CREATE OR REPLACE FUNCTION api_post_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := api_post_search_document(NEW.title, NEW.category, NEW."postDesc");
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql''',
+    'ALTER TABLE api_post ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    'DROP TRIGGER IF EXISTS api_post_search_update ON api_post',
+    '''CREATE TRIGGER api_post_search_update BEFORE INSERT OR UPDATE OF title, category, "postDesc" ON api_post
+        FOR EACH ROW EXECUTE FUNCTION api_post_search_update()''', # the counters only UPDATE the counts, that doesnt fire it
+    'CREATE INDEX IF NOT EXISTS api_post_search_vector_idx ON api_post USING GIN (search_vector)',
+]
+
+SQLITE_SQL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS api_post_search USING fts5(
+        title, category, postDesc, content='api_post', content_rowid='id', tokenize='porter unicode61')''',
+    '''CREATE TRIGGER IF NOT EXISTS api_post_search_insert AFTER INSERT ON api_post BEGIN
+        INSERT INTO api_post_search(rowid, title, category, postDesc) VALUES (new.id, new.title, new.category, new.postDesc);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_post_search_delete AFTER DELETE ON api_post BEGIN
+        INSERT INTO api_post_search(api_post_search, rowid, title, category, postDesc) VALUES ('delete', old.id, old.title, old.category, old.postDesc);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_post_search_update AFTER UPDATE OF title, category, postDesc ON api_post BEGIN
+        INSERT INTO api_post_search(api_post_search, rowid, title, category, postDesc) VALUES ('delete', old.id, old.title, old.category, old.postDesc);
+        INSERT INTO api_post_search(rowid, title, category, postDesc) VALUES (new.id, new.title, new.category, new.postDesc);
+    END''',
+]
+
+
+# index the posts that already exist, in batches on postgres (sqlite rebuilds the FTS table in one go)
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    statements = {'postgresql': POSTGRES_SQL, 'sqlite': SQLITE_SQL}.get(connection.vendor)
+    if statements is None:
+        return
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+        if connection.vendor == 'sqlite':
+            cursor.execute("INSERT INTO api_post_search(api_post_search) VALUES ('rebuild')")
+            return
+        last_id = 0
+        while True:
+            cursor.execute('''UPDATE api_post SET search_vector = api_post_search_document(title, category, "postDesc")
+                WHERE id IN (SELECT id FROM api_post WHERE id > %s ORDER BY id LIMIT 1000) RETURNING id''', [last_id])
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return
+            last_id = max(ids)
+
+def drop_search_index(apps, schema_editor):
+    statements = {
+        'postgresql': ['DROP TRIGGER IF EXISTS api_post_search_update ON api_post', 'DROP FUNCTION IF EXISTS api_post_search_update()',
+            'ALTER TABLE api_post DROP COLUMN IF EXISTS search_vector', 'DROP FUNCTION IF EXISTS api_post_search_document(text, text, text)'],
+        'sqlite': ['DROP TRIGGER IF EXISTS api_post_search_insert', 'DROP TRIGGER IF EXISTS api_post_search_delete',
+            'DROP TRIGGER IF EXISTS api_post_search_update', 'DROP TABLE IF EXISTS api_post_search'],
+    }.get(schema_editor.connection.vendor, [])
+    with schema_editor.connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:39
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+# the same as api.tags.parse_tags when this migration was written, copied so the migration doesnt change if that one does
+def parse_tags(category):
+    names = []
+    for name in (category or '').split(','):
+        name = ' '.join(name.split()).lower()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+# split the category of the posts that already exist into tags
+def split_categories(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Tag = apps.get_model('api', 'Tag')
+    PostTag = apps.get_model('api', 'PostTag')
+    posts = [(post_id, created, parse_tags(category)) for post_id, created, category in Post.objects.values_list('id', 'created', 'category').iterator()]
+    Tag.objects.bulk_create([Tag(name=name) for name in {name for _, _, names in posts for name in names}], batch_size=1000)
+    tag_ids = dict(Tag.objects.values_list('name', 'id'))
+    PostTag.objects.bulk_create([PostTag(post_id=post_id, tag_id=tag_ids[name], created=created) for post_id, created, names in posts for name in names], batch_size=1000)
+    counts = PostTag.objects.filter(tag_id=OuterRef('pk')).order_by().values('tag_id').annotate(total=Count('*')).values('total')
+    Tag.objects.update(post_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_post_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('post_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='api.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='api.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'created', 'post'], name='post_tag_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('tag', 'post'), name='post_tag_unique'),
+        ),
+        migrations.RunPython(split_categories, migrations.RunPython.noop),
+    ]
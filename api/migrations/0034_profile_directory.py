@@ -0,0 +1,42 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:41
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZipCentroid',
+            fields=[
+                ('zip_code', models.CharField(max_length=5, primary_key=True, serialize=False)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['state', 'martialArt', 'beltLevel', 'id'], name='profile_state_art_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['martialArt', 'beltLevel', 'id'], name='profile_art_belt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['beltLevel', 'id'], name='profile_belt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(django.db.models.functions.text.Substr('zip_code', 1, 5), models.F('id'), name='profile_zip5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='zipcentroid',
+            index=models.Index(fields=['latitude', 'longitude'], name='zip_centroid_lat_lon_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_profile_directory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostRanking',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='api.post')),
+                ('score', models.FloatField()),
+                ('refreshed', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['updated'], name='post_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postranking',
+            index=models.Index(fields=['-score', '-post'], name='ranking_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postranking',
+            index=models.Index(fields=['refreshed'], name='ranking_refreshed_idx'),
+        ),
+    ]
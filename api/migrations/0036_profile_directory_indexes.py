@@ -0,0 +1,29 @@
+# Generated by Django 4.2.1 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_post_ranking'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['state', 'martialArt', 'id'], name='profile_state_art_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['state', 'beltLevel', 'id'], name='profile_state_belt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['state', 'id'], name='profile_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['martialArt', 'id'], name='profile_art_idx'),
+        ),
+    ]
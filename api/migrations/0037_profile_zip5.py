@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:23
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+# the 5 digit zip of the profiles that already exist
+def fill_zip5(apps, schema_editor):
+    UserProfile = apps.get_model('api', 'UserProfile')
+    UserProfile.objects.update(zip5=Substr('zip_code', 1, 5))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0036_profile_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userprofile',
+            name='profile_zip5_idx',
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='zip5',
+            field=models.CharField(default='', editable=False, max_length=5),
+        ),
+        migrations.RunPython(fill_zip5, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['zip5', 'id'], name='profile_zip5_id_idx'),
+        ),
+    ]
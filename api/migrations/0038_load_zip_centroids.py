@@ -0,0 +1,29 @@
+import csv
+import gzip
+import os
+
+from django.db import migrations
+
+# The ZIP code centers that come with the app, the same file "manage.py load_zip_centroids" loads without a path. The file is
+# read here (not with the command) so the migration keeps working whatever happens to the command later
+CENTROIDS = os.path.join(os.path.dirname(__file__), '..', 'data', 'zip_centroids.csv.gz')
+
+
+def load_centroids(apps, schema_editor):
+    ZipCentroid = apps.get_model('api', 'ZipCentroid')
+    if ZipCentroid.objects.exists(): # someone already loaded their own file
+        return
+    with gzip.open(CENTROIDS, 'rt', newline='') as file:
+        centroids = [ZipCentroid(zip_code=row['zip_code'], latitude=float(row['latitude']), longitude=float(row['longitude'])) for row in csv.DictReader(file)]
+    ZipCentroid.objects.bulk_create(centroids, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_profile_zip5'),
+    ]
+
+    operations = [
+        migrations.RunPython(load_centroids, migrations.RunPython.noop),
+    ]
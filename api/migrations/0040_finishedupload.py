@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_likeintent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinishedUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blob_name', models.CharField(max_length=255, unique=True)),
+                ('rejected', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,6 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from localflavor.us.models import USStateField, USZipCodeField
 from django.contrib.auth.models import User
@@ -17,10 +19,49 @@ class Post(models.Model):
     userId = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True) # this means that when the referrenced object is deleted, the objects that have a foreign key pointing to it will also be deleted
     username = models.CharField(max_length=50, default='Default Username', null=True, blank=True)
     likes = models.ManyToManyField(User, related_name='video_post') # we will be using a many to many field because a user can have many likes and a post can have many likes
+    # The counts are stored on the post so the feed never has to COUNT the likes/comments, they are kept up to date in counters.py (run "manage.py recount_post_counters" to repair them)
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
 
     # Class Metadata is an optional entity within a model and it is anything that is not a field. Some helpful meta data can include how to order instances, providing db table name,etc 
     class Meta:
         ordering = ['created'] # here we will order the posts by the date they were created 
+        indexes = [
+            models.Index(fields=['created', 'id'], name='post_created_id_idx'), # the cursor pagination walks the feed in (created, id) order
+            models.Index(fields=['updated'], name='post_updated_idx'), # the trending refresh only reads the posts that changed since its last run
+        ]
+
+# Tags - the comma separated Post.category ("Kicks, Forms") split into one row per tag, so the feed can be filtered by tag with
+# an index instead of a LIKE over every category string. The tags are kept in sync with the category in tags.py
+class Tag(models.Model):
+    name = models.CharField(max_length=100, unique=True) # stripped and lower case, "Kicks" and " kicks" are the same tag
+    post_count = models.IntegerField(default=0) # kept up to date with F expressions in tags.py, so the tag list never has to COUNT
+
+class PostTag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags')
+    created = models.DateTimeField() # a copy of post.created, so a tag's feed is walked in (created, post) order straight from the index
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'post'], name='post_tag_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'created', 'post'], name='post_tag_created_idx'), # the cursor pagination of posts/?tag=
+        ]
+
+# The trending score of every post (trending.py). It is worked out by "manage.py refresh_trending" from the counts on the post,
+# so posts/?sort=trending reads the posts in score order straight from the index instead of counting likes and comments
+class PostRanking(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='ranking')
+    score = models.FloatField()
+    refreshed = models.DateTimeField() # when the refresh that wrote the score started, the newest one is where the next refresh starts
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-post'], name='ranking_score_idx'), # the cursor pagination of posts/?sort=trending
+            models.Index(fields=['refreshed'], name='ranking_refreshed_idx'),
+        ]
 
 # User Model
 # We will be using the default USER model that comes with django.contrib.auth¶
@@ -41,10 +82,16 @@ class Comment(models.Model):
     updated = models.DateTimeField(auto_now=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies') # parent will refer to a parent comment. It is set to "self" to refer to another instance of the comment model. with the related name replies, we can specify that a comment will be accessible via the "replies" attribute
     username = models.CharField(max_length=50, default='Default Username') #The username will be passed through the frontend when the user creates a comment 
+    reply_count = models.IntegerField(default=0) # the number of direct replies, kept up to date in counters.py so the threads never COUNT them
     # Self referencing foreign keys are used to model nested relationships. behind the scenes, DJANGO will create an id field "parent_id" to store the ID of the parent comment 
 
     class Meta: 
         ordering = ['created'] # here we will order the comments for a particular fund by the date they were created 
+        indexes = [
+            models.Index(fields=['created', 'id'], name='comment_created_id_idx'), # cursor pagination over all the comments
+            models.Index(fields=['post', 'created', 'id'], name='comment_post_created_id_idx'), # cursor pagination over the comments of one post
+            models.Index(fields=['post', 'parent', 'created', 'id'], name='comment_post_parent_idx'), # the threads: the top level comments (parent is null) or the replies of one comment
+        ]
 
     # If we have a reply comment, its going to have a parent comment --> so we can get the parent id
     def parent_comment_id(self): 
@@ -58,9 +105,9 @@ class Comment(models.Model):
     def post_comment_id(self):
         return self.post_id
 
-    # here we can get the comment count for the specific post
+    # here we can get the comment count for the specific post, it is read from the post instead of counting the comments
     def get_comment_count(self):
-        return Comment.objects.filter(post=self.post).count()
+        return self.post.comment_count
 
 class UserProfile(models.Model):
     userId = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_profile_username', null=True, blank=True)
@@ -76,4 +123,83 @@ class UserProfile(models.Model):
     city = models.CharField(_("city"), max_length=64, default="")
     state = USStateField(_("state"), default="")
     zip_code = USZipCodeField(_("zip code"), default="")
+    # updated and version let the profile routes answer with 304 Not Modified (ETag/Last-Modified) without serializing anything
+    updated = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=0) # goes up by one on every save
+    zip5 = models.CharField(max_length=5, default='', editable=False) # the first 5 digits of zip_code, set by save() (the directory looks zip codes up by it)
+
+    # The directory (directory.py) filters on any combination of state, martial art and belt. Every combination has its own index
+    # that ends with the id, so a page walks the matching profiles already in id order (the cursor pagination) and stops after
+    # one page, instead of reading and sorting every match
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'martialArt', 'beltLevel', 'id'], name='profile_state_art_idx'), # state + art + belt
+            models.Index(fields=['state', 'martialArt', 'id'], name='profile_state_art_id_idx'),
+            models.Index(fields=['state', 'beltLevel', 'id'], name='profile_state_belt_idx'),
+            models.Index(fields=['state', 'id'], name='profile_state_idx'),
+            models.Index(fields=['martialArt', 'beltLevel', 'id'], name='profile_art_belt_idx'), # art + belt
+            models.Index(fields=['martialArt', 'id'], name='profile_art_idx'),
+            models.Index(fields=['beltLevel', 'id'], name='profile_belt_idx'),
+            # the 5 digit zip, so "12345-6789" is found as 12345 too. The other filters are checked on the profiles of that zip code
+            models.Index(fields=['zip5', 'id'], name='profile_zip5_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        self.zip5 = (self.zip_code or '')[:5]
+        if kwargs.get('update_fields') is not None and 'zip_code' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'zip5'}
+        super().save(*args, **kwargs)
 
+# The center of every 5 digit ZIP code, for the "near a zip code" search of the directory. Filled in from a file with
+# "manage.py load_zip_centroids" (e.g. the Census ZCTA gazetteer), the app never looks a location up online
+class ZipCentroid(models.Model):
+    zip_code = models.CharField(max_length=5, primary_key=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='zip_centroid_lat_lon_idx'), # the bounding box around the center of the search
+        ]
+
+
+# A resumable upload (like the tus protocol). The client creates a session, sends the file in pieces at the offset the server
+# has reached, and can ask for that offset again after a network failure instead of starting over. The pieces are appended to
+# an append blob in azure, and when offset == length the session can be finalized into a Post
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False) # random ids so nobody can guess someone else's session
+    userId = models.ForeignKey(User, on_delete=models.CASCADE)
+    blob_name = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=50)
+    length = models.PositiveIntegerField() # the full size of the file, given when the session is created
+    offset = models.PositiveIntegerField(default=0) # how many bytes have been uploaded so far
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True) # unfinished sessions are cleaned up after this with "manage.py expire_upload_sessions"
+
+# Every blob a direct upload token was finalized with (see checkDirectUpload in views.py). The unique blob name is what makes a token
+# single use even when two finalize requests come in at once, and a rejected upload keeps its row so the token cant be tried again
+# with a different file. Rows older than DIRECT_UPLOAD_FINALIZE_SECONDS are removed by "manage.py expire_upload_sessions"
+class FinishedUpload(models.Model):
+    blob_name = models.CharField(max_length=255, unique=True)
+    rejected = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+# Blobs waiting to be deleted from azure. Deleting a post/profile only deletes the row and adds the blob here in the same
+# transaction, then "manage.py drain_blob_deletions" deletes the blobs in batches, retrying the ones that fail with a growing wait
+class BlobDeletion(models.Model):
+    blob_name = models.CharField(max_length=255)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True) # the worker picks up rows whose next_attempt has passed
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+# The likes/unlikes waiting to be written by the like buffer (see api/likes.py). The view only inserts a row here, so a like that
+# got its 202 survives the worker being killed, and any worker's flush picks it up. The ids give the order the requests came in,
+# so the latest intent of a user wins no matter which worker took the request
+class LikeIntent(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    liked = models.BooleanField() # True for like, False for unlike
+    created = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,123 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+# Keyset (cursor) pagination - instead of using OFFSET (which gets slower the deeper the page is), we remember the ordering values
+# of the last row we sent, and the next page is just "WHERE (created, id) > (last created, last id)" which uses the composite index
+# so page 1000 costs the same as page 1. The cursor we hand to the client is opaque, its just base64 encoded json
+class KeysetPagination(BasePagination):
+    ordering = ('created', 'id') # matches Post.Meta.ordering and Comment.Meta.ordering, id is the tie breaker so every row has a unique position. A '-' in front means descending
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size' # the client can ask for a different page size with ?page_size=
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+
+        if cursor is None:
+            reverse, position = False, None
+        else:
+            reverse, position = cursor
+            queryset = queryset.filter(self.position_filter(position, reverse))
+
+        # we grab one extra row so we know if there is another page after this one
+        queryset = queryset.order_by(*self.get_ordering(reverse))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse: # we walked backwards to get the previous page, so flip it back into the normal order
+            rows.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.first_position = self.get_position(rows[0]) if rows else position
+        self.last_position = self.get_position(rows[-1]) if rows else position
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return list(self.ordering)
+        return [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+
+    # (a, b) > (x, y) is the same as a > x OR (a = x AND b > y), this is written out with Q objects so it works on every database
+    def position_filter(self, position, reverse):
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            equal = {other.lstrip('-'): value for other, value in zip(self.ordering[:index], position)}
+            conditions.append(Q(**equal, **{name + ('__lt' if descending else '__gt'): position[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def get_position(self, row):
+        return [row[field.lstrip('-')] if isinstance(row, dict) else getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(False, self.last_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(True, self.first_position))
+
+    def encode_cursor(self, reverse, position):
+        payload = json.dumps({'r': int(reverse), 'p': position}, default=lambda value: value.isoformat(), separators=(',', ':')) # datetimes keep their full microseconds, otherwise rows could get skipped
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return bool(payload['r']), self.parse_position(model, position)
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    # The cursor values come back out of json as strings/numbers, so we turn them back into the right python type using the model field
+    def parse_position(self, model, position):
+        values = []
+        for field, value in zip(self.ordering, position):
+            try:
+                values.append(model._meta.get_field(field.lstrip('-')).to_python(value))
+            except FieldDoesNotExist: # annotated values are not model fields, they are used as is
+                values.append(value)
+            except ValidationError:
+                raise ValueError
+        return values
@@ -0,0 +1,205 @@
+import hashlib
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from .compression import choose_encoding, precompress
+
+# Response cache for the read endpoints. Every cached response is stored under a key that has the VERSION of what it shows in it
+# (e.g. "post:5" for one post, "posts" for the list of posts). Writes never look for the old keys, they just add one to the
+# version, so the next read builds a new key and the old entries are never read again (they expire on their own).
+# Any cache backend works: LocMem/file for development and tests, redis/memcached in production (see CACHES in settings)
+
+VERSION_PREFIX = 'version:'
+STATS_PREFIX = 'response-cache:'
+
+
+# The version keys each read endpoint depends on
+def post_scopes(post_id):
+    return ['posts', f'post:{post_id}']
+
+def comment_scopes(post_id):
+    return ['comments', f'post-comments:{post_id}'] + post_scopes(post_id) # posts show their comments, so those change too
+
+def profile_scopes(profile_id):
+    return ['userProfiles', f'userProfile:{profile_id}']
+
+
+# Versions never expire. A version that was evicted starts again from the current time in nanoseconds, which is always bigger
+# than the old one was, so the responses cached under the old version cant be served again
+def get_versions(scopes):
+    versions = cache.get_many([VERSION_PREFIX + scope for scope in scopes])
+    missing = [VERSION_PREFIX + scope for scope in scopes if VERSION_PREFIX + scope not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), None) # add so two workers starting the same version at once both end up with the same one
+        versions.update(cache.get_many(missing))
+    return [versions.get(VERSION_PREFIX + scope, 0) for scope in scopes]
+
+def bump_now(*scopes):
+    for scope in set(scopes):
+        try:
+            cache.incr(VERSION_PREFIX + scope)
+        except ValueError: # nobody has read it yet (or it was evicted)
+            cache.add(VERSION_PREFIX + scope, time.time_ns(), None)
+
+# The bump waits for the transaction to commit. Bumping before the commit would let a read in between cache the OLD rows
+# under the NEW version, and that entry would be served until it expires
+def bump_versions(*scopes):
+    transaction.on_commit(lambda: bump_now(*scopes))
+
+
+# A lock that works across all the workers because it lives in the cache: cache.add only sets the key if nobody else has it.
+# Yields True when we got the lock (waiting up to `wait` seconds for it) and False when we didnt. The lock expires after
+# `timeout` seconds in case the worker holding it dies, and it is only deleted by the worker that set it
+@contextmanager
+def cache_lock(key, timeout=10, wait=0):
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    locked = cache.add(key, token, timeout)
+    while not locked and time.monotonic() < deadline:
+        time.sleep(0.01)
+        locked = cache.add(key, token, timeout)
+    try:
+        yield locked
+    finally:
+        if locked and cache.get(key) == token:
+            cache.delete(key)
+
+
+def count(name):
+    try:
+        cache.incr(STATS_PREFIX + name)
+    except ValueError:
+        if not cache.add(STATS_PREFIX + name, 1, None):
+            cache.incr(STATS_PREFIX + name) # another worker added it first
+
+# stale = the single flight routes sent the previous response while another request was rebuilding it
+def get_stats(views):
+    names = [f'{view}:{result}' for view in views for result in ('hit', 'miss', 'stale')]
+    counts = cache.get_many([STATS_PREFIX + name for name in names])
+    stats = {}
+    for view in views:
+        hits = counts.get(f'{STATS_PREFIX}{view}:hit', 0)
+        misses = counts.get(f'{STATS_PREFIX}{view}:miss', 0)
+        stale = counts.get(f'{STATS_PREFIX}{view}:stale', 0)
+        stats[view] = {'hits': hits, 'misses': misses, 'stale': stale, 'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None}
+    return stats
+
+def reset_stats(views):
+    cache.delete_many([f'{STATS_PREFIX}{view}:{result}' for view in views for result in ('hit', 'miss', 'stale')])
+
+
+# Decorator for a read view (put it UNDER @api_view and @permission_classes so the permission checks still run on a hit).
+# `scopes` gets the same arguments as the view and returns the version keys, or None when the response shouldnt be cached.
+# The full url is part of the key because the page/cursor/page_size are in the query string.
+# What is stored is the RENDERED json plus its gzip/brotli versions (made once, when the entry is stored), so a hit is sent
+# straight from the cache without rendering or compressing anything.
+#
+# single_flight=True is for the hot routes (one popular post): when the entry is missing only ONE request (in any worker,
+# the lock is in the cache) runs the view. The others get the last response of that url (stale-while-revalidate) or, when
+# there is none yet, wait up to SINGLE_FLIGHT_WAIT seconds for the new one. "manage.py bench_single_flight" shows it
+CACHED_VIEWS = []
+
+def cached_response(scopes, single_flight=False):
+    def decorator(view):
+        CACHED_VIEWS.append(view.__name__)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            names = scopes(*args, **kwargs)
+            renderer = getattr(request, 'accepted_renderer', None) # only json is cached, not the browsable api pages
+            if names is None or not settings.RESPONSE_CACHE_SECONDS or renderer is None or renderer.format != 'json':
+                return view(request, *args, **kwargs)
+
+            versions = get_versions(names)
+            url = hashlib.md5(f'{request.build_absolute_uri()}|{request.accepted_media_type}'.encode()).hexdigest() # memcached keys cant be longer than 250 characters
+            key = f'rendered:{view.__name__}:{url}:' + ':'.join(map(str, versions))
+            stale_key = f'stale:{view.__name__}:{url}' if single_flight else None
+            cached = cache.get(key)
+            if cached is not None:
+                count(view.__name__ + ':hit')
+                return cached_http_response(request, cached)
+
+            lock_key = None
+            if single_flight:
+                cached, lock_key = wait_for_flight(key, stale_key)
+                if cached is not None:
+                    count(view.__name__ + (':hit' if cached.get('fresh', True) else ':stale'))
+                    return cached_http_response(request, cached)
+
+            count(view.__name__ + ':miss')
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                release(lock_key)
+                raise
+            if response.streaming or response.status_code != 200: # streamed responses (?stream=1) and errors are not cached
+                release(lock_key)
+            else:
+                response.add_post_render_callback(lambda response: store(key, response, stale_key, lock_key))
+            if not response.streaming:
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+# Returns (cached entry, None) when another request already built it or there is a stale one to send, or (None, lock key)
+# when this request got the lock and has to build it. (None, None) when we waited too long, the view runs without the lock
+def wait_for_flight(key, stale_key):
+    lock_key = 'lock:' + key
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT
+    stale = None
+    while True:
+        if cache.add(lock_key, 1, settings.SINGLE_FLIGHT_LOCK_SECONDS):
+            return None, lock_key
+        if stale is None: # someone else is building it, the last response of this url is good enough in the meantime
+            stale = cache.get(stale_key)
+            if stale is not None:
+                return dict(stale, fresh=False), None
+        if time.monotonic() >= deadline:
+            return None, None
+        time.sleep(0.01)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, None
+
+def release(lock_key):
+    if lock_key is not None:
+        cache.delete(lock_key)
+
+def store(key, response, stale_key=None, lock_key=None):
+    entry = {
+        'content_type': response['Content-Type'],
+        'body': response.content,
+        'encoded': precompress(response.content),
+        # the validators of THIS body. @conditional sets them from the live stats after the view, which would be wrong for a
+        # stale body: the client would send the new ETag back and get 304 for the old response
+        'etag': response.get('ETag'),
+        'last_modified': response.get('Last-Modified'),
+    }
+    cache.set(key, entry, settings.RESPONSE_CACHE_SECONDS)
+    if stale_key is not None: # kept longer than the entry itself, it is what the other requests get while it is rebuilt
+        cache.set(stale_key, entry, settings.RESPONSE_STALE_SECONDS)
+    release(lock_key)
+
+def cached_http_response(request, cached):
+    encoding = choose_encoding(request)
+    body = cached['encoded'].get(encoding)
+    response = HttpResponse(body or cached['body'], content_type=cached['content_type'])
+    if body is not None:
+        response['Content-Encoding'] = encoding # CompressionMiddleware leaves it alone and only sets Vary/the weak ETag
+    for header, name in (('ETag', 'etag'), ('Last-Modified', 'last_modified')):
+        if cached.get(name):
+            response[header] = cached[name] # @conditional only sets the headers that are missing
+    response['X-Cache'] = 'HIT' if cached.get('fresh', True) else 'STALE'
+    return response
+
+# the post/profile id in the url, only ids that are plain numbers are cached ("05" would be a different key than the one we bump)
+def object_id(id):
+    return int(id) if str(id).isdigit() and str(int(id)) == str(id) else None
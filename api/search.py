@@ -0,0 +1,125 @@
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from .models import Post
+from .pagination import KeysetPagination
+
+# Full text search over the posts (title, category and postDesc). The search index lives in the database and is kept up to
+# date by triggers, so every way a post is created or changed (the views, the admin, .update()) is covered:
+#   postgres: a tsvector column api_post.search_vector with a GIN index, ranked with ts_rank_cd. The title counts the most,
+#             then the category, then the description
+#   sqlite:   an FTS5 table api_post_search that indexes the post table (external content), ranked with bm25.
+#             This is what the development/test databases use, it needs nothing but python's sqlite
+#   others:   no index, the posts are filtered with icontains and come back newest first
+# The column/table is not a model field, so it is only ever read through search_posts(). "manage.py reindex_post_search"
+# rebuilds it (and puts the triggers back, sqlite drops them when a migration rebuilds the post table)
+
+SEARCH_CONFIG = 'english' # the postgres text search configuration (stemming and stop words)
+
+POSTGRES_SQL = [
+    f'''CREATE OR REPLACE FUNCTION api_post_search_document(title text, category text, description text) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(category, '')), 'B')
+            || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'C')
+    $$ LANGUAGE sql IMMUTABLE''',
+    '''CREATE OR REPLACE FUNCTION api_post_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := api_post_search_document(NEW.title, NEW.category, NEW."postDesc");
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql''',
+    'ALTER TABLE api_post ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    'DROP TRIGGER IF EXISTS api_post_search_update ON api_post',
+    '''CREATE TRIGGER api_post_search_update BEFORE INSERT OR UPDATE OF title, category, "postDesc" ON api_post
+        FOR EACH ROW EXECUTE FUNCTION api_post_search_update()''', # the counters only UPDATE the counts, that doesnt fire it
+    'CREATE INDEX IF NOT EXISTS api_post_search_vector_idx ON api_post USING GIN (search_vector)',
+]
+
+SQLITE_SQL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS api_post_search USING fts5(
+        title, category, postDesc, content='api_post', content_rowid='id', tokenize='porter unicode61')''',
+    '''CREATE TRIGGER IF NOT EXISTS api_post_search_insert AFTER INSERT ON api_post BEGIN
+        INSERT INTO api_post_search(rowid, title, category, postDesc) VALUES (new.id, new.title, new.category, new.postDesc);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_post_search_delete AFTER DELETE ON api_post BEGIN
+        INSERT INTO api_post_search(api_post_search, rowid, title, category, postDesc) VALUES ('delete', old.id, old.title, old.category, old.postDesc);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_post_search_update AFTER UPDATE OF title, category, postDesc ON api_post BEGIN
+        INSERT INTO api_post_search(api_post_search, rowid, title, category, postDesc) VALUES ('delete', old.id, old.title, old.category, old.postDesc);
+        INSERT INTO api_post_search(rowid, title, category, postDesc) VALUES (new.id, new.title, new.category, new.postDesc);
+    END''',
+]
+
+def install_search_index(connection):
+    statements = {'postgresql': POSTGRES_SQL, 'sqlite': SQLITE_SQL}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+def uninstall_search_index(connection):
+    statements = {
+        'postgresql': ['DROP TRIGGER IF EXISTS api_post_search_update ON api_post', 'DROP FUNCTION IF EXISTS api_post_search_update()',
+            'ALTER TABLE api_post DROP COLUMN IF EXISTS search_vector', 'DROP FUNCTION IF EXISTS api_post_search_document(text, text, text)'],
+        'sqlite': ['DROP TRIGGER IF EXISTS api_post_search_insert', 'DROP TRIGGER IF EXISTS api_post_search_delete',
+            'DROP TRIGGER IF EXISTS api_post_search_update', 'DROP TABLE IF EXISTS api_post_search'],
+    }.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+# Recompute the index for every post, `batch_size` posts per UPDATE on postgres (sqlite rebuilds the FTS table in one go).
+# Returns how many posts were indexed
+def reindex_posts(batch_size=1000, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    install_search_index(connection)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("INSERT INTO api_post_search(api_post_search) VALUES ('rebuild')")
+            cursor.execute('SELECT COUNT(*) FROM api_post')
+            return cursor.fetchone()[0]
+        indexed, last_id = 0, 0
+        while True:
+            cursor.execute('''UPDATE api_post SET search_vector = api_post_search_document(title, category, "postDesc")
+                WHERE id IN (SELECT id FROM api_post WHERE id > %s ORDER BY id LIMIT %s) RETURNING id''', [last_id, batch_size])
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return indexed
+            indexed += len(ids)
+            last_id = max(ids)
+
+
+# The posts that match `text`, with a `rank` (higher is better). Both the filter and the ranking read the index
+def search_posts(text):
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField # needs psycopg2, so only imported here
+        vector = RawSQL('"api_post"."search_vector"', [], output_field=SearchVectorField())
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG) # handles "quotes", OR and -word like a search box
+        return (Post.objects.alias(search_vector=vector).filter(search_vector=query)
+            .annotate(rank=Cast(SearchRank(vector, query, cover_density=True), FloatField()))) # float8, so the rank in the cursor compares exactly
+    if connection.vendor == 'sqlite':
+        match = fts5_query(text)
+        if not match:
+            return Post.objects.none()
+        # the MATCH picks the posts out of the FTS table, and bm25 (it only works in a query that does the MATCH) is read for each
+        # of them by rowid. The rank columns weigh the title the most
+        matches = RawSQL('SELECT rowid FROM api_post_search WHERE api_post_search MATCH %s', [match])
+        rank = RawSQL('''SELECT -bm25(api_post_search, 10.0, 5.0, 1.0) FROM api_post_search
+            WHERE api_post_search MATCH %s AND rowid = "api_post"."id"''', [match], output_field=FloatField())
+        return Post.objects.filter(id__in=matches).annotate(rank=rank)
+    # any other database has no search index, so every word just has to be somewhere in the post (a full scan, no ranking)
+    words = Q()
+    for word in text.split():
+        words &= Q(title__icontains=word) | Q(category__icontains=word) | Q(postDesc__icontains=word)
+    if not words:
+        return Post.objects.none()
+    return Post.objects.filter(words).annotate(rank=Value(0.0, output_field=FloatField()))
+
+# Every word of the search box has to be in the post. The words are quoted so FTS5 never reads them as its own query syntax
+def fts5_query(text):
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+# The results are walked best match first, the id breaks the ties
+class SearchPagination(KeysetPagination):
+    ordering = ('-rank', '-id')
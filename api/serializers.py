@@ -1,6 +1,7 @@
 # Now the important thing is that we need to take our python objects and then turn them into JSON format - so we need to serialize them
 from rest_framework.serializers import ModelSerializer, SerializerMethodField, URLField
 from .models import Post, UserProfile, Comment
+from .comment_tree import CommentTree
 
 # imports needed for the register serializer
 from rest_framework import serializers
@@ -9,32 +10,107 @@ from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
 
 
+# The comment tree is loaded ONCE per serializer and shared through the context, so the nested comments/replies never query per comment
+# Views can pass in their own tree with context={'comment_tree': tree}, otherwise we load it for whatever the top level serializer is serializing
+def get_comment_tree(serializer):
+    context = serializer.context
+    if context.get('comment_tree') is None:
+        instance = serializer.root.instance
+        instances = [instance] if isinstance(instance, (Post, Comment)) else list(instance)
+        if instances and isinstance(instances[0], Post):
+            context['comment_tree'] = CommentTree.for_posts(post.id for post in instances)
+        else:
+            context['comment_tree'] = CommentTree.for_comments(instances)
+    return context['comment_tree']
+
+
+# Sparse fieldsets - ?fields=title,upload,like_count only sends those fields, and the heavy nested fields (the comment tree and the
+# likes list) are only sent when they are asked for with ?expand=comments,likes. Without either parameter everything is sent like before.
+# The views read the parameters with sparse_context() and pass them in the serializer context
+def sparse_context(request):
+    context = {}
+    for param in ('fields', 'expand'):
+        value = request.query_params.get(param)
+        if value is not None:
+            context[param] = {name.strip() for name in value.split(',') if name.strip()}
+    return context
+
+class SparseFieldsMixin:
+    expandable_fields = () # the fields that are left out when the client asks for a sparse response, unless they are expanded
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields, expand = self.context.get('fields'), self.context.get('expand')
+        if fields is None and expand is None:
+            return
+        for name in list(self.fields):
+            if name in self.expandable_fields:
+                keep = name in (expand or ()) or name in (fields or ())
+            else:
+                keep = fields is None or name in fields
+            if not keep:
+                self.fields.pop(name)
+
+    # Load only the columns the response needs (plus `keep`, e.g. the columns the pagination cursor is made of),
+    # and only prefetch the many to many fields that are sent
+    @classmethod
+    def sparse_queryset(cls, queryset, context, keep=()):
+        names = set(cls(context=context).fields)
+        model_fields = {field.name: field for field in queryset.model._meta.get_fields()}
+        many_to_many = [name for name in names if name in model_fields and model_fields[name].many_to_many]
+        if context.get('fields') is not None or context.get('expand') is not None:
+            columns = {name for name in names if name in model_fields and model_fields[name].concrete and not model_fields[name].many_to_many}
+            queryset = queryset.only('id', *columns, *(name.lstrip('-') for name in keep))
+        return queryset.prefetch_related(*many_to_many)
+
+
 # Comment serializer - to serialize the comment model 
 class CommentSerializer(ModelSerializer):
     replies = SerializerMethodField() # since replies is not a field explicitly in the comments model, its created in the frontend and then its added to the serializer 
     class Meta: 
         model = Comment
-        fields = '__all__'
+        exclude = ('reply_count',) # only the threads send it, the full tree has every reply anyway
 
     def get_replies(self, comment): # takes a comment instance to be serialized
-        replies = comment.replies.all() # Fetch the related replies for the comment
-        reply_serializer = self.__class__(replies, many=True)  # Serialize the replies
+        replies = get_comment_tree(self).replies_for(comment.id) # Look up the replies in the already loaded comment tree instead of querying for them
+        reply_serializer = self.__class__(replies, many=True, context=self.context)  # Serialize the replies
         return reply_serializer.data
 
 
+# Thread serializer - a comment with its reply_count and only the FIRST few replies (the client loads the rest page by page).
+# The views load those replies for the whole page at once (threads.py) and pass them in the context as 'reply_previews'
+class ThreadCommentSerializer(ModelSerializer):
+    replies = SerializerMethodField()
+    class Meta:
+        model = Comment
+        fields = '__all__'
+        read_only_fields = ('reply_count',)
+
+    def get_replies(self, comment):
+        previews = self.context.get('reply_previews', {}).get(comment.id, [])
+        return ThreadCommentSerializer(previews, many=True, context={}).data # the replies of the previews are not loaded, only their reply_count
+
+
 # postserializer - to serialize the post models
-class PostSerializer(ModelSerializer):
-    comments = CommentSerializer(many=True, read_only=True) #here we want to be able to get the actual comments. It needs to be outside the meta class
+class PostSerializer(SparseFieldsMixin, ModelSerializer):
+    expandable_fields = ('comments', 'likes')
+    comments = SerializerMethodField() #here we want to be able to get the actual comments. It needs to be outside the meta class
 
     class Meta: 
         model = Post #specify the model we will serialize 
         fields = '__all__' # here we specified that we want to serialize ALL the fields in the model, BUT we can list out certain ones  
+        read_only_fields = ('like_count', 'comment_count') # the counts are only ever changed by the counters, never by the client
+
+    def get_comments(self, post):
+        comments = get_comment_tree(self).comments_for_post(post.id) # every comment for the post comes out of the shared comment tree
+        return CommentSerializer(comments, many=True, context=self.context).data
     
 #userprofile serializer - to serialize the user profile model
-class UserProfileSerializer(ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, ModelSerializer):
     class Meta: 
         model = UserProfile
-        fields = '__all__'
+        exclude = ('zip5',) # only there for the directory's index, zip_code is what is sent
+        read_only_fields = ('version',) # only ever changed by UserProfile.save
 
 
 # Login Register serializer 
@@ -0,0 +1,118 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from . import comment_tree_cache
+from .autocomplete import username_index
+from .models import Post, Comment, UserProfile, PostTag
+from .counters import change_comment_count, change_like_count, change_reply_count, touch_posts
+from .response_cache import bump_versions, comment_scopes, post_scopes, profile_scopes
+from .tags import change_post_count, sync_post_tags
+
+# Signals keep Post.comment_count right no matter how a comment is created or deleted (this includes the replies that
+# get deleted by CASCADE when their parent comment is deleted, django sends post_delete for every one of them)
+# an edit can move a comment to another parent, so we need to know the parent it had before for the reply counts
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance.previous_parent_id = Comment.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        change_comment_count(instance.post_id, 1)
+        if instance.parent_id is not None:
+            change_reply_count(instance.parent_id, 1)
+    else:
+        touch_posts([instance.post_id]) # the post shows its comments, so an edited comment is a change to the post
+        previous_parent_id = getattr(instance, 'previous_parent_id', instance.parent_id)
+        if previous_parent_id != instance.parent_id:
+            if previous_parent_id is not None:
+                change_reply_count(previous_parent_id, -1)
+            if instance.parent_id is not None:
+                change_reply_count(instance.parent_id, 1)
+    bump_versions(*comment_scopes(instance.post_id)) # edits change the cached responses too
+    comment_tree_cache.comment_saved(instance)
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    change_comment_count(instance.post_id, -1)
+    if instance.parent_id is not None:
+        change_reply_count(instance.parent_id, -1) # nothing happens when the parent was deleted with it
+    bump_versions(*comment_scopes(instance.post_id))
+    comment_tree_cache.comment_deleted(instance)
+
+
+# Any change to a post or profile moves the version of its cached responses on (see response_cache.py)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    bump_versions(*post_scopes(instance.pk), f'post-comments:{instance.pk}') # a deleted post has to 404 on its comments route too
+    if kwargs['signal'] is post_delete:
+        comment_tree_cache.post_deleted(instance.pk)
+    else:
+        sync_post_tags(instance) # the tags follow the category
+
+# a post lost a tag (its category changed, or the post was deleted and its PostTag rows went with it by CASCADE)
+@receiver(post_delete, sender=PostTag)
+def post_tag_deleted(sender, instance, **kwargs):
+    change_post_count([instance.tag_id], -1)
+    bump_versions('tags')
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    bump_versions(*profile_scopes(instance.pk))
+
+
+# The username autocomplete index follows the users (this includes RegisterView) and the profiles. A rename has to take the old
+# name out, so we look it up before the save. Saves that dont touch the username (like the last_login of a login) are skipped
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=UserProfile)
+def username_saving(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is not None and (update_fields is None or 'username' in update_fields):
+        instance.previous_username = sender.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def username_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    previous = getattr(instance, 'previous_username', None)
+    if created or previous is None:
+        username_index.change(added=[instance.username])
+    elif previous != instance.username:
+        username_index.change(added=[instance.username], removed=[previous])
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=UserProfile)
+def username_deleted(sender, instance, **kwargs):
+    username_index.change(removed=[instance.username])
+# Post.likes can be changed from either side (post.likes.add(user) OR user.video_post.add(post)), so we handle both directions
+# post_add only gets the rows that were really inserted, but for remove/clear we have to look up which rows exist before they are deleted
+@receiver(m2m_changed, sender=Post.likes.through)
+def likes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        if reverse: # instance is a user, pk_set are post ids
+            change_like_count(pk_set, 1)
+            changed = pk_set
+        else:
+            change_like_count([instance.pk], len(pk_set))
+            changed = [instance.pk]
+
+    elif action in ('pre_remove', 'pre_clear'):
+        rows = sender.objects.filter(**{'user_id' if reverse else 'post_id': instance.pk})
+        if action == 'pre_remove':
+            rows = rows.filter(**{'post_id__in' if reverse else 'user_id__in': pk_set})
+        if reverse:
+            changed = list(rows.values_list('post_id', flat=True))
+            change_like_count(changed, -1)
+        else:
+            removed = rows.count()
+            if removed:
+                change_like_count([instance.pk], -removed)
+            changed = [instance.pk] if removed else []
+    else:
+        return
+
+    for post_id in changed: # the likes are part of the cached posts
+        bump_versions(*post_scopes(post_id))
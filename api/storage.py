@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+import uuid
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.exceptions import AzureError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobBlock, BlobSasPermissions, BlobServiceClient, generate_blob_sas
+from django.conf import settings
+from django.utils.text import get_valid_filename
+
+# The file types we allow, by file extension. Posts can be pictures or videos, profile pictures can only be pictures
+POST_CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+}
+PICTURE_CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+}
+
+# Check the first bytes of a file ("magic bytes") to make sure it really is the type its extension says it is
+def looks_like(content_type, head):
+    if content_type == 'image/jpeg':
+        return head.startswith(b'\xff\xd8\xff')
+    if content_type == 'image/png':
+        return head.startswith(b'\x89PNG\r\n\x1a\n')
+    if content_type in ('video/mp4', 'video/quicktime'): # mp4/mov files are made of boxes, the first box type is in bytes 4-8
+        return head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip')
+    return False
+
+
+# Building a BlobServiceClient sets up a brand new http session, so doing it on every request meant a new TLS connection to Azure
+# every time. Instead each worker process builds the client ONCE (the first time it is needed) and every view reuses it,
+# the requests session underneath keeps its connections alive in a pool so the next upload/delete skips the handshake
+_lock = threading.Lock()
+_container_client = None
+
+def get_container_client():
+    global _container_client
+    if _container_client is None:
+        with _lock:
+            if _container_client is None: # another thread could have built it while we were waiting for the lock
+                _container_client = build_container_client()
+    return _container_client
+
+def get_blob_client(blob_name):
+    return get_container_client().get_blob_client(blob_name) # blob clients made from the container client share its transport/connection pool
+
+
+# Posts and profiles save the full blob url, this turns it back into the blob name (folder + the decoded file name)
+def blob_name_from_url(folder, url):
+    return folder + unquote(os.path.basename(urlsplit(url).path))
+
+# A new blob name inside a folder that will never clash with another upload, the original file name is kept at the end
+def unique_blob_name(folder, file_name):
+    return folder + uuid.uuid4().hex + '-' + get_valid_filename(os.path.basename(file_name))
+
+# A short lived url that lets the client upload (create/write only, no reading or deleting) ONE blob straight to azure
+def blob_upload_url(blob_name, expires_in):
+    container_client = get_container_client()
+    sas_token = generate_blob_sas(
+        account_name=container_client.account_name,
+        container_name=container_client.container_name,
+        blob_name=blob_name,
+        account_key=container_client.credential.account_key,
+        permission=BlobSasPermissions(create=True, write=True),
+        expiry=datetime.now(timezone.utc) + timedelta(seconds=expires_in),
+    )
+    return container_client.get_blob_client(blob_name).url + '?' + sas_token
+
+
+def build_container_client(connection_string=None, container=None):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=settings.AZURE_POOL_CONNECTIONS, pool_maxsize=settings.AZURE_POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter) # the local emulator (Azurite) runs on plain http
+
+    transport = RequestsTransport(
+        session=session,
+        session_owner=False, # the session lives as long as the process, the client should not close it
+        connection_timeout=settings.AZURE_CONNECTION_TIMEOUT,
+        read_timeout=settings.AZURE_READ_TIMEOUT,
+    )
+    blob_service_client = BlobServiceClient.from_connection_string(
+        connection_string or settings.AZURE_CONNECTION_STRING,
+        transport=transport,
+        retry_total=settings.AZURE_RETRY_TOTAL,
+        initial_backoff=settings.AZURE_RETRY_BACKOFF,
+    )
+    return blob_service_client.get_container_client(container or settings.AZURE_CONTAINER)
+
+
+# Uploading a big file as a block blob: every block is sent with stage_block from a small thread pool so several blocks are
+# on their way to azure at the same time, then ONE commit_block_list puts them together in order. Only `concurrency` blocks
+# are ever held in memory at once, stage() waits for a free slot before it takes the next block
+class BlockUploader:
+    def __init__(self, blob_client, concurrency=None, retries=None):
+        self.blob_client = blob_client
+        self.concurrency = concurrency or settings.AZURE_UPLOAD_CONCURRENCY
+        self.retries = settings.AZURE_UPLOAD_BLOCK_RETRIES if retries is None else retries
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.block_ids = []
+        self.futures = []
+        self.size = 0
+
+    def stage(self, data):
+        block_id = b64encode(f'{len(self.block_ids):08d}'.encode()).decode() # azure wants every block id of a blob to be the same length
+        self.block_ids.append(block_id)
+        self.size += len(data)
+        self.slots.acquire()
+        future = self.executor.submit(self.stage_block, block_id, data)
+        future.add_done_callback(lambda future: self.slots.release())
+        self.futures.append(future)
+
+    # each block gets its own retries with a growing wait, so one bad block doesnt mean starting the whole upload again
+    def stage_block(self, block_id, data):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.blob_client.stage_block(block_id, data, length=len(data))
+            except AzureError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(settings.AZURE_RETRY_BACKOFF * 2 ** attempt)
+
+    def commit(self, content_settings=None):
+        try:
+            for future in self.futures:
+                future.result() # raises the error of any block that failed for good
+        except Exception:
+            self.abort()
+            raise
+        self.executor.shutdown()
+        return self.blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in self.block_ids], content_settings=content_settings)
+
+    # the staged blocks that never get committed are thrown away by azure on their own
+    def abort(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def upload_in_blocks(blob_client, file, content_settings=None, block_size=None, concurrency=None):
+    uploader = BlockUploader(blob_client, concurrency=concurrency)
+    try:
+        file.seek(0)
+        while chunk := file.read(block_size or settings.AZURE_UPLOAD_BLOCK_SIZE): # we read the blocks ourselves, files that are kept in memory ignore the chunk size in chunks()
+            uploader.stage(chunk)
+    except Exception:
+        uploader.abort()
+        raise
+    return uploader.commit(content_settings)
@@ -0,0 +1,37 @@
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.settings import api_settings
+
+# Streaming list responses (?stream=1 on getComments and getUserProfiles). Instead of loading the whole table and building the full
+# json in memory, the rows are read from the database chunk_size at a time with .iterator(), every chunk is serialized and
+# rendered on its own, and the pieces are sent as they are ready. Only one chunk is ever held in memory.
+# The bytes are the same as rendering the whole list at once: "[" + the rows of each chunk without their brackets, joined by "," + "]"
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+def stream_json_array(pages):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]() # the same json renderer the normal responses go through
+    yield b'['
+    first = True
+    for page in pages:
+        if not page:
+            continue
+        body = renderer.render(page)[1:-1] # a rendered list is "[...]", we only want what is inside
+        yield body if first else b',' + body
+        first = False
+    yield b']'
+
+# `serializer` is one of the fast serializers (fast_serializers.py), it serializes every chunk and loads the related rows for it
+def streaming_list(serializer, queryset, chunk_size=None):
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    rows = serializer.queryset(queryset).iterator(chunk_size=chunk_size) # on postgres this is a server side cursor, the rows are never all loaded
+    pages = (serializer.serialize(chunk) for chunk in chunks(rows, chunk_size))
+    return StreamingHttpResponse(stream_json_array(pages), content_type='application/json')
+
+def wants_stream(request):
+    return request.query_params.get('stream') in ('1', 'true')
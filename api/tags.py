@@ -0,0 +1,54 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from .models import PostTag, Tag
+from .pagination import KeysetPagination
+from .response_cache import bump_versions
+
+# Post.category stays what the client sends ("Kicks, Forms"), and every time a post is saved its tags are brought in line with
+# it (the post_save signal calls sync_post_tags). Tag.post_count is changed with F expressions as tags are added to and
+# removed from posts, so the tag list (getTags) is read straight from the column. "manage.py recount_post_counters" repairs it
+
+def parse_tags(category):
+    names = []
+    for name in (category or '').split(','):
+        name = ' '.join(name.split()).lower()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def change_post_count(tag_ids, delta):
+    Tag.objects.filter(pk__in=tag_ids).update(post_count=F('post_count') + delta)
+
+def sync_post_tags(post):
+    wanted = parse_tags(post.category)
+    current = dict(PostTag.objects.filter(post=post).values_list('tag__name', 'id'))
+    removed = [id for name, id in current.items() if name not in wanted]
+    if removed:
+        PostTag.objects.filter(id__in=removed).delete() # the post_delete signal of every row lowers its tag's count
+    added = [name for name in wanted if name not in current]
+    if added:
+        Tag.objects.bulk_create([Tag(name=name) for name in added], ignore_conflicts=True) # another post may have just made the same tag
+        tag_ids = list(Tag.objects.filter(name__in=added).values_list('id', flat=True))
+        PostTag.objects.bulk_create([PostTag(post=post, tag_id=tag_id, created=post.created) for tag_id in tag_ids])
+        change_post_count(tag_ids, 1)
+        bump_versions('tags')
+
+# Recount Tag.post_count from the PostTag rows, only the tags whose count is wrong are written. Returns how many were fixed
+def recount_tags():
+    posts = (PostTag.objects.filter(tag_id=OuterRef('pk'))
+        .order_by().values('tag_id').annotate(total=Count('*')).values('total'))
+    real_count = Coalesce(Subquery(posts, output_field=IntegerField()), Value(0))
+    tag_ids = list(Tag.objects.annotate(real_post_count=real_count).filter(~Q(post_count=F('real_post_count'))).values_list('pk', flat=True))
+    if tag_ids:
+        bump_versions('tags')
+    return Tag.objects.filter(pk__in=tag_ids).update(post_count=real_count)
+
+
+# The id of the tag for ?tag=, None when there is no such tag
+def find_tag(name):
+    names = parse_tags(name)
+    return Tag.objects.filter(name=names[0]).values_list('id', flat=True).first() if names else None
+
+# posts/?tag= walks the PostTag rows of the tag with the (tag, created, post) index, then loads the posts of the page
+class TagPagination(KeysetPagination):
+    ordering = ('created', 'post_id')
@@ -1,3 +1,1073 @@
-from django.test import TestCase
+import contextlib
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from azure.core.exceptions import AzureError, HttpResponseError
+from django.contrib.auth.models import User
+from django.core import checks, signing
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from . import comment_tree_cache, storage
+from .autocomplete import UsernameIndex
+from .blob_deletions import drain_blob_deletions, queue_blob_deletion
+from .comment_tree import CommentTree
+from .counters import recount_posts
+from .fast_serializers import FastPostSerializer, FastCommentSerializer, FastUserProfileSerializer
+from .likes import LikeBuffer
+from .models import BlobDeletion, FinishedUpload, LikeIntent, Post, Comment, PostRanking, Tag, UploadSession, UserProfile, ZipCentroid
+from .serializers import PostSerializer, CommentSerializer, UserProfileSerializer
+from .storage import upload_in_blocks
+from .tags import recount_tags
+from .trending import DECAY_SECONDS, refresh_rankings, trending_score
+
+
+# The fast .values() serializers of the list routes have to send exactly the same json as the DRF serializers, for every
+# ?fields=/?expand= combination, with an empty fragment cache (cold) and with every row already in it (warm)
+class SerializerParityTests(TestCase):
+    post_contexts = [
+        {},
+        {'fields': {'title', 'upload', 'like_count', 'comment_count'}},
+        {'expand': {'likes'}},
+        {'fields': {'id', 'title'}, 'expand': {'comments'}},
+        {'fields': {'title'}, 'expand': {'comments', 'likes'}},
+    ]
+    profile_contexts = [{}, {'fields': {'username', 'picture', 'first_name'}}]
+    page_size = 10
+
+    # every other comment is a reply (some are replies of replies), every post has 0-4 likes
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create(username=f'parity-{i}') for i in range(5)]
+        for i in range(25):
+            post = Post.objects.create(title=f'post {i}', category='Kicks, Forms', postDesc='Parity post é', username='parity', userId=users[i % 5],
+                upload=f'https://x.blob.core.windows.net/c/uploads/post-{i}.mp4' if i % 10 else '')
+            post.likes.add(*users[:i % 5])
+            parent = None
+            for j in range(i % 4):
+                parent = Comment.objects.create(post=post, parent=parent if j % 2 else None, commentDesc=f'comment {j}', userId=users[j], username='parity', checked=bool(j % 3))
+        for i in range(25):
+            UserProfile.objects.create(username=f'profile-{i}', first_name=None if i % 3 else 'First', picture=f'https://x.blob.core.windows.net/c/pictures/p-{i}.png', state='NY', zip_code='10001')
+
+    def setUp(self):
+        cache.clear() # the fragments of the last test would make the first pass warm
+
+    def pages(self, queryset):
+        ids = list(queryset.values_list('id', flat=True))
+        return [ids[start:start + self.page_size] for start in range(0, len(ids), self.page_size)]
+
+    def assertSameJson(self, expected, got, message):
+        self.assertEqual(JSONRenderer().render(expected).decode(), JSONRenderer().render(got).decode(), message)
+
+    def check(self, queryset, contexts, drf, fast):
+        for context in contexts:
+            for page in self.pages(queryset):
+                expected = drf(page, dict(context))
+                self.assertSameJson(expected, fast(page, dict(context)), f'cold {context}')
+                self.assertSameJson(expected, fast(page, dict(context)), f'warm {context}')
+
+    def test_posts(self):
+        def drf(ids, context):
+            posts = PostSerializer.sparse_queryset(Post.objects.filter(id__in=ids).order_by('created', 'id'), context)
+            return PostSerializer(posts, many=True, context=context).data
+        def fast(ids, context):
+            serializer = FastPostSerializer(context)
+            return serializer.serialize(serializer.queryset(Post.objects.filter(id__in=ids).order_by('created', 'id')))
+        self.check(Post.objects.order_by('created', 'id'), self.post_contexts, drf, fast)
+
+    def test_comments(self):
+        def drf(ids, context):
+            comments = list(Comment.objects.filter(id__in=ids).order_by('created', 'id'))
+            return CommentSerializer(comments, many=True, context={'comment_tree': CommentTree.for_comments(comments)}).data
+        def fast(ids, context):
+            serializer = FastCommentSerializer()
+            return serializer.serialize(serializer.queryset(Comment.objects.filter(id__in=ids).order_by('created', 'id')))
+        self.check(Comment.objects.order_by('created', 'id'), [{}], drf, fast)
+
+    def test_profiles(self):
+        def drf(ids, context):
+            profiles = UserProfileSerializer.sparse_queryset(UserProfile.objects.filter(id__in=ids).order_by('id'), context)
+            return UserProfileSerializer(profiles, many=True, context=context).data
+        def fast(ids, context):
+            serializer = FastUserProfileSerializer(context)
+            return serializer.serialize(serializer.queryset(UserProfile.objects.filter(id__in=ids).order_by('id')))
+        self.check(UserProfile.objects.order_by('id'), self.profile_contexts, drf, fast)
+
+    @override_settings(FRAGMENT_CACHE_SECONDS=0)
+    def test_posts_without_fragment_cache(self):
+        self.test_posts()
+        self.test_comments()
+
+    # a changed row gets a new fragment (its `updated` is in the key), the others come from the cache
+    def test_changed_rows_are_not_served_from_the_fragment_cache(self):
+        serializer = FastPostSerializer({})
+        posts = Post.objects.order_by('created', 'id')
+        serializer.serialize(serializer.queryset(posts))
+        post = posts[3]
+        Post.objects.filter(pk=post.pk).update(title='changed', updated=timezone.now())
+        data = FastPostSerializer({}).serialize(FastPostSerializer({}).queryset(posts))
+        self.assertEqual(data[3]['title'], 'changed')
+        self.assertSameJson(PostSerializer(PostSerializer.sparse_queryset(posts, {}), many=True, context={}).data, data, 'after a change')
+
+
+# a logged in client, the tests below go through the real routes
+class ApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tester')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, title='post', category='Kicks', postDesc='A post', **fields):
+        return Post.objects.create(title=title, category=category, postDesc=postDesc, username='tester', userId=self.user, **fields)
+
+    # follows the next links from the first page and returns the ids of every page
+    def walk(self, url):
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        return pages
+
+
+class KeysetPaginationTests(ApiTestCase):
+    """The cursor pages cover every row once, in order, and the previous link goes back to the page before."""
+
+    def test_next_links_walk_every_post_in_order(self):
+        posts = [self.create_post(f'post {i}') for i in range(7)]
+        pages = self.walk('/api/posts/?page_size=3')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [post.id for post in posts])
+
+    def test_previous_link_goes_back_a_page(self):
+        for i in range(7):
+            self.create_post(f'post {i}')
+        first = self.client.get('/api/posts/?page_size=3').json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([row['id'] for row in back['results']], [row['id'] for row in first['results']])
+
+    def test_invalid_cursor_is_a_404(self):
+        self.assertEqual(self.client.get('/api/posts/?cursor=nonsense').status_code, 404)
+
+
+class PostCounterTests(ApiTestCase):
+    """The like_count/comment_count follow the rows however they change, recount_posts fixes counts that drifted."""
+
+    def test_comment_count_follows_the_comments(self):
+        post = self.create_post()
+        comment = Comment.objects.create(post=post, commentDesc='top', userId=self.user, username='tester')
+        Comment.objects.create(post=post, parent=comment, commentDesc='reply', userId=self.user, username='tester')
+        post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((post.comment_count, comment.reply_count), (2, 1))
+        comment.delete() # the reply goes with it
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_like_count_follows_both_sides_of_the_likes(self):
+        post = self.create_post()
+        other = User.objects.create(username='other')
+        post.likes.add(self.user, other)
+        other.video_post.remove(post)
+        post.refresh_from_db()
+        self.assertEqual(post.like_count, 1)
+        post.likes.clear()
+        post.refresh_from_db()
+        self.assertEqual(post.like_count, 0)
+
+    def test_recount_fixes_drifted_counts(self):
+        post = self.create_post()
+        post.likes.add(self.user)
+        Post.objects.filter(pk=post.pk).update(like_count=5, comment_count=3)
+        self.assertEqual(recount_posts(), 1)
+        post.refresh_from_db()
+        self.assertEqual((post.like_count, post.comment_count), (1, 0))
+        self.assertEqual(recount_posts(), 0) # nothing left to fix
+
+
+class LikeBufferTests(ApiTestCase):
+    """The like routes only fill the buffer, a flush writes the last intent of every user once."""
+
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post()
+        self.buffer = LikeBuffer(auto_flush=False)
+        patcher = mock.patch('api.views.like_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_nothing_is_written_until_the_flush(self):
+        response = self.client.post(f'/api/posts/{self.post.id}/like')
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(self.post.likes.exists())
+        self.assertEqual(self.buffer.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, list(self.post.likes.all())), (1, [self.user]))
+
+    def test_the_last_request_of_a_user_wins(self):
+        for route in ('like', 'unlike', 'like', 'like'):
+            self.client.post(f'/api/posts/{self.post.id}/{route}')
+        self.buffer.flush()
+        self.client.post(f'/api/posts/{self.post.id}/unlike')
+        self.client.post(f'/api/posts/{self.post.id}/unlike')
+        self.buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.likes.count()), (0, 0))
+
+    def test_unknown_post_is_a_404(self):
+        self.assertEqual(self.client.post('/api/posts/999999/like').status_code, 404)
+        self.assertFalse(LikeIntent.objects.exists())
+
+    def test_full_buffer_flushes_right_away(self):
+        buffer = LikeBuffer(max_pending=2, auto_flush=False)
+        other = User.objects.create(username='other')
+        buffer.record(self.post.id, self.user.id, True)
+        buffer.record(self.post.id, other.id, True)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 2)
+
+    def test_intents_outlive_the_buffer_that_recorded_them(self):
+        # a like taken by one worker and an unlike taken by another, the worker that took the like dies before flushing
+        LikeBuffer(auto_flush=False).record(self.post.id, self.user.id, True)
+        self.buffer.record(self.post.id, self.user.id, False)
+        other = User.objects.create(username='other')
+        LikeBuffer(auto_flush=False).record(self.post.id, other.id, True)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertFalse(LikeIntent.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, list(self.post.likes.all())), (1, [other]))
+
+    def test_flush_in_batches(self):
+        buffer = LikeBuffer(max_pending=2, auto_flush=False)
+        users = [User.objects.create(username=f'fan{i}') for i in range(5)]
+        for user in users:
+            LikeIntent.objects.create(post=self.post, user=user, liked=True)
+        self.assertEqual(buffer.flush(), 5)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 5)
+
+
+# stands in for an azure blob client, keeps the staged blocks and how many were being sent at once
+class FakeBlobClient:
+    url = 'https://x.blob.core.windows.net/c/uploads/clip.mp4'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}
+        self.sending = self.most_sending = 0
+        self.committed = None
+
+    def stage_block(self, block_id, data, length=None):
+        with self.lock:
+            self.sending += 1
+            self.most_sending = max(self.most_sending, self.sending)
+        time.sleep(0.005) # slow enough that the request body comes in faster than the blocks go out
+        with self.lock:
+            self.sending -= 1
+            self.blocks[block_id] = data
+
+    def commit_block_list(self, blocks, content_settings=None):
+        self.committed = b''.join(self.blocks[block.id] for block in blocks)
+
+
+@override_settings(STREAM_UPLOAD_BLOCK_SIZE=64 * 1024, STREAM_UPLOAD_CONCURRENCY=2)
+class StreamedUploadTests(ApiTestCase):
+    """Create post streams the file into azure a block at a time, never more than STREAM_UPLOAD_CONCURRENCY at once."""
+
+    def setUp(self):
+        super().setUp()
+        self.blob_client = FakeBlobClient()
+        patcher = mock.patch('api.upload_handlers.get_blob_client', return_value=self.blob_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, content, name='clip.mp4'):
+        data = {'title': 'clip', 'category': 'Kicks', 'postDesc': 'A clip', 'username': 'tester'}
+        return self.client.post('/api/posts/create', {'upload': SimpleUploadedFile(name, content), 'data': json.dumps(data)}, format='multipart')
+
+    def test_file_is_sent_in_bounded_blocks(self):
+        content = b'\x00\x00\x00\x18ftypmp42' + os.urandom(1024 * 1024)
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Post.objects.get().upload.name, self.blob_client.url)
+        self.assertEqual(self.blob_client.committed, content)
+        self.assertLessEqual(max(len(block) for block in self.blob_client.blocks.values()), 64 * 1024)
+        self.assertLessEqual(self.blob_client.most_sending, 2)
+
+    def test_file_that_isnt_a_video_is_rejected(self):
+        response = self.upload(b'not a video at all' * 100)
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(self.blob_client.committed)
+        self.assertFalse(Post.objects.exists())
+
+
+class BlobDeletionTests(ApiTestCase):
+    """Deleting a post only queues its blob, the drain deletes the queued blobs and keeps the ones that failed for later."""
+
+    def setUp(self):
+        super().setUp()
+        self.container_client = mock.Mock()
+        patcher = mock.patch('api.blob_deletions.get_container_client', return_value=self.container_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_deleted_post_queues_its_blob(self):
+        post = self.create_post(upload='https://x.blob.core.windows.net/c/uploads/clip.mp4')
+        self.assertEqual(self.client.delete(f'/api/posts/{post.id}/delete').status_code, 200)
+        self.assertEqual(list(BlobDeletion.objects.values_list('blob_name', flat=True)), ['uploads/clip.mp4'])
+        self.container_client.delete_blobs.return_value = [mock.Mock(status_code=202)]
+        self.assertEqual(drain_blob_deletions(), (1, 0))
+        self.container_client.delete_blobs.assert_called_once_with('uploads/clip.mp4', raise_on_any_failure=False)
+        self.assertFalse(BlobDeletion.objects.exists())
+
+    def test_failed_blobs_are_retried_later(self):
+        queue_blob_deletion('uploads/a.mp4', 'uploads/b.mp4')
+        self.container_client.delete_blobs.return_value = [mock.Mock(status_code=202), mock.Mock(status_code=500, reason='Server Error')]
+        self.assertEqual(drain_blob_deletions(), (1, 1))
+        row = BlobDeletion.objects.get()
+        self.assertEqual((row.blob_name, row.attempts, row.last_error), ('uploads/b.mp4', 1, '500 Server Error'))
+        self.assertGreater(row.next_attempt, timezone.now())
+        self.assertEqual(drain_blob_deletions(), (0, 0)) # not due yet
+
+
+@override_settings(RESPONSE_CACHE_SECONDS=300)
+class ResponseCacheTests(ApiTestCase):
+    """A read is served from the cache until a write moves the version of what it shows."""
+
+    def test_second_read_is_a_hit(self):
+        self.create_post('cached')
+        first = self.client.get('/api/posts/')
+        second = self.client.get('/api/posts/')
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.content, second.content)
+
+    def test_a_change_is_never_served_from_the_old_entry(self):
+        post = self.create_post('before')
+        self.client.get(f'/api/posts/{post.id}')
+        with self.captureOnCommitCallbacks(execute=True): # the versions are bumped once the write commits
+            post.title = 'after'
+            post.save()
+        response = self.client.get(f'/api/posts/{post.id}')
+        self.assertEqual((response['X-Cache'], response.json()['title']), ('MISS', 'after'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=post, commentDesc='new', userId=self.user, username='tester')
+        response = self.client.get(f'/api/posts/{post.id}')
+        self.assertEqual((response['X-Cache'], response.json()['comment_count']), ('MISS', 1))
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.client.get('/api/posts/999999/comments/').status_code, 404)
+        self.assertEqual(self.client.get('/api/posts/999999/comments/')['X-Cache'], 'MISS')
+
+    @override_settings(SHARED_CACHE=False)
+    def test_warning_without_a_shared_cache(self):
+        self.assertEqual([warning.id for warning in checks.run_checks(tags=['caches'])], ['api.W001'])
+        with override_settings(RESPONSE_CACHE_SECONDS=0):
+            self.assertEqual([warning.id for warning in checks.run_checks(tags=['caches'])], [])
+            self.assertEqual([warning.id for warning in checks.run_checks(tags=['caches'], include_deployment_checks=True)], ['api.W002'])
+
+    @override_settings(RESPONSE_CACHE_SECONDS=0)
+    def test_turned_off(self):
+        self.create_post()
+        self.client.get('/api/posts/')
+        self.assertNotIn('X-Cache', self.client.get('/api/posts/'))
+
+
+class ConditionalGetTests(ApiTestCase):
+    """A client that sends back the ETag (or Last-Modified of one post) gets 304 until something it shows changed."""
+
+    def test_list_etag(self):
+        post = self.create_post()
+        etag = self.client.get('/api/posts/')['ETag']
+        self.assertEqual(self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(post=post, commentDesc='new', userId=self.user, username='tester')
+        self.assertEqual(self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    # a deleted row doesnt move the newest `updated`, only the etag has the row count
+    def test_lists_have_no_last_modified(self):
+        first = self.create_post()
+        self.create_post()
+        Post.objects.update(updated=timezone.now() - timedelta(minutes=5))
+        response = self.client.get('/api/posts/')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        first.delete()
+        self.assertEqual(self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_one_post_has_last_modified_once_its_second_is_over(self):
+        post = self.create_post()
+        Post.objects.filter(pk=post.pk).update(updated=timezone.now() + timedelta(seconds=5)) # still in its second, whenever the test runs
+        self.assertNotIn('Last-Modified', self.client.get(f'/api/posts/{post.id}'))
+        Post.objects.filter(pk=post.pk).update(updated=timezone.now() - timedelta(minutes=5))
+        last_modified = self.client.get(f'/api/posts/{post.id}')['Last-Modified']
+        self.assertEqual(self.client.get(f'/api/posts/{post.id}', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_every_page_has_its_own_etag(self):
+        for i in range(3):
+            self.create_post(f'post {i}')
+        first = self.client.get('/api/posts/?page_size=2')
+        second = self.client.get(first.json()['next'])
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+
+class SparseFieldsetTests(ApiTestCase):
+    """?fields= only sends those fields, the comments and likes only come with ?expand= once ?fields= is used."""
+
+    def test_fields(self):
+        post = self.create_post('sparse')
+        self.assertEqual(self.client.get('/api/posts/?fields=id,title').json()['results'], [{'id': post.id, 'title': 'sparse'}])
+        self.assertEqual(self.client.get(f'/api/posts/{post.id}?fields=title').json(), {'title': 'sparse'})
+
+    def test_expand(self):
+        post = self.create_post()
+        post.likes.add(self.user)
+        data = self.client.get(f'/api/posts/{post.id}?fields=title&expand=likes').json()
+        self.assertEqual(data, {'title': 'post', 'likes': [self.user.id]})
+
+    def test_without_fields_everything_is_sent(self):
+        post = self.create_post()
+        self.assertEqual(set(self.client.get(f'/api/posts/{post.id}').json()), set(PostSerializer(post).data))
+
+
+@override_settings(STREAM_CHUNK_SIZE=2) # more than one chunk
+class StreamedListTests(ApiTestCase):
+    """?stream=1 sends the same json as the pages, one chunk at a time."""
+
+    def test_comments(self):
+        post = self.create_post()
+        for i in range(5):
+            Comment.objects.create(post=post, commentDesc=f'comment {i}', userId=self.user, username='tester')
+        response = self.client.get('/api/comments/?stream=1')
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        paged = self.client.get('/api/comments/?page_size=100').json()['results']
+        self.assertEqual(streamed, paged)
+
+    def test_profiles(self):
+        for i in range(5):
+            UserProfile.objects.create(username=f'profile-{i}', picture='https://x.blob.core.windows.net/c/pictures/p.png')
+        response = self.client.get('/api/userProfiles/?stream=1')
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), self.client.get('/api/userProfiles/').json())
+
+    def test_empty(self):
+        self.assertEqual(b''.join(self.client.get('/api/comments/?stream=1').streaming_content), b'[]')
+
+
+@override_settings(COMPRESS_MIN_BYTES=200)
+class CompressionTests(ApiTestCase):
+    """A compressed response decodes to the same json, with a weak etag and Vary: Accept-Encoding."""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(10):
+            self.create_post(f'post {i}')
+
+    def test_gzip(self):
+        plain = self.client.get('/api/posts/')
+        response = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/api/tags/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(RESPONSE_CACHE_SECONDS=300)
+    def test_cached_response_is_sent_precompressed(self):
+        miss = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        hit = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((hit['X-Cache'], hit['Content-Encoding'], hit['ETag']), ('HIT', 'gzip', miss['ETag']))
+        self.assertEqual(gzip.decompress(hit.content), gzip.decompress(miss.content))
+
+
+@override_settings(RESPONSE_CACHE_SECONDS=300, SINGLE_FLIGHT_WAIT=0, COMPRESS_MIN_BYTES=10)
+class SingleFlightTests(ApiTestCase):
+    """While one request rebuilds a hot post, the others get the last response with the validators of THAT body."""
+
+    def test_stale_response_keeps_its_own_etag(self):
+        post = self.create_post('before')
+        Post.objects.filter(pk=post.pk).update(postDesc='A long description ' * 100, updated=timezone.now() - timedelta(minutes=5)) # always worth compressing
+        first = self.client.get(f'/api/posts/{post.id}', HTTP_ACCEPT_ENCODING='gzip')
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'after'
+            post.save()
+        add = cache.add
+        locked = lambda key, *args, **kwargs: False if key.startswith('lock:') else add(key, *args, **kwargs)
+        with mock.patch('api.response_cache.cache.add', side_effect=locked): # someone else holds the rebuild lock
+            stale = self.client.get(f'/api/posts/{post.id}', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((stale['X-Cache'], stale['Content-Encoding']), ('STALE', 'gzip'))
+        self.assertEqual(json.loads(gzip.decompress(stale.content))['title'], 'before')
+        self.assertEqual((stale['ETag'], stale['Last-Modified']), (first['ETag'], first['Last-Modified']))
+        self.assertTrue(stale['ETag'].startswith('W/"'))
+
+        fresh = self.client.get(f'/api/posts/{post.id}', HTTP_IF_NONE_MATCH=stale['ETag'])
+        self.assertEqual((fresh.status_code, fresh.json()['title']), (200, 'after'))
+
+    def test_rebuilt_once_the_lock_is_free(self):
+        post = self.create_post()
+        self.client.get(f'/api/posts/{post.id}')
+        self.assertEqual(self.client.get(f'/api/posts/{post.id}')['X-Cache'], 'HIT')
+
+
+class CommentTreeCacheTests(ApiTestCase):
+    """The signals patch the cached comment tree, and a tree that missed a patch (another worker made the change) is rebuilt."""
+
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post()
+        self.top = Comment.objects.create(post=self.post, commentDesc='top', userId=self.user, username='tester')
+        self.reply = Comment.objects.create(post=self.post, parent=self.top, commentDesc='reply', userId=self.user, username='tester')
+
+    def comments(self):
+        return self.client.get(f'/api/posts/{self.post.id}/comments/').json()['results']
+
+    def expected(self):
+        comments = list(Comment.objects.filter(post=self.post).order_by('created', 'id'))
+        return CommentSerializer(comments, many=True, context={'comment_tree': CommentTree.for_comments(comments)}).data
+
+    def test_patched_tree_matches_the_database(self):
+        self.comments() # cache the tree
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, parent=self.reply, commentDesc='nested', userId=self.user, username='tester')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.top.commentDesc = 'edited'
+            self.top.save()
+        self.assertEqual(self.comments(), self.expected())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reply.delete() # and the nested reply with it
+        self.assertEqual(self.comments(), self.expected())
+        self.assertEqual(comment_tree_cache.get_tree(self.post.id)['comments'].keys(), {self.top.id})
+
+    def test_change_from_another_worker_is_not_hidden(self):
+        self.comments()
+        # the patch would only run in the worker that made the change, here it is never run at all
+        Comment.objects.filter(pk=self.reply.pk).update(commentDesc='edited elsewhere', updated=timezone.now())
+        self.assertEqual(self.comments()[0]['replies'][0]['commentDesc'], 'edited elsewhere')
+        Comment.objects.filter(pk=self.reply.pk).delete()
+        self.assertEqual(self.comments(), self.expected())
+
+
+class CommentThreadTests(ApiTestCase):
+    """A thread page has the top level comments with their reply_count and first few replies, the rest are paged."""
+
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post()
+        self.threads = [Comment.objects.create(post=self.post, commentDesc=f'thread {i}', userId=self.user, username='tester') for i in range(3)]
+        self.replies = [Comment.objects.create(post=self.post, parent=self.threads[0], commentDesc=f'reply {i}', userId=self.user, username='tester') for i in range(5)]
+        Comment.objects.create(post=self.post, parent=self.replies[0], commentDesc='nested', userId=self.user, username='tester')
+
+    def test_threads(self):
+        data = self.client.get(f'/api/posts/{self.post.id}/threads/?replies=2').json()
+        self.assertEqual([comment['id'] for comment in data['results']], [comment.id for comment in self.threads])
+        first = data['results'][0]
+        self.assertEqual(first['reply_count'], 5)
+        self.assertEqual([reply['id'] for reply in first['replies']], [reply.id for reply in self.replies[:2]])
+        self.assertEqual((first['replies'][0]['reply_count'], first['replies'][0]['replies']), (1, []))
+        self.assertEqual(data['results'][1]['replies'], [])
+
+    def test_load_more_replies(self):
+        url = f'/api/posts/{self.post.id}/comments/{self.threads[0].id}/replies/?page_size=2&replies=1'
+        self.assertEqual(sum(self.walk(url), []), [reply.id for reply in self.replies])
+        first = self.client.get(url).json()['results'][0]
+        self.assertEqual([reply['commentDesc'] for reply in first['replies']], ['nested'])
+
+    def test_replies_of_a_comment_of_another_post(self):
+        other = self.create_post()
+        self.assertEqual(self.client.get(f'/api/posts/{other.id}/comments/{self.threads[0].id}/replies/').status_code, 404)
+
+
+class PostSearchTests(ApiTestCase):
+    """The search index follows every write to the posts, the best match comes first."""
+
+    def search(self, text):
+        response = self.client.get('/api/posts/search', {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return [post['title'] for post in response.json()['results']]
+
+    def test_best_match_first(self):
+        self.create_post('Forms practice', postDesc='A roundhouse kick at the end')
+        self.create_post('Roundhouse kick basics', category='Kicks')
+        self.create_post('Breakfalls')
+        self.assertEqual(self.search('roundhouse kicks'), ['Roundhouse kick basics', 'Forms practice'])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = self.create_post('Sparring drills')
+        Post.objects.filter(pk=post.pk).update(title='Grappling drills')
+        self.assertEqual(self.search('sparring'), [])
+        self.assertEqual(self.search('grappling'), ['Grappling drills'])
+        post.delete()
+        self.assertEqual(self.search('grappling'), [])
+
+    def test_any_text_is_safe(self):
+        self.create_post('Kata')
+        for text in ('"kata', 'kata OR', 'NEAR(', '*', "kata's -"):
+            self.search(text)
+
+    def test_missing_text(self):
+        self.assertEqual(self.client.get('/api/posts/search?q=%20').status_code, 400)
+
+    def test_database_without_a_search_index(self):
+        self.create_post('Roundhouse kick basics', category='Kicks')
+        self.create_post('Forms practice', postDesc='Ends with a roundhouse kick')
+        self.create_post('Roundhouse drills', category='Sparring')
+        with mock.patch('api.search.connection', mock.Mock(vendor='mysql')):
+            self.assertEqual(self.search('roundhouse KICK'), ['Forms practice', 'Roundhouse kick basics'])
+
+
+class TagTests(ApiTestCase):
+    """The tags follow the category of every post, with their post counts, and ?tag= pages through one tag's posts."""
+
+    def tags(self):
+        return {tag['name']: tag['post_count'] for tag in self.client.get('/api/tags/').json()}
+
+    def test_tags_follow_the_category(self):
+        post = self.create_post(category='Kicks, Forms')
+        self.create_post(category=' kicks ,Sparring,kicks')
+        self.assertEqual(self.tags(), {'kicks': 2, 'forms': 1, 'sparring': 1})
+        post.category = 'Forms, Weapons'
+        post.save()
+        self.assertEqual(self.tags(), {'kicks': 1, 'forms': 1, 'sparring': 1, 'weapons': 1})
+        post.delete()
+        self.assertEqual(self.tags(), {'kicks': 1, 'sparring': 1})
+
+    def test_tag_filter(self):
+        tagged = [self.create_post(f'kicks {i}', category='Kicks') for i in range(3)]
+        self.create_post('forms', category='Forms')
+        self.assertEqual(sum(self.walk('/api/posts/?tag=KICKS&page_size=2'), []), [post.id for post in tagged])
+        self.assertEqual(self.client.get('/api/posts/?tag=nothing').json()['results'], [])
+
+    def test_recount(self):
+        self.create_post(category='Kicks')
+        Tag.objects.update(post_count=7)
+        self.assertEqual(recount_tags(), 1)
+        self.assertEqual(self.tags(), {'kicks': 1})
+
+
+class DirectoryTests(ApiTestCase):
+    """The directory filters page in id order, ?near= only keeps the profiles within the radius, closest first."""
+
+    gazetteer = 'GEOID\tALAND\tINTPTLAT\tINTPTLONG\n10001\t1\t40.750633\t-73.997177\n07030\t1\t40.745098\t-74.027922\n11201\t1\t40.694196\t-73.990506\n19103\t1\t39.952416\t-75.172920\n94103\t1\t37.772623\t-122.411025\n'
+
+    def setUp(self):
+        super().setUp()
+        for name, art, belt, state, zip_code in [('nyc-bjj', 'BJJ', 'Blue', 'NY', '10001'), ('nyc-karate', 'Karate', 'Black', 'NY', '10001-1234'),
+                ('hoboken', 'BJJ', 'Black', 'NJ', '07030'), ('brooklyn', 'BJJ', 'Blue', 'NY', '11201'), ('philly', 'BJJ', 'Blue', 'PA', '19103'), ('sf', 'BJJ', 'Blue', 'CA', '94103')]:
+            UserProfile.objects.create(username=name, martialArt=art, beltLevel=belt, state=state, zip_code=zip_code,
+                picture='https://x.blob.core.windows.net/c/pictures/p.png')
+
+    def load_centroids(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+            file.write(self.gazetteer)
+        self.addCleanup(os.remove, file.name)
+        call_command('load_zip_centroids', file.name, stdout=io.StringIO())
+
+    def directory(self, query):
+        return self.client.get('/api/userProfiles/directory?' + query)
+
+    # every profile of every page, two at a time so the cursor is used too
+    def profiles_of(self, query):
+        url, profiles = f'/api/userProfiles/directory?{query}&page_size=2', []
+        while url:
+            data = self.client.get(url).json()
+            profiles += data['results']
+            url = data['next']
+        return profiles
+
+    def names(self, query):
+        return [profile['username'] for profile in self.profiles_of(query)]
+
+    def test_filters(self):
+        self.assertEqual(self.names('martialArt=BJJ&beltLevel=Blue&state=NY'), ['nyc-bjj', 'brooklyn'])
+        self.assertEqual(self.names('state=NY'), ['nyc-bjj', 'nyc-karate', 'brooklyn'])
+        self.assertEqual(self.names('beltLevel=Black'), ['nyc-karate', 'hoboken'])
+        self.assertEqual(self.names('zip_code=10001'), ['nyc-bjj', 'nyc-karate'])
+
+    def test_zip_code_follows_the_profile(self):
+        profile = UserProfile.objects.get(username='philly')
+        profile.zip_code = '10001-5678'
+        profile.save(update_fields=['zip_code'])
+        self.assertEqual(self.names('zip_code=10001'), ['nyc-bjj', 'nyc-karate', 'philly'])
+
+    def test_near(self):
+        self.load_centroids()
+        profiles = self.profiles_of('near=10001&radius=10')
+        self.assertEqual([profile['username'] for profile in profiles], ['nyc-bjj', 'nyc-karate', 'hoboken', 'brooklyn'])
+        self.assertEqual([profile['distance'] for profile in profiles[:2]], [0, 0])
+        self.assertAlmostEqual(profiles[2]['distance'], 1.62, delta=0.1)
+        self.assertEqual(self.names('near=10001&radius=100&martialArt=BJJ&state=PA'), ['philly'])
+
+    def test_bundled_centroids(self):
+        self.assertGreater(ZipCentroid.objects.count(), 40000) # loaded by the migrations
+        self.assertEqual(self.names('near=10001&radius=5'), ['nyc-bjj', 'nyc-karate', 'hoboken', 'brooklyn'])
+
+    def test_near_errors(self):
+        for query in ('near=10001&radius=far', 'near=10001&radius=500', 'near=10001&radius=0', 'near=00000'):
+            self.assertEqual(self.directory(query).status_code, 400, query)
+        ZipCentroid.objects.all().delete()
+        with self.assertLogs('api.directory', 'WARNING'):
+            self.assertEqual(self.directory('near=10001').json(), {'error': 'Searching near a zip code is not available yet'})
+
+
+class UsernameAutocompleteTests(ApiTestCase):
+    """The usernames that start with what was typed, from the index in memory, which follows the users and profiles."""
+
+    def setUp(self):
+        super().setUp()
+        for name in ('Bruce', 'brandon', 'Bram', 'chuck'):
+            User.objects.create(username=name)
+        UserProfile.objects.create(username='Bruce', picture='https://x.blob.core.windows.net/c/pictures/p.png')
+        self.index = UsernameIndex(rebuild_seconds=60, max_age=600)
+        for target in ('api.views.username_index', 'api.signals.username_index'):
+            patcher = mock.patch(target, self.index)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def search(self, query):
+        return self.client.get('/api/users/autocomplete', query).json()
+
+    def test_prefix(self):
+        self.assertEqual(self.search({'q': 'BR'}), ['Bram', 'brandon', 'Bruce'])
+        self.assertEqual(self.search({'q': 'bra', 'limit': 1}), ['Bram'])
+        self.assertEqual(self.search({'q': 'x'}), [])
+        self.assertEqual(self.search({'q': ''}), [])
+
+    def test_changes_in_this_worker(self):
+        self.search({'q': 'b'})
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create(username='Brock')
+            User.objects.filter(username='Bruce').get().delete() # the profile still has the name
+            profile = UserProfile.objects.get()
+            profile.username = 'Bruno'
+            profile.save()
+        with mock.patch('api.autocomplete.usernames_stamp') as stamp: # answered from the patched index, not rebuilt
+            self.assertEqual(self.search({'q': 'br'}), ['Bram', 'brandon', 'Brock', 'Bruno'])
+            stamp.assert_not_called()
+
+    def test_changes_from_another_worker(self):
+        self.search({'q': 'b'})
+        self.index.rebuild_seconds = 0
+        UserProfile.objects.create(username='Brett', picture='https://x.blob.core.windows.net/c/pictures/p.png') # no patch ran here
+        self.assertIn('Brett', self.search({'q': 'br'}))
+        User.objects.filter(username='chuck').update(username='Brad') # no signal and no stamp change, only max_age finds it
+        self.assertNotIn('Brad', self.search({'q': 'br'}))
+        self.index.max_age = 0
+        self.assertEqual(self.search({'q': 'br'}), ['Brad', 'Bram', 'brandon', 'Brett', 'Bruce'])
+
+
+class TrendingTests(ApiTestCase):
+    """?sort=trending pages through the scores written by refresh_trending, a refresh only rescores the changed posts."""
+
+    def test_score(self):
+        now = timezone.now()
+        self.assertGreater(trending_score(1, 0, now), trending_score(0, 0, now))
+        self.assertGreater(trending_score(0, 1, now), trending_score(1, 0, now))
+        self.assertGreater(trending_score(0, 0, now), trending_score(0, 0, now - timedelta(hours=1)))
+        self.assertAlmostEqual(trending_score(9, 0, now) - trending_score(9, 0, now - timedelta(seconds=DECAY_SECONDS)), 1, places=6) # the scores are rounded to 7 digits
+
+    def test_feed_order(self):
+        quiet, liked, discussed = self.create_post('quiet'), self.create_post('liked'), self.create_post('discussed')
+        Post.objects.update(created=timezone.now() - timedelta(hours=1))
+        old = self.create_post('old')
+        Post.objects.filter(pk=old.pk).update(created=timezone.now() - timedelta(days=3), like_count=50)
+        Post.objects.filter(pk=liked.pk).update(like_count=3)
+        Post.objects.filter(pk=discussed.pk).update(comment_count=3)
+        self.assertEqual(refresh_rankings(), 4)
+        self.assertEqual(sum(self.walk('/api/posts/?sort=trending&page_size=3'), []), [discussed.id, liked.id, quiet.id, old.id])
+
+    def test_only_changed_posts_are_rescored(self):
+        posts = [self.create_post(f'post {i}') for i in range(3)]
+        refresh_rankings()
+        Post.objects.update(updated=timezone.now() - timedelta(hours=1))
+        PostRanking.objects.update(refreshed=timezone.now() - timedelta(minutes=30))
+        etag = self.client.get('/api/posts/?sort=trending')['ETag']
+        posts[2].likes.add(self.user)
+        self.assertEqual(refresh_rankings(), 1)
+        self.assertEqual(self.client.get('/api/posts/?sort=trending').json()['results'][0]['id'], posts[2].id)
+        self.assertEqual(self.client.get('/api/posts/?sort=trending', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(refresh_rankings(full=True), 3)
+
+    def test_posts_that_were_not_scored_yet(self):
+        self.create_post()
+        self.assertEqual(self.client.get('/api/posts/?sort=trending').json()['results'], [])
+
+
+class CommentTreeTests(ApiTestCase):
+    """The comments of a post and all of their replies come from one query, however deep the tree is."""
+
+    def add_comments(self, post, count):
+        parent = None
+        for i in range(count):
+            parent = Comment.objects.create(post=post, parent=parent if i % 3 else None, commentDesc=f'comment {i}', userId=self.user, username='tester')
+
+    def queries(self, post):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/posts/{post.id}')
+        return len(queries)
+
+    def test_query_count_doesnt_grow_with_the_comments(self):
+        small, big = self.create_post(), self.create_post()
+        self.add_comments(small, 2)
+        self.add_comments(big, 30)
+        self.assertEqual(self.queries(small), self.queries(big))
+
+    def test_replies_are_nested(self):
+        post = self.create_post()
+        self.add_comments(post, 3)
+        comments = self.client.get(f'/api/posts/{post.id}').json()['comments']
+        self.assertEqual([comment['commentDesc'] for comment in comments], ['comment 0', 'comment 1', 'comment 2'])
+        self.assertEqual(comments[0]['replies'][0]['commentDesc'], 'comment 1')
+        self.assertEqual(comments[0]['replies'][0]['replies'][0]['commentDesc'], 'comment 2')
+
+
+# the well known connection string of the local storage emulator (Azurite), nothing is sent to it
+AZURITE = ('DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;'
+    'AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==')
+
+class SharedBlobClientTests(TestCase):
+    """Every view of a worker shares one container client, built the first time it is needed."""
+
+    def setUp(self):
+        patcher = mock.patch('api.storage._container_client', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_built_once(self):
+        with mock.patch('api.storage.build_container_client', side_effect=lambda: mock.Mock()) as build:
+            threads = [threading.Thread(target=storage.get_blob_client, args=(f'uploads/{i}.mp4',)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertIs(storage.get_container_client(), storage.get_container_client())
+        build.assert_called_once()
+
+    def test_blob_clients_share_the_connection_pool(self):
+        container_client = storage.build_container_client(AZURITE, 'test')
+        sessions = {id(self.session(container_client.get_blob_client(name))) for name in ('a', 'b')}
+        self.assertEqual(sessions, {id(self.session(container_client))})
+
+    # the requests session under the wrappers the sdk puts around the transport
+    def session(self, client):
+        transport = client._pipeline._transport
+        while not hasattr(transport, 'session'):
+            transport = transport._transport
+        return transport.session
+
+
+@override_settings(AZURE_RETRY_BACKOFF=0)
+class BlockUploadTests(TestCase):
+    """A file goes to azure as blocks sent in parallel, each block retried on its own, and one commit in order."""
+
+    def test_blocks_are_committed_in_order(self):
+        blob_client = FakeBlobClient()
+        content = os.urandom(100 * 1024 + 7)
+        upload_in_blocks(blob_client, io.BytesIO(content), block_size=8 * 1024, concurrency=4)
+        self.assertEqual(blob_client.committed, content)
+        self.assertEqual(len(blob_client.blocks), 13)
+        self.assertGreater(blob_client.most_sending, 1)
+        self.assertLessEqual(blob_client.most_sending, 4)
+
+    def test_a_failed_block_is_retried(self):
+        blob_client = FakeBlobClient()
+        stage_block, failures = blob_client.stage_block, []
+        def flaky(block_id, data, length=None):
+            if block_id not in failures: # every block fails once
+                failures.append(block_id)
+                raise AzureError('connection reset')
+            return stage_block(block_id, data, length)
+        blob_client.stage_block = flaky
+        upload_in_blocks(blob_client, io.BytesIO(b'x' * 3000), block_size=1000, concurrency=2)
+        self.assertEqual((blob_client.committed, len(failures)), (b'x' * 3000, 3))
+
+    @override_settings(AZURE_UPLOAD_BLOCK_RETRIES=1)
+    def test_nothing_is_committed_when_a_block_keeps_failing(self):
+        blob_client = FakeBlobClient()
+        blob_client.stage_block = mock.Mock(side_effect=AzureError('down'))
+        with self.assertRaises(AzureError):
+            upload_in_blocks(blob_client, io.BytesIO(b'x' * 3000), block_size=1000)
+        self.assertIsNone(blob_client.committed)
+
+
+# stands in for a blob the client uploaded straight to azure
+def uploaded_blob(content, content_type, url='https://x.blob.core.windows.net/c/uploads/clip.mp4'):
+    blob_client = mock.Mock(url=url)
+    blob_client.get_blob_properties.return_value = mock.Mock(size=len(content), content_settings=mock.Mock(content_type=content_type))
+    blob_client.download_blob.side_effect = lambda offset, length: mock.Mock(readall=lambda: content[offset:offset + length])
+    return blob_client
+
+
+class DirectUploadTests(ApiTestCase):
+    """The client gets a short lived url for one new blob, and finalize only accepts a token for a file that really is there."""
+
+    post_data = {'title': 'direct', 'category': 'Kicks', 'postDesc': 'Uploaded directly', 'username': 'tester'}
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.storage._container_client', storage.build_container_client(AZURITE, 'test'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload_url(self, kind='post', filename='clip.mp4'):
+        return self.client.post('/api/uploads/url', {'kind': kind, 'filename': filename}, format='json')
+
+    def finalize(self, token, blob_client):
+        with mock.patch('api.views.get_blob_client', return_value=blob_client):
+            return self.client.post('/api/posts/finalize', {'upload_token': token, 'data': self.post_data}, format='json')
+
+    def test_upload_url(self):
+        data = self.upload_url().json()
+        self.assertTrue(data['blob_name'].startswith('uploads/') and data['blob_name'].endswith('-clip.mp4'))
+        self.assertIn(data['blob_name'] + '?', data['upload_url'])
+        self.assertIn('sp=cw', data['upload_url']) # create and write only
+        self.assertEqual(data['headers']['x-ms-blob-content-type'], 'video/mp4')
+        self.assertEqual(self.upload_url(filename='notes.txt').status_code, 400)
+        self.assertEqual(self.upload_url(kind='other').status_code, 400)
+
+    def test_finalize(self):
+        token = self.upload_url().json()['upload_token']
+        response = self.finalize(token, uploaded_blob(b'\x00\x00\x00\x18ftypmp42....', 'video/mp4'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.objects.get().title, 'direct')
+        self.assertEqual(self.finalize(token, uploaded_blob(b'\x00\x00\x00\x18ftypmp42....', 'video/mp4')).status_code, 409) # used once
+
+    def test_bad_uploads_are_rejected_and_deleted(self):
+        for blob_client in (uploaded_blob(b'<html>not a video</html>', 'video/mp4'), uploaded_blob(b'\x00\x00\x00\x18ftypmp42', 'text/html')):
+            token = self.upload_url().json()['upload_token']
+            self.assertEqual(self.finalize(token, blob_client).status_code, 400)
+        self.assertEqual(BlobDeletion.objects.count(), 2)
+        self.assertFalse(Post.objects.exists())
+
+    def test_rejected_token_cant_be_tried_again(self):
+        token = self.upload_url().json()['upload_token']
+        self.assertEqual(self.finalize(token, uploaded_blob(b'<html>not a video</html>', 'video/mp4')).status_code, 400)
+        response = self.finalize(token, uploaded_blob(b'\x00\x00\x00\x18ftypmp42....', 'video/mp4')) # the same blob uploaded again through the url
+        self.assertEqual(response.json(), {'error': 'This upload was rejected, ask for a new upload url'})
+        self.assertFalse(Post.objects.exists())
+
+    def test_finalize_that_lost_the_race(self):
+        token = self.upload_url().json()['upload_token']
+        # the other request creates its row after our check but before our insert
+        with mock.patch('api.views.FinishedUpload.objects.filter', return_value=FinishedUpload.objects.none()):
+            FinishedUpload.objects.create(blob_name=signing.loads(token, salt='direct-upload')['blob'])
+            self.assertEqual(self.finalize(token, uploaded_blob(b'\x00\x00\x00\x18ftypmp42....', 'video/mp4')).status_code, 409)
+        self.assertFalse(Post.objects.exists())
+
+    def test_old_finished_uploads_are_forgotten(self):
+        FinishedUpload.objects.create(blob_name='uploads/new.mp4')
+        old = FinishedUpload.objects.create(blob_name='uploads/old.mp4')
+        FinishedUpload.objects.filter(id=old.id).update(created=timezone.now() - timedelta(days=1))
+        call_command('expire_upload_sessions', stdout=io.StringIO())
+        self.assertEqual(list(FinishedUpload.objects.values_list('blob_name', flat=True)), ['uploads/new.mp4'])
+
+    def test_token_of_another_user(self):
+        token = self.upload_url().json()['upload_token']
+        self.client.force_authenticate(User.objects.create(username='other'))
+        self.assertEqual(self.finalize(token, uploaded_blob(b'\x00\x00\x00\x18ftypmp42', 'video/mp4')).json(), {'error': 'The upload token is not valid'})
+
+
+# stands in for an azure append blob, refuses a piece that doesnt start where the blob ends like appendpos_condition does
+class FakeAppendBlob:
+    url = 'https://x.blob.core.windows.net/c/uploads/session.mp4'
+
+    def __init__(self):
+        self.content = b''
+
+    def create_append_blob(self, content_settings=None):
+        self.content = b''
+
+    def append_block(self, data, length=None, appendpos_condition=None):
+        if appendpos_condition != len(self.content):
+            raise HttpResponseError(response=mock.Mock(status_code=412, reason='Precondition Failed'))
+        self.content += data
+
+    def get_blob_properties(self):
+        return mock.Mock(size=len(self.content))
+
+
+@override_settings(UPLOAD_SESSION_MAX_CHUNK=1024)
+class UploadSessionTests(ApiTestCase):
+    """A video sent in pieces, the client can ask where the upload is and carry on after a broken connection."""
+
+    content = b'\x00\x00\x00\x18ftypmp42' + b'v' * 2000
+    post_data = {'data': {'title': 'resumed', 'category': 'Kicks', 'postDesc': 'A clip', 'username': 'tester'}}
+
+    def setUp(self):
+        super().setUp()
+        self.blob = FakeAppendBlob()
+        patcher = mock.patch('api.views.get_blob_client', return_value=self.blob)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = '/api/uploads/sessions/' + self.client.post('/api/uploads/sessions/', {'filename': 'clip.mp4', 'length': len(self.content)}, format='json').json()['id']
+
+    def send(self, offset, size):
+        return self.client.generic('PATCH', self.url, self.content[offset:offset + size], content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_pieces_then_finalize(self):
+        response = self.send(0, 1000)
+        self.assertEqual((response.status_code, response.content, response['Upload-Offset']), (204, b'', '1000'))
+        self.assertEqual(self.send(0, 1000).status_code, 409) # a retried piece the server already has
+        self.assertEqual(self.client.head(self.url)['Upload-Offset'], '1000')
+        self.assertEqual(self.client.post(self.url + '/finalize', self.post_data, format='json').status_code, 409)
+        self.assertEqual(self.send(1000, 1000)['Upload-Offset'], '2000')
+        self.send(2000, 1000)
+        self.assertEqual(self.blob.content, self.content)
+        response = self.client.post(self.url + '/finalize', self.post_data, format='json')
+        self.assertEqual((response.status_code, Post.objects.get().upload.name), (201, self.blob.url))
+        self.assertEqual(self.client.get(self.url).status_code, 404) # the session is gone
+        self.assertEqual(self.client.post(self.url + '/finalize', self.post_data, format='json').status_code, 404)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_finalize_that_lost_the_race(self):
+        self.send(0, 1000), self.send(1000, 1000), self.send(2000, 1000)
+        real_filter = UploadSession.objects.filter
+        def finalized_meanwhile(*args, **kwargs): # the other finalize deleted the session after this one read it
+            rows = real_filter(*args, **kwargs)
+            if 'offset' in kwargs:
+                real_filter(id=kwargs['id']).delete()
+            return rows
+        with mock.patch.object(UploadSession.objects, 'filter', side_effect=finalized_meanwhile):
+            response = self.client.post(self.url + '/finalize', self.post_data, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Post.objects.exists())
+
+    def test_azure_error_when_starting(self):
+        self.blob.create_append_blob = mock.Mock(side_effect=AzureError('down'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post('/api/uploads/sessions/', {'filename': 'clip.mp4', 'length': 10}, format='json')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(UploadSession.objects.count(), 1) # only the session of setUp
+
+    def test_lost_response(self):
+        self.blob.content = self.content[:500] # azure has a piece the server never heard about
+        response = self.send(0, 1000)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 500))
+        self.assertEqual(self.send(500, 1000).status_code, 204)
+
+    def test_bad_pieces(self):
+        self.assertEqual(self.send(0, 2000).status_code, 413)
+        self.assertEqual(self.client.generic('PATCH', self.url, b'not a video!', HTTP_UPLOAD_OFFSET='0').status_code, 400)
+        self.client.force_authenticate(User.objects.create(username='other'))
+        self.assertEqual(self.send(0, 1000).status_code, 404) # someone else's session
+
+    def test_cancel(self):
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertEqual(BlobDeletion.objects.count(), 1)
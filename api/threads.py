@@ -0,0 +1,41 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Comment
+
+# Threads - instead of sending every reply nested under its comment (a thread with 2,000 replies is one huge response), the
+# thread routes send one page of comments, each with its reply_count and only its first few replies. The client pages through
+# the rest of the replies of a comment with the replies route. Both read the (post, parent, created, id) index.
+
+PREVIEW_REPLIES = 3 # replies sent with every comment, ?replies= changes it
+MAX_PREVIEW_REPLIES = 20
+preview_query_param = 'replies'
+
+def get_preview_count(request):
+    try:
+        count = int(request.query_params[preview_query_param])
+    except (KeyError, ValueError):
+        return PREVIEW_REPLIES
+    return max(0, min(count, MAX_PREVIEW_REPLIES))
+
+# comment id -> its first `count` replies, for every comment of the page in ONE query. On databases that can LIMIT every part
+# of a UNION (postgres) every comment gets its own "LIMIT count" on the index, so only the replies that are sent are read.
+# Otherwise (sqlite) ROW_NUMBER() numbers the replies of each comment and we keep the first ones
+def first_replies(post_id, parent_ids, count):
+    parent_ids = list(parent_ids)
+    if not parent_ids or not count:
+        return {}
+    replies = Comment.objects.filter(post_id=post_id)
+    if connection.features.supports_slicing_ordering_in_compound:
+        parts = [replies.filter(parent_id=parent_id).order_by('created', 'id')[:count] for parent_id in parent_ids]
+        rows = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+    else:
+        rows = (replies.filter(parent_id__in=parent_ids)
+            .annotate(position=Window(RowNumber(), partition_by=[F('parent_id')], order_by=[F('created').asc(), F('id').asc()]))
+            .filter(position__lte=count))
+    previews = defaultdict(list)
+    for reply in sorted(rows, key=lambda reply: (reply.created, reply.id)):
+        previews[reply.parent_id].append(reply)
+    return previews
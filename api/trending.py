@@ -0,0 +1,60 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import Post, PostRanking
+from .pagination import KeysetPagination
+from .response_cache import bump_versions
+
+# The trending feed (posts/?sort=trending). A post's score is log10 of its engagement (likes, comments count double, plus one) plus its
+# age bonus: every DECAY_SECONDS newer is worth 10x the engagement. Like this the score of a post only changes when its likes
+# or comments change, the "decay" is newer posts starting higher, so the scores never have to be redone just because time passed.
+# The scores are kept in PostRanking by "manage.py refresh_trending" (run it every few minutes). Every change to the likes and
+# comments moves the post's `updated` on (counters.py), so a refresh only reads the posts updated since the last one
+
+COMMENT_WEIGHT = 2
+DECAY_SECONDS = 45000 # 12.5 hours
+EPOCH = datetime(2023, 1, 1, tzinfo=dt_timezone.utc) # keeps the age bonus small, the scores of all the posts move together so it doesnt change the order
+REFRESH_OVERLAP = timedelta(minutes=1) # a post written by a transaction that committed late still gets picked up by the next refresh
+
+def trending_score(like_count, comment_count, created):
+    engagement = max(like_count + COMMENT_WEIGHT * comment_count, 0) + 1 # + 1 so the first like counts too
+    return round(math.log10(engagement) + (created - EPOCH).total_seconds() / DECAY_SECONDS, 7)
+
+# Write the score of every post updated since the last refresh (every post with full=True), `batch_size` posts per query.
+# It is one transaction, so the feed (and its ETag, see conditional.py) never shows a refresh that is only half written.
+# Returns how many scores were written
+@transaction.atomic
+def refresh_rankings(full=False, batch_size=1000):
+    started = timezone.now()
+    posts = Post.objects.all()
+    last_refresh = PostRanking.objects.aggregate(last=Max('refreshed'))['last']
+    if last_refresh is not None and not full:
+        posts = posts.filter(updated__gte=last_refresh - REFRESH_OVERLAP)
+    refreshed, batch = 0, []
+    for post in posts.order_by().values('id', 'like_count', 'comment_count', 'created').iterator(chunk_size=batch_size):
+        batch.append(PostRanking(post_id=post['id'], score=trending_score(post['like_count'], post['comment_count'], post['created']), refreshed=started))
+        if len(batch) >= batch_size:
+            refreshed += save_rankings(batch)
+            batch = []
+    refreshed += save_rankings(batch)
+    if refreshed:
+        bump_versions('posts') # after the commit
+    return refreshed
+
+def save_rankings(rankings):
+    try:
+        with transaction.atomic():
+            PostRanking.objects.bulk_create(rankings, update_conflicts=True, unique_fields=['post'], update_fields=['score', 'refreshed'])
+    except IntegrityError: # a post was deleted after we read it, write the others
+        existing = set(Post.objects.filter(pk__in=[ranking.post_id for ranking in rankings]).values_list('pk', flat=True))
+        rankings = [ranking for ranking in rankings if ranking.post_id in existing]
+        PostRanking.objects.bulk_create(rankings, update_conflicts=True, unique_fields=['post'], update_fields=['score', 'refreshed'])
+    return len(rankings)
+
+
+# The posts are walked highest score first, the post id breaks the ties
+class TrendingPagination(KeysetPagination):
+    ordering = ('-score', '-post_id')
@@ -0,0 +1,104 @@
+import os
+
+from azure.storage.blob._models import ContentSettings
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from .storage import BlockUploader, PICTURE_CONTENT_TYPES, POST_CONTENT_TYPES, get_blob_client, looks_like
+from .validators import MAX_FILE_SIZE
+
+# The file we give to the view when the upload was already streamed into azure, there is nothing left to read, just the blob url
+class StreamedBlobFile(UploadedFile):
+    def __init__(self, blob_name, blob_url, name, content_type, size):
+        super().__init__(file=None, name=name, content_type=content_type, size=size)
+        self.blob_name = blob_name
+        self.blob_url = blob_url
+
+
+# Instead of letting django save the whole upload into memory/a temp file and then reading it AGAIN to send it to azure,
+# this handler sends the file to azure in blocks while it is still coming in from the client. It only does this for the
+# file field of the create post/create user profile routes, every other upload goes to django's normal handlers.
+# Bad files (wrong extension, wrong magic bytes, too big) are rejected right away without reading the rest of the request,
+# the view finds out why from request.upload_error
+class BlobUploadHandler(FileUploadHandler):
+    streamed_fields = {
+        'create-post': ('upload', 'uploads/', POST_CONTENT_TYPES, 'The file should be a jpeg/jpg, png, mov, or mp4'),
+        'create-userProfile': ('picture', 'pictures/', PICTURE_CONTENT_TYPES, 'The file should be a jpeg/jpg or png'),
+    }
+    form_overhead = 1024 * 1024 # room for the other form fields when we check the size of the whole request
+    request_length = None
+    uploader = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_length = content_length
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.uploader = None
+        match = getattr(self.request, 'resolver_match', None)
+        target = self.streamed_fields.get(match.url_name) if match else None
+        if target is None or target[0] != field_name:
+            return # not a file we stream, so the normal handlers take care of it
+
+        _, folder, content_types, type_error = target
+        content_type = content_types.get(os.path.splitext(file_name)[1].lower())
+        if content_type is None:
+            self.reject(type_error)
+        if self.request_length and self.request_length > MAX_FILE_SIZE + self.form_overhead:
+            self.reject('Maximum file size is 15 mb')
+
+        self.blob_name = folder + file_name
+        self.blob_client = get_blob_client(self.blob_name)
+        self.blob_content_type = content_type
+        self.uploader = BlockUploader(self.blob_client, concurrency=settings.STREAM_UPLOAD_CONCURRENCY)
+        self.buffer = bytearray()
+        self.received = 0
+        self.checked_type = False
+        raise StopFutureHandlers() # we are handling this file, the other handlers dont need to keep a copy
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.uploader is None:
+            return raw_data
+
+        self.received += len(raw_data)
+        if self.received > MAX_FILE_SIZE:
+            self.reject('Maximum file size is 15 mb')
+        self.buffer += raw_data
+
+        if not self.checked_type and len(self.buffer) >= 12: # we only need the first few bytes to check the type
+            if not looks_like(self.blob_content_type, bytes(self.buffer[:12])):
+                self.reject('The file contents do not match its file type')
+            self.checked_type = True
+
+        # full blocks go to azure right away. stage() waits while STREAM_UPLOAD_CONCURRENCY blocks are still being sent, so an
+        # upload holds at most those, the block waiting for a turn and the one being filled
+        while len(self.buffer) >= settings.STREAM_UPLOAD_BLOCK_SIZE:
+            self.uploader.stage(bytes(self.buffer[:settings.STREAM_UPLOAD_BLOCK_SIZE]))
+            del self.buffer[:settings.STREAM_UPLOAD_BLOCK_SIZE]
+        return None
+
+    def file_complete(self, file_size):
+        if self.uploader is None:
+            return None
+        if not self.checked_type: # files smaller than 12 bytes cant be a real picture or video
+            self.reject('The file contents do not match its file type')
+        try:
+            if self.buffer:
+                self.uploader.stage(bytes(self.buffer))
+            self.uploader.commit(ContentSettings(content_type=self.blob_content_type, content_disposition='inline'))
+        except Exception as e:
+            print("Error uploading the file:", str(e))
+            self.reject('The file could not be uploaded', connection_reset=False)
+        uploader, self.uploader, self.buffer = self.uploader, None, bytearray()
+        return StreamedBlobFile(self.blob_name, self.blob_client.url, self.file_name, self.blob_content_type, uploader.size)
+
+    def upload_interrupted(self):
+        if self.uploader is not None:
+            self.uploader.abort()
+
+    def reject(self, error, connection_reset=True):
+        self.request.upload_error = error
+        if self.uploader is not None:
+            self.uploader.abort()
+            self.uploader = None
+        raise StopUpload(connection_reset=connection_reset) # connection_reset means django stops reading the rest of the request body
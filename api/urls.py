@@ -17,17 +17,33 @@ urlpatterns = [
     path('register/', RegisterView.as_view(), name='auth_register'),
     
 
+    # Direct upload routes - get an upload url, upload straight to azure, then finalize
+    path('uploads/url', views.createUploadUrl, name="upload-url"),
+    path('posts/finalize', views.finalizePost, name="finalize-post"),
+    path('userProfiles/finalize', views.finalizeUserProfile, name="finalize-userProfile"),
+
+    # Resumable upload routes - create a session, PATCH the pieces, then finalize it into a post
+    path('uploads/sessions/', views.createUploadSession, name="create-upload-session"),
+    path('uploads/sessions/<str:id>', views.uploadSession, name="upload-session"),
+    path('uploads/sessions/<str:id>/finalize', views.finalizeUploadSession, name="finalize-upload-session"),
+
     # the Posts routes
     path('posts/', views.getPosts, name="posts"), # get posts route
     path('posts/create', views.createPost, name="create-post"), # create a post
+    path('posts/search', views.searchPosts, name="search-posts"), # full text search, has to come before posts/<str:id>
+    path('tags/', views.getTags, name="tags"), # every tag with its number of posts
     path('posts/<str:id>/update', views.updatePost, name="update-post"), # update a specific post
     path('posts/<str:id>/delete', views.deletePost, name="delete-post"), # delete a specific post
+    path('posts/<str:id>/like', views.likePost, name="like-post"), # like a specific post
+    path('posts/<str:id>/unlike', views.unlikePost, name="unlike-post"), # unlike a specific post
     path('posts/<str:id>', views.getPost, name="post"), # get post (get a specific post) route
 
 
     # UserProfile Routes
+    path('users/autocomplete', views.autocompleteUsernames, name="autocomplete-usernames"), # usernames that start with ?q=
     path('userProfiles/', views.getUserProfiles, name="userProfiles"), # get userProfiles route
     path('userProfiles/create', views.createUserProfile, name="create-userProfile"), 
+    path('userProfiles/directory', views.getUserProfileDirectory, name="userProfile-directory"), # filtered and near a zip code, has to come before userProfiles/<str:id>
     path('userProfiles/<str:id>/update', views.updateUserProfile, name="update-userProfile"), 
     path('userProfiles/<str:id>/delete', views.deleteUserProfile, name="delete-userProfile"), 
     path('userProfiles/<str:id>', views.getUserProfile, name="userProfile"), # get a specific userprofile
@@ -36,9 +52,14 @@ urlpatterns = [
     # Comment Routes
     path('comments/', views.getComments, name="comments"), # get all the comments for the ENTIRE APP
     path('posts/<str:id>/comments/', views.getPostComments, name="postComments"), # get all the comments for a specific post
+    path('posts/<str:id>/threads/', views.getPostThreads, name="postThreads"), # the top level comments of a post with their first few replies
+    path('posts/<str:id>/comments/<str:comment_id>/replies/', views.getCommentReplies, name="commentReplies"), # load more replies of one comment
     path('posts/<str:id>/createComment', views.createPostComment, name="create-comment"),
     path('posts/<str:id>/updateComment', views.updatePostComment, name="update-comment"),
     path('posts/<str:id>/deleteComment', views.deletePostComment, name="delete-comment"),
 
+    # hit/miss counts of the response cache (admins only)
+    path('cache/stats', views.getCacheStats, name="cache-stats"),
+
 
 ]
\ No newline at end of file
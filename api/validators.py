@@ -1,6 +1,8 @@
 from django.core.exceptions import ValidationError
 
+MAX_FILE_SIZE = 15000000 # 15 mb, the biggest upload we allow
+
 def file_size(value):
     file_size = value.size 
-    if file_size > 15000000: #if the file is more than 15 mb then raise an error 
+    if file_size > MAX_FILE_SIZE: #if the file is more than 15 mb then raise an error 
         raise ValidationError("Maximum file size is 15 mb")
@@ -1,21 +1,44 @@
 from django.shortcuts import render
 from rest_framework.response import Response # now we will begin to use the django rest framework which will streamline the process of building APIs and endpoints
 from rest_framework.decorators import api_view, permission_classes # import permission classes
-from .models import Post, UserProfile, Comment# import our models so then in the routes we can render the data 
-from .serializers import PostSerializer, UserProfileSerializer, CommentSerializer, RegisterSerializer # import the serializer
+from .models import Post, UserProfile, Comment, UploadSession, PostTag, Tag, PostRanking, FinishedUpload # import our models so then in the routes we can render the data 
+from .serializers import PostSerializer, UserProfileSerializer, CommentSerializer, ThreadCommentSerializer, RegisterSerializer, sparse_context # import the serializer
+from . import comment_tree_cache # the cached comment tree of every post, patched by the signals
+from .fast_serializers import FastPostSerializer, FastCommentSerializer, FastUserProfileSerializer # .values() based serializers for the list routes
+from .pagination import KeysetPagination # cursor pagination for the list endpoints
+from .streaming import streaming_list, wants_stream # ?stream=1 on the unbounded lists
+from .search import search_posts, SearchPagination # full text search over the posts
+from .tags import find_tag, TagPagination # posts/?tag= and the tag counts
+from .trending import TrendingPagination # posts/?sort=trending, scored by manage.py refresh_trending
+from .threads import first_replies, get_preview_count # paginated threads with the first few replies of every comment
+from .autocomplete import username_index, get_limit # username autocomplete from an index in memory
+from .directory import directory_queryset, DirectoryError, DirectoryPagination, NearPagination # the filtered practitioner directory
+from .likes import like_buffer # likes are buffered and written in batches
+from .response_cache import cached_response, get_stats, reset_stats, object_id, CACHED_VIEWS # versioned cache for the read endpoints
+from .conditional import conditional, posts_stats, post_stats, post_comments_stats, comment_replies_stats, comments_stats, profiles_stats, profile_stats # ETag/Last-Modified, 304 when nothing changed
 from rest_framework import status # import status so we can use the status codes 
 # Import these for UserAuthentication/ tokens/ Login/ Register 
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.permissions import AllowAny
 from django.contrib.auth.models import User
 from rest_framework import generics
 
-from azure.storage.blob import BlobServiceClient
 from azure.storage.blob._models import ContentSettings
+from .storage import get_blob_client, upload_in_blocks, unique_blob_name, blob_upload_url, blob_name_from_url, looks_like, POST_CONTENT_TYPES, PICTURE_CONTENT_TYPES # the shared azure client for this worker
+from .blob_deletions import queue_blob_deletion
+from django.db import IntegrityError, transaction
+from .upload_handlers import StreamedBlobFile
+from .validators import MAX_FILE_SIZE
+from azure.core.exceptions import AzureError, HttpResponseError, ResourceNotFoundError
+from django.utils import timezone
+from datetime import timedelta
+from django.conf import settings
+from django.core import signing
 import os
 import json
+import uuid
 # Create your views here.
 
 # Here we can customize the token claim
@@ -45,7 +68,31 @@ def getRoutes(request):
             'Endpoint': '/posts/',
             'method': 'GET',
             'body': None,
-            'description': 'Returns an array of posts(videos and pictures)'
+            'description': 'Returns a page of posts(videos and pictures) with next/previous cursor links, use ?page_size= to change the page size, ?fields=title,upload to only get some fields, ?expand=comments,likes to include the comments/likes with them, ?tag= to only get the posts with that tag and ?sort=trending to get the trending posts first'
+        },
+        {
+            'Endpoint': '/tags/',
+            'method': 'GET',
+            'body': None,
+            'description': 'Returns every tag (the comma separated categories of the posts) with how many posts have it'
+        },
+        {
+            'Endpoint': '/posts/search?q=',
+            'method': 'GET',
+            'body': None,
+            'description': 'Returns a page of the posts whose title, category or description match the search text, best match first'
+        },
+        {
+            'Endpoint': '/users/autocomplete?q=',
+            'method': 'GET',
+            'body': None,
+            'description': 'Returns the usernames that start with the text, for mentions and profile lookup, ?limit= changes how many'
+        },
+        {
+            'Endpoint': '/userProfiles/directory',
+            'method': 'GET',
+            'body': None,
+            'description': 'Returns a page of the user profiles filtered by ?martialArt=, ?beltLevel=, ?state= and ?zip_code=, ?near=<zip>&radius=<miles> returns the ones within that many miles of the zip code, closest first'
         },
         {
             'Endpoint': '/posts/id',
@@ -74,21 +121,75 @@ def getRoutes(request):
     ]
     return Response(routes)
 #----------------------------------------------------------------------------------
-# GET posts - get all the posts that have been made 
+# GET posts - get the posts that have been made, one page at a time. Use the next/previous links to move between pages
 @api_view(['GET'])
+@conditional(posts_stats)
+@cached_response(lambda: ['posts'])
 def getPosts(request):  
-    posts = Post.objects.all() # query for all of the posts that have been made
-    # Now the important thing is that we need to take our python objects and then turn them into JSON format - so we need to serialize them 
-    serializer = PostSerializer(posts, many=True) # here we will use the serializer. We pass in the posts object
-    return Response(serializer.data)
+    paginator = KeysetPagination()
+    context = sparse_context(request) # ?fields= and ?expand= make the response (and the query) smaller, see SparseFieldsMixin
+    # The list is serialized with the fast path (plain rows from .values(), same json as PostSerializer), only the columns that are sent are loaded
+    serializer = FastPostSerializer(context)
+    if request.query_params.get('tag') is not None: # ?tag=kicks only sends the posts with that tag
+        return getTaggedPosts(request, serializer)
+    if request.query_params.get('sort') == 'trending': # ?sort=trending sends the posts with the most recent activity first
+        return getTrendingPosts(request, serializer)
+    posts = paginator.paginate_queryset(serializer.queryset(Post.objects.all(), keep=paginator.ordering), request) # query for a page of posts
+    return paginator.get_paginated_response(serializer.serialize(posts)) # the likes and comments of the whole page are loaded with one query each
+
+# The page is read from the tag's PostTag rows with the (tag, created, post) index, then the posts of that page are loaded by id
+def getTaggedPosts(request, serializer):
+    paginator = TagPagination()
+    tag_id = find_tag(request.query_params['tag'])
+    rows = PostTag.objects.filter(tag_id=tag_id) if tag_id is not None else PostTag.objects.none()
+    rows = paginator.paginate_queryset(rows.values('created', 'post_id'), request)
+    posts = {post['id']: post for post in serializer.queryset(Post.objects.filter(id__in=[row['post_id'] for row in rows]))}
+    return paginator.get_paginated_response(serializer.serialize(posts[row['post_id']] for row in rows if row['post_id'] in posts))
+
+# The page is read from PostRanking with the (score, post) index, then the posts of that page are loaded by id. Posts that were
+# not scored yet (created after the last refresh_trending) show up after the next refresh
+def getTrendingPosts(request, serializer):
+    paginator = TrendingPagination()
+    rows = paginator.paginate_queryset(PostRanking.objects.values('score', 'post_id'), request)
+    posts = {post['id']: post for post in serializer.queryset(Post.objects.filter(id__in=[row['post_id'] for row in rows]))}
+    return paginator.get_paginated_response(serializer.serialize(posts[row['post_id']] for row in rows if row['post_id'] in posts))
+
+# GET tags - every tag with the number of posts that have it, most used first. The counts are kept up to date on every write
+# (tags.py) so nothing is counted here, and the response is cached until a post's tags change. ?limit= (default 100) to get more
+@api_view(['GET'])
+@cached_response(lambda: ['tags'])
+def getTags(request):
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 100)), 1000))
+    except ValueError:
+        limit = 100
+    tags = Tag.objects.filter(post_count__gt=0).order_by('-post_count', 'name').values('name', 'post_count')[:limit]
+    return Response(list(tags))
+
+# GET posts search - ?q= searches the title, category and description of every post (full text, see search.py), best match first
+@api_view(['GET'])
+@conditional(posts_stats)
+@cached_response(lambda: ['posts'])
+def searchPosts(request):
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return Response({'error': 'Search text (?q=) is missing'}, status=status.HTTP_400_BAD_REQUEST)
+    paginator = SearchPagination()
+    context = sparse_context(request)
+    serializer = FastPostSerializer(context)
+    posts = paginator.paginate_queryset(serializer.queryset(search_posts(text), keep=paginator.ordering), request) # the cursor is (rank, id)
+    return paginator.get_paginated_response(serializer.serialize(posts))
 
 # GET post - get a SINGULAR post that have been made 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional(post_stats, last_modified=True)
+@cached_response(lambda id: [f'post:{object_id(id)}'] if object_id(id) else None, single_flight=True) # one rebuild at a time for a hot post
 def getPost(request, id):  #in django id You will be able to access a specific post because id is the params in the url
-    post = Post.objects.get(id=id) # query to get the post id from the url params
+    context = sparse_context(request)
+    post = PostSerializer.sparse_queryset(Post.objects.all(), context).get(id=id) # query to get the post id from the url params
     # Now the important thing is that we need to take our python objects and then turn them into JSON format - so we need to serialize them 
-    serializer = PostSerializer(post) # here we will use the serializer. We pass in the posts object
+    serializer = PostSerializer(post, context=context) # here we will use the serializer. We pass in the posts object
     return Response(serializer.data)
 
 @api_view(['POST'])
@@ -96,48 +197,35 @@ def getPost(request, id):  #in django id You will be able to access a specific p
 def createPost(request):
     data = request.data
     file = request.FILES.get('upload')
-    blob_name = "uploads/" + file.name # the blob will go inside an uploads folder in azure
-    
-    # Here we need to make a connection to Azure using the azure account information
-    azure_container = os.getenv('AZURE_CONTAINER')
-    azure_connection_string = os.getenv('AZURE_CONNECTION_STRING')
-    blob_service_client = BlobServiceClient.from_connection_string(azure_connection_string)
-    blob_container_client = blob_service_client.get_container_client(azure_container)
-    blob_client = blob_container_client.get_blob_client(blob_name)
-    
-    file_size = file.size # Get the size of the file
-    chunk_size = 4 * 1024 * 1024  # Set the chunk size for uploading, 4MB is a good size for chunk
-    file_extension = os.path.splitext(file.name)[1].lower() # We just want to extract the file extension 
-
-    # Set the content type based on the file extension, limiting them to the 4 below
-    if file_extension == '.jpg' or file_extension == '.jpeg':
-        content_type = 'image/jpeg'
-    elif file_extension == '.png':
-        content_type = 'image/png'
-    elif file_extension == '.mp4':
-        content_type = 'video/mp4'
-    elif file_extension == '.mov':
-        content_type = 'video/quicktime'
+    upload_error = getattr(request, 'upload_error', None) # the upload handler rejects bad files while they are still coming in
+    if upload_error:
+        return Response({'error': upload_error}, status=400)
+
+    if isinstance(file, StreamedBlobFile):
+        upload_url = file.blob_url # the upload handler already streamed the file into azure
     else:
-        return Response({'error': 'The file should be a jpeg/jpg, png, mov, or mp4'}, status=400)
+        blob_name = "uploads/" + file.name # the blob will go inside an uploads folder in azure
+        blob_client = get_blob_client(blob_name) # the connection to Azure is shared, so we just ask it for the blob
         
-    content_settings = ContentSettings(content_type=content_type, content_disposition='inline') # Essentially we are telling Azure what file type it should expect
+        file_extension = os.path.splitext(file.name)[1].lower() # We just want to extract the file extension 
 
-    #First we want to create an empty blob
-    try:
-        blob_client.create_append_blob()
-        print("Append blob created successfully")
-    except Exception as e:
-        print("Error creating append blob:", str(e))
+        # Set the content type based on the file extension, limiting them to the 4 in POST_CONTENT_TYPES
+        content_type = POST_CONTENT_TYPES.get(file_extension)
+        if content_type is None:
+            return Response({'error': 'The file should be a jpeg/jpg, png, mov, or mp4'}, status=400)
+            
+        content_settings = ContentSettings(content_type=content_type, content_disposition='inline') # Essentially we are telling Azure what file type it should expect
 
-    # Essentially we are just breaking up the file into chunks so that its easier to upload in the blob
-    for chunk_start_index in range(0, file_size, chunk_size):
-        chunk = file.read(chunk_size)
-        blob_client.upload_blob(chunk, blob_type='AppendBlob', length=len(chunk), content_settings=content_settings)
+        # The file is sent to azure in blocks that are uploaded in parallel, and then committed as one blob
+        try:
+            upload_in_blocks(blob_client, file, content_settings)
+        except Exception as e:
+            print("Error uploading the file:", str(e))
+            return Response({'error': 'The file could not be uploaded'}, status=status.HTTP_502_BAD_GATEWAY)
+        upload_url = blob_client.url
 
     jsonData = data.get('data')  # Access the JSON string from the 'data' field
     data_dict = json.loads(jsonData)  # Parse the JSON string into a dictionary
-    upload_url = blob_client.url
 
     # Here we pass in the data fields being used to create the post
     post = Post.objects.create(upload=upload_url, title=data_dict['title'], category=data_dict['category'], postDesc=data_dict['postDesc'], username=data_dict['username'])
@@ -168,39 +256,341 @@ def deletePost(request, id):
     post = Post.objects.get(id=id)
     
     # Deleting a post requires 1) Deleting of the Post and then 2) File from Azure
-    upload_url = post.upload.url # we get back the url of the file that was uploaded
-    blob_name = "uploads/" + os.path.basename(upload_url) # Extracting the name of the blob/file which is in an uploads folder in azure
-    azure_container = os.getenv('AZURE_CONTAINER')
-    azure_connection_string = os.getenv('AZURE_CONNECTION_STRING')
-  
-    blob_service_client = BlobServiceClient.from_connection_string(azure_connection_string)
-    blob_container_client = blob_service_client.get_container_client(azure_container)
-    blob_client = blob_container_client.get_blob_client(blob_name)
-    blob_exists = blob_client.exists()
+    # The file is only added to the deletion queue here, together with the delete of the post, so a slow azure never holds up the request
+    blob_name = blob_name_from_url("uploads/", post.upload.name) # Extracting the name of the blob/file which is in an uploads folder in azure
+    with transaction.atomic():
+        post.delete() #Now comes deleting of the post
+        queue_blob_deletion(blob_name)
+    return Response('Post has been deleted')
+
+# LIKE / UNLIKE a post - the like is recorded in the like buffer and written to the database in the next flush, which is why we send back 202
+# Liking a post twice (or unliking a post that isnt liked) doesnt change anything, the last request from a user is the one that counts
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def likePost(request, id):
+    return recordLike(request, id, True)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def unlikePost(request, id):
+    return recordLike(request, id, False)
+
+def recordLike(request, id, liked):
+    post_id = Post.objects.filter(id=id).values_list('id', flat=True).first()
+    if post_id is None:
+        return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+    like_buffer.record(post_id, request.user.id, liked)
+    return Response({'post': post_id, 'liked': liked}, status=status.HTTP_202_ACCEPTED)
+
+#----------------------------------------------------------------------------------
+# Direct uploads - instead of sending the whole video through our server, the client asks for an upload url, uploads the file
+# straight to azure with it, and then calls finalize to create the post/user profile. Our workers never touch the file bytes
+
+# what can be uploaded directly: the folder in azure, the allowed file types, and the error if the type isnt allowed
+DIRECT_UPLOAD_KINDS = {
+    'post': ('uploads/', POST_CONTENT_TYPES, 'The file should be a jpeg/jpg, png, mov, or mp4'),
+    'picture': ('pictures/', PICTURE_CONTENT_TYPES, 'The file should be a jpeg/jpg or png'),
+}
+
+# STEP 1 - get an upload url. The body is {"kind": "post" or "picture", "filename": "..."}
+# The client then PUTs the file to upload_url with the headers we send back, and keeps the upload_token for finalize
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def createUploadUrl(request):
+    kind = request.data.get('kind')
+    file_name = request.data.get('filename') or ''
+    if kind not in DIRECT_UPLOAD_KINDS:
+        return Response({'error': 'kind should be post or picture'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if blob_exists:
-        blob_client.delete_blob() # We must delete the blob from azure 
+    folder, content_types, type_error = DIRECT_UPLOAD_KINDS[kind]
+    content_type = content_types.get(os.path.splitext(file_name)[1].lower())
+    if content_type is None:
+        return Response({'error': type_error}, status=status.HTTP_400_BAD_REQUEST)
+
+    blob_name = unique_blob_name(folder, file_name)
+    expires_in = settings.DIRECT_UPLOAD_URL_SECONDS
+    # the token is signed by django so the client cant change which blob/type/user it is for
+    upload_token = signing.dumps({'blob': blob_name, 'kind': kind, 'type': content_type, 'user': request.user.id}, salt='direct-upload')
+    return Response({
+        'upload_url': blob_upload_url(blob_name, expires_in),
+        'blob_name': blob_name,
+        'content_type': content_type,
+        'expires_in': expires_in,
+        'headers': {'x-ms-blob-type': 'BlockBlob', 'x-ms-blob-content-type': content_type}, # the client has to send these with the PUT
+        'upload_token': upload_token,
+    })
+
+# Check that the file the client says it uploaded is really there, with an allowed size and the type we gave out
+# Returns the blob name and client, or the error response to send back (bad uploads are deleted and their token cant be used again)
+def checkDirectUpload(request, kind):
+    try:
+        upload = signing.loads(request.data.get('upload_token') or '', salt='direct-upload', max_age=settings.DIRECT_UPLOAD_FINALIZE_SECONDS)
+    except signing.BadSignature: # this also covers tokens that are too old
+        return None, None, Response({'error': 'The upload token is not valid'}, status=status.HTTP_400_BAD_REQUEST)
+    if upload['kind'] != kind or upload['user'] != request.user.id:
+        return None, None, Response({'error': 'The upload token is not valid'}, status=status.HTTP_400_BAD_REQUEST)
+
+    finished = FinishedUpload.objects.filter(blob_name=upload['blob']).first()
+    if finished is not None and finished.rejected:
+        return None, None, Response({'error': 'This upload was rejected, ask for a new upload url'}, status=status.HTTP_400_BAD_REQUEST)
+    if finished is not None:
+        return None, None, Response({'error': 'This upload has already been used'}, status=status.HTTP_409_CONFLICT)
+
+    blob_client = get_blob_client(upload['blob'])
+    try:
+        properties = blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None, None, Response({'error': 'The file has not been uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if properties.size == 0 or properties.size > MAX_FILE_SIZE:
+        error = 'Maximum file size is 15 mb'
+    elif properties.content_settings.content_type != upload['type']:
+        error = 'The file was not uploaded with the content type ' + upload['type']
+    elif not looks_like(upload['type'], blob_client.download_blob(offset=0, length=12).readall()):
+        error = 'The file contents do not match its file type'
     else:
-        print("The specified blob does not exist.")
+        return upload['blob'], blob_client, None
+    with transaction.atomic():
+        _, created = FinishedUpload.objects.get_or_create(blob_name=upload['blob'], defaults={'rejected': True})
+        if created: # if a finalize used the blob in the meantime it is not ours to delete
+            queue_blob_deletion(upload['blob'])
+    return None, None, Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
 
-    post.delete() #Now comes deleting of the post
-    return Response('Post has been deleted')
+# STEP 2 - create the post once the file is in azure. The body is {"upload_token": "...", "data": the same data as posts/create}
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalizePost(request):
+    blob_name, blob_client, error = checkDirectUpload(request, 'post')
+    if error:
+        return error
+
+    data = request.data.get('data')
+    data_dict = data if isinstance(data, dict) else json.loads(data) # the data can be sent as json or as a json string like in posts/create
+    try:
+        with transaction.atomic(): # the blob name is unique, so of two finalize requests for the same token only one creates a post
+            FinishedUpload.objects.create(blob_name=blob_name)
+            post = Post.objects.create(upload=blob_client.url, title=data_dict['title'], category=data_dict['category'], postDesc=data_dict['postDesc'], username=data_dict['username'])
+    except IntegrityError:
+        return Response({'error': 'This upload has already been used'}, status=status.HTTP_409_CONFLICT)
+    serializer = PostSerializer(post, many=False)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+# STEP 2 - create the user profile once the picture is in azure. The body is {"upload_token": "...", "data": the same data as userProfiles/create}
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalizeUserProfile(request):
+    blob_name, blob_client, error = checkDirectUpload(request, 'picture')
+    if error:
+        return error
+
+    data = request.data.get('data')
+    data_dict = data if isinstance(data, dict) else json.loads(data)
+    try:
+        with transaction.atomic():
+            FinishedUpload.objects.create(blob_name=blob_name)
+            userProfile = UserProfile.objects.create(
+                picture=blob_client.url,
+                username=data_dict['username'],
+                first_name=data_dict['first_name'],
+                last_name=data_dict['last_name'],
+                beltLevel=data_dict['beltLevel'],
+                userDesc=data_dict['userDesc'],
+                martialArt=data_dict['martialArt'],
+                address=data_dict['address'],
+                city=data_dict['city'],
+                state=data_dict['state'],
+                zip_code=data_dict['zip_code']
+            )
+    except IntegrityError:
+        return Response({'error': 'This upload has already been used'}, status=status.HTTP_409_CONFLICT)
+    serializer = UserProfileSerializer(userProfile, many=False)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+#----------------------------------------------------------------------------------
+# Resumable uploads for post videos - for clients on a bad connection, the file is sent in pieces and an upload that breaks
+# can carry on from where it stopped. 1) POST uploads/sessions  2) PATCH the pieces  3) HEAD/GET to see the offset after a failure
+# 4) POST uploads/sessions/<id>/finalize to create the post
+
+# CREATE an upload session. The body is {"filename": "...", "length": the size of the whole file in bytes}
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def createUploadSession(request):
+    file_name = request.data.get('filename') or ''
+    try:
+        length = int(request.data.get('length'))
+    except (TypeError, ValueError):
+        return Response({'error': 'length is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # the same checks as posts/create, done before a single byte is uploaded
+    content_type = POST_CONTENT_TYPES.get(os.path.splitext(file_name)[1].lower())
+    if content_type is None:
+        return Response({'error': 'The file should be a jpeg/jpg, png, mov, or mp4'}, status=status.HTTP_400_BAD_REQUEST)
+    if length <= 0 or length > MAX_FILE_SIZE:
+        return Response({'error': 'Maximum file size is 15 mb'}, status=status.HTTP_400_BAD_REQUEST)
+
+    session = UploadSession(
+        userId=request.user,
+        blob_name=unique_blob_name('uploads/', file_name),
+        file_name=file_name,
+        content_type=content_type,
+        length=length,
+        expires=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_SECONDS),
+    )
+    try:
+        get_blob_client(session.blob_name).create_append_blob(content_settings=ContentSettings(content_type=content_type, content_disposition='inline'))
+    except AzureError as e:
+        print("Error creating the upload blob:", str(e))
+        return Response({'error': 'The upload could not be started'}, status=status.HTTP_502_BAD_GATEWAY) # the session is only saved once the blob exists
+    session.save()
+    response = Response(uploadSessionData(session), status=status.HTTP_201_CREATED)
+    response['Location'] = request.build_absolute_uri(f'{session.id}')
+    response['Upload-Offset'] = str(session.offset)
+    return response
+
+# the sessions of the logged in user that have not expired yet (a session id that isnt even a uuid can't be found either)
+def getUploadSession(request, id):
+    try:
+        return UploadSession.objects.filter(id=uuid.UUID(id), userId=request.user, expires__gt=timezone.now()).first()
+    except ValueError:
+        return None
+
+def uploadSessionData(session):
+    return {'id': str(session.id), 'offset': session.offset, 'length': session.length, 'expires': session.expires}
+
+# GET/HEAD the current offset of a session, PATCH the next piece of the file, or DELETE to give up on the upload
+# A PATCH sends the raw bytes as the body with an Upload-Offset header that has to match the offset the server is at
+@api_view(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def uploadSession(request, id):
+    session = getUploadSession(request, id)
+    if session is None:
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+    blob_client = get_blob_client(session.blob_name)
+
+    if request.method == 'DELETE':
+        with transaction.atomic():
+            session.delete()
+            queue_blob_deletion(session.blob_name)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset'))
+        except (TypeError, ValueError):
+            return Response({'error': 'The Upload-Offset header is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if offset != session.offset:
+            return uploadOffsetConflict(session)
+
+        # read the raw body ourselves, at most one piece + 1 byte so we can tell if the piece is too big
+        chunk = request.stream.read(settings.UPLOAD_SESSION_MAX_CHUNK + 1) if request.stream else b''
+        if not chunk:
+            return Response({'error': 'The request has no data'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(chunk) > settings.UPLOAD_SESSION_MAX_CHUNK:
+            return Response({'error': f'Each piece can be at most {settings.UPLOAD_SESSION_MAX_CHUNK} bytes'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if offset + len(chunk) > session.length:
+            return Response({'error': 'The upload is bigger than the length of the file'}, status=status.HTTP_400_BAD_REQUEST)
+        if offset == 0 and not looks_like(session.content_type, chunk[:12]):
+            return Response({'error': 'The file contents do not match its file type'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # appendpos_condition makes azure refuse the piece if the blob isnt exactly `offset` bytes long, so a retried piece is never added twice
+            blob_client.append_block(chunk, length=len(chunk), appendpos_condition=offset)
+        except HttpResponseError as e:
+            if e.status_code != status.HTTP_412_PRECONDITION_FAILED:
+                raise
+            session.offset = blob_client.get_blob_properties().size # azure has the real offset, the last response must have been lost
+            UploadSession.objects.filter(id=session.id).update(offset=session.offset)
+            return uploadOffsetConflict(session)
+
+        UploadSession.objects.filter(id=session.id, offset=offset).update(offset=offset + len(chunk))
+        session.offset = offset + len(chunk)
+
+    # a 204 has no body, after a PATCH the client only gets the new offset in the headers
+    response = Response(status=status.HTTP_204_NO_CONTENT) if request.method == 'PATCH' else Response(uploadSessionData(session))
+    response['Upload-Offset'] = str(session.offset)
+    response['Upload-Length'] = str(session.length)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+def uploadOffsetConflict(session):
+    response = Response({'error': 'The offset does not match the upload', 'offset': session.offset}, status=status.HTTP_409_CONFLICT)
+    response['Upload-Offset'] = str(session.offset)
+    return response
+
+# FINALIZE an upload session into a post, once every byte has been uploaded. The body has the same data as posts/create
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalizeUploadSession(request, id):
+    session = getUploadSession(request, id)
+    if session is None:
+        return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+    if session.offset != session.length:
+        return uploadOffsetConflict(session)
+
+    data = request.data.get('data')
+    data_dict = data if isinstance(data, dict) else json.loads(data)
+    with transaction.atomic():
+        # the session is deleted FIRST, when two finalize calls race only the one that deleted it creates the post
+        deleted, _ = UploadSession.objects.filter(id=session.id, offset=session.length).delete()
+        if not deleted:
+            return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+        post = Post.objects.create(upload=get_blob_client(session.blob_name).url, title=data_dict['title'], category=data_dict['category'], postDesc=data_dict['postDesc'], username=data_dict['username'])
+    serializer = PostSerializer(post, many=False)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 #----------------------------------------------------------------------------------
 # GET UserProfile - get all of the user profiles that have been made 
 @api_view(['GET'])
+@conditional(profiles_stats)
+@cached_response(lambda: ['userProfiles'])
 def getUserProfiles(request):  
-    userProfiles = UserProfile.objects.all() # query for all of the user profiles that have been made
-    serializer = UserProfileSerializer(userProfiles, many=True) # here we will use the serializer. We pass in the userProfiles object
-    return Response(serializer.data)
+    context = sparse_context(request) # ?fields= only sends (and only loads) those fields
+    serializer = FastUserProfileSerializer(context) # fast path, plain rows from .values() turned into the same json as UserProfileSerializer
+    if wants_stream(request): # ?stream=1 sends the same json a chunk at a time, so memory doesnt grow with the number of profiles
+        return streaming_list(serializer, UserProfile.objects.order_by('id'))
+    userProfiles = serializer.queryset(UserProfile.objects.all()) # query for all of the user profiles that have been made
+    return Response(serializer.serialize(userProfiles))
+
+# GET username autocomplete - ?q= is what was typed so far, sends back the usernames (of users and profiles) that start with it.
+# Answered from the index in memory (see autocomplete.py), the database is not queried
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def autocompleteUsernames(request):
+    prefix = request.query_params.get('q', '').strip()
+    if not prefix:
+        return Response([])
+    return Response(username_index.search(prefix, get_limit(request)))
+
+# GET the practitioner directory - a page of the user profiles filtered by ?martialArt=, ?beltLevel=, ?state= and ?zip_code=,
+# ?near=<zip>&radius=<miles> only keeps the ones around that zip code and sorts them closest first (see directory.py)
+@api_view(['GET'])
+@conditional(profiles_stats)
+@cached_response(lambda: ['userProfiles'])
+def getUserProfileDirectory(request):
+    try:
+        profiles = directory_queryset(request.query_params)
+    except DirectoryError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    near = bool(request.query_params.get('near'))
+    paginator = NearPagination() if near else DirectoryPagination()
+    context = sparse_context(request)
+    serializer = FastUserProfileSerializer(context)
+    rows = paginator.paginate_queryset(serializer.queryset(profiles, keep=paginator.ordering), request) # never more than a page of profiles
+    data = serializer.serialize(rows)
+    if near:
+        data = [dict(profile, distance=row['distance']) for profile, row in zip(data, rows)] # miles from the center of the zip code
+    return paginator.get_paginated_response(data)
 
 # GET user profile - get a SINGULAR user profile that have been made 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional(profile_stats, last_modified=True)
+@cached_response(lambda id: [f'userProfile:{object_id(id)}'] if object_id(id) else None)
 def getUserProfile(request, id):  #in django id You will be able to access a specific userprofile because id is the params in the url
-    userProfile = UserProfile.objects.get(id=id) # query to get the post id from the url params
+    context = sparse_context(request)
+    userProfile = UserProfileSerializer.sparse_queryset(UserProfile.objects.all(), context).get(id=id) # query to get the post id from the url params
     # Now the important thing is that we need to take our python objects and then turn them into JSON format - so we need to serialize them 
-    serializer = UserProfileSerializer(userProfile, many=False) # here we will use the serializer. We pass in the user profile object
+    serializer = UserProfileSerializer(userProfile, many=False, context=context) # here we will use the serializer. We pass in the user profile object
     return Response(serializer.data)
 
 #CREATE User Profile
@@ -210,27 +600,25 @@ def createUserProfile(request):
     print("This is the data we get back", request.data)
     data = request.data
     picture = request.FILES.get('picture')
-    blob_name = "pictures/" + picture.name # the blob will go inside a pictures folder in Azure
-    azure_container = os.getenv('AZURE_CONTAINER')
-    azure_connection_string = os.getenv('AZURE_CONNECTION_STRING')
-
-    # Here we need to make a connection to the azure account information
-    blob_service_client = BlobServiceClient.from_connection_string(azure_connection_string)
-    blob_container_client = blob_service_client.get_container_client(azure_container)
-    blob_client = blob_container_client.get_blob_client(blob_name)
-    picture_extension = os.path.splitext(picture.name)[1].lower() # We just want to extract the picture file extension 
-
-    # set the content type based on the file extension limiting only to jpeg and png below 
-    if picture_extension == '.jpg' or picture_extension == '.jpeg':
-        content_type = 'image/jpeg'
-    elif picture_extension == '.png':
-        content_type = 'image/png'
+    upload_error = getattr(request, 'upload_error', None) # the upload handler rejects bad files while they are still coming in
+    if upload_error:
+        return Response({'error': upload_error}, status=400)
+
+    if isinstance(picture, StreamedBlobFile):
+        picture_url = picture.blob_url # the upload handler already streamed the picture into azure
     else:
-        return Response({'error': 'The file should be a jpeg/jpg or png'}, status=400)
-    
-    content_settings = ContentSettings(content_type=content_type, content_disposition='inline') # Essentially we are telling Azure what file type it should expect
-    blob_client.upload_blob(picture, content_settings = content_settings) #We upload the file to Azure using the content settings we defined
-    picture_url = blob_client.url
+        blob_name = "pictures/" + picture.name # the blob will go inside a pictures folder in Azure
+        blob_client = get_blob_client(blob_name) # the connection to Azure is shared, so we just ask it for the blob
+        picture_extension = os.path.splitext(picture.name)[1].lower() # We just want to extract the picture file extension 
+
+        # set the content type based on the file extension limiting only to jpeg and png in PICTURE_CONTENT_TYPES
+        content_type = PICTURE_CONTENT_TYPES.get(picture_extension)
+        if content_type is None:
+            return Response({'error': 'The file should be a jpeg/jpg or png'}, status=400)
+        
+        content_settings = ContentSettings(content_type=content_type, content_disposition='inline') # Essentially we are telling Azure what file type it should expect
+        blob_client.upload_blob(picture, content_settings = content_settings) #We upload the file to Azure using the content settings we defined
+        picture_url = blob_client.url
 
     jsonData = data['data']  # Access the JSON string from the 'data' field
     data_dict = json.loads(jsonData)  # Parse the JSON string into a dictionary
@@ -283,43 +671,69 @@ def updateUserProfile(request, id):
 @permission_classes([IsAuthenticated])
 def deleteUserProfile(request, id):
     userProfile = UserProfile.objects.get(id=id)
-    picture_url = userProfile.picture.url # we get back the url of the file that was uploaded
-
-    blob_name = "pictures/" + os.path.basename(picture_url) # Extracting the name of the blob/file which is in an uploads folder in azure
-    azure_container = os.getenv('AZURE_CONTAINER')
-    azure_connection_string = os.getenv('AZURE_CONNECTION_STRING')
-  
-    blob_service_client = BlobServiceClient.from_connection_string(azure_connection_string)
-    blob_container_client = blob_service_client.get_container_client(azure_container)
-    blob_client = blob_container_client.get_blob_client(blob_name)
-    blob_exists = blob_client.exists()
-
-    if blob_exists: # if the blob exists on Azure, then delete it 
-        blob_client.delete_blob()
-    else:
-        print("The specified blob does not exist.")
-
-    userProfile.delete()
+    # The picture is added to the deletion queue in the same transaction as the delete, "manage.py drain_blob_deletions" removes it from azure
+    blob_name = blob_name_from_url("pictures/", userProfile.picture.name) # Extracting the name of the blob/file which is in a pictures folder in azure
+    with transaction.atomic():
+        userProfile.delete()
+        queue_blob_deletion(blob_name)
     return Response('User Profile has been deleted')
 #----------------------------------------------------------------------------------
-# GET Comments - get all of the comments that have been made for the ENTIRE APP
+# GET Comments - get all of the comments that have been made for the ENTIRE APP, one page at a time
 @api_view(['GET'])
+@conditional(comments_stats)
+@cached_response(lambda: ['comments'])
 def getComments(request):  
-    comments = Comment.objects.all() 
-    serializer = CommentSerializer(comments, many=True) 
-    return Response(serializer.data)
+    serializer = FastCommentSerializer() # fast path, same json as CommentSerializer
+    if wants_stream(request): # ?stream=1 sends EVERY comment as one plain list (no pages), streamed a chunk at a time
+        return streaming_list(serializer, Comment.objects.order_by('created', 'id'))
+    paginator = KeysetPagination()
+    comments = paginator.paginate_queryset(serializer.queryset(Comment.objects.all(), keep=paginator.ordering), request)
+    return paginator.get_paginated_response(serializer.serialize(comments)) # the replies come from the comments of the posts on this page
 
 # GET Post Comments - get all the comments for a specific post
 @api_view(['GET'])
+@conditional(post_comments_stats)
+@cached_response(lambda id: [f'post-comments:{object_id(id)}'] if object_id(id) else None, single_flight=True) # one rebuild at a time for a hot post
 def getPostComments(request, id):
     try:
         post = Post.objects.get(id=id)
-        comments = Comment.objects.filter(post=post)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        paginator = KeysetPagination()
+        comments = paginator.paginate_queryset(Comment.objects.filter(post=post).values('id', 'created'), request) # only the ids of the page, the rest comes from the tree
+        stats = getattr(request, 'conditional_stats', None) # the newest updated and count of the comments, the tree is checked against them
+        return paginator.get_paginated_response(comment_tree_cache.serialize_page(post.id, comments, stats)) # the post's comment tree is cached and patched by the signals
     except Post.DoesNotExist:
         return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
     
+# GET Post Threads - the top level comments of a post one page at a time, each with its reply_count and first few replies (?replies=)
+@api_view(['GET'])
+@conditional(post_comments_stats)
+@cached_response(lambda id: [f'post-comments:{object_id(id)}'] if object_id(id) else None)
+def getPostThreads(request, id):
+    try:
+        post = Post.objects.get(id=id)
+        paginator = KeysetPagination()
+        comments = paginator.paginate_queryset(Comment.objects.filter(post=post, parent__isnull=True), request)
+        previews = first_replies(post.id, [comment.id for comment in comments], get_preview_count(request))
+        serializer = ThreadCommentSerializer(comments, many=True, context={'reply_previews': previews})
+        return paginator.get_paginated_response(serializer.data)
+    except Post.DoesNotExist:
+        return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+
+# GET Comment Replies - the "load more replies" of a thread, the replies of one comment a page at a time (each with its own first few replies)
+@api_view(['GET'])
+@conditional(comment_replies_stats)
+@cached_response(lambda id, comment_id: [f'post-comments:{object_id(id)}'] if object_id(id) and object_id(comment_id) else None)
+def getCommentReplies(request, id, comment_id):
+    try:
+        comment = Comment.objects.get(id=comment_id, post_id=id)
+        paginator = KeysetPagination()
+        replies = paginator.paginate_queryset(Comment.objects.filter(post_id=comment.post_id, parent=comment), request)
+        previews = first_replies(comment.post_id, [reply.id for reply in replies], get_preview_count(request))
+        serializer = ThreadCommentSerializer(replies, many=True, context={'reply_previews': previews})
+        return paginator.get_paginated_response(serializer.data)
+    except (Comment.DoesNotExist, ValueError):
+        return Response({'error': 'Comment not found'}, status=status.HTTP_404_NOT_FOUND)
+
 # CREATE Comment 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -380,3 +794,11 @@ def deletePostComment(request, id):
 
 
 #----------------------------------------------------------------------------------
+
+# Response cache hit/miss counts for every cached read view, to see if the cache is worth its memory. DELETE sets them back to 0
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def getCacheStats(request):
+    if request.method == 'DELETE':
+        reset_stats(CACHED_VIEWS)
+    return Response(get_stats(CACHED_VIEWS))
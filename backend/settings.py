@@ -47,9 +47,109 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # The list endpoints use cursor pagination keyed on (created, id), the page size can be changed here or with ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 20)),
+    # orjson when it is installed, with the json module as the fall back (see api/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
+# Likes are buffered and written in batches (see api/likes.py), this is how long a like can wait and how many can pile up before a flush
+LIKE_BUFFER_SECONDS = float(os.getenv('LIKE_BUFFER_SECONDS', 0.5))
+LIKE_BUFFER_MAX_PENDING = int(os.getenv('LIKE_BUFFER_MAX_PENDING', 500))
+
+# Azure blob storage - one client per worker process is shared by all the views (see api/storage.py)
+AZURE_CONNECTION_STRING = os.getenv('AZURE_CONNECTION_STRING')
+AZURE_CONTAINER = os.getenv('AZURE_CONTAINER')
+AZURE_CONNECTION_TIMEOUT = float(os.getenv('AZURE_CONNECTION_TIMEOUT', 10)) # seconds to wait to connect to azure
+AZURE_READ_TIMEOUT = float(os.getenv('AZURE_READ_TIMEOUT', 60)) # seconds to wait for azure to answer
+AZURE_RETRY_TOTAL = int(os.getenv('AZURE_RETRY_TOTAL', 3)) # how many times a failed storage call is retried
+AZURE_RETRY_BACKOFF = float(os.getenv('AZURE_RETRY_BACKOFF', 2)) # seconds before the first retry, it grows after every retry
+AZURE_POOL_CONNECTIONS = int(os.getenv('AZURE_POOL_CONNECTIONS', 10))
+AZURE_POOL_MAXSIZE = int(os.getenv('AZURE_POOL_MAXSIZE', 10)) # how many kept-alive connections to azure each worker can hold
+AZURE_UPLOAD_BLOCK_SIZE = int(os.getenv('AZURE_UPLOAD_BLOCK_SIZE', 4 * 1024 * 1024)) # big uploads are sent to azure in blocks of this many bytes
+AZURE_UPLOAD_CONCURRENCY = int(os.getenv('AZURE_UPLOAD_CONCURRENCY', 4)) # how many blocks are uploaded at the same time
+AZURE_UPLOAD_BLOCK_RETRIES = int(os.getenv('AZURE_UPLOAD_BLOCK_RETRIES', 2)) # how many times one failed block is sent again
+# Uploads streamed into azure while the request is still coming in (api/upload_handlers.py) use smaller blocks and fewer at a
+# time, every block that is being filled, waiting or being sent is held in memory: at most STREAM_UPLOAD_CONCURRENCY + 2 blocks (1 mb) per upload
+STREAM_UPLOAD_BLOCK_SIZE = int(os.getenv('STREAM_UPLOAD_BLOCK_SIZE', 256 * 1024))
+STREAM_UPLOAD_CONCURRENCY = int(os.getenv('STREAM_UPLOAD_CONCURRENCY', 2))
+
+# Direct uploads - how long the upload url from uploads/url works, and how long the client has to call finalize after getting it
+DIRECT_UPLOAD_URL_SECONDS = int(os.getenv('DIRECT_UPLOAD_URL_SECONDS', 15 * 60))
+DIRECT_UPLOAD_FINALIZE_SECONDS = int(os.getenv('DIRECT_UPLOAD_FINALIZE_SECONDS', 60 * 60))
+
+# Resumable upload sessions - how long a session lasts, and the biggest piece that can be sent in one PATCH (azure appends at most 4 mb at a time)
+UPLOAD_SESSION_SECONDS = int(os.getenv('UPLOAD_SESSION_SECONDS', 24 * 60 * 60))
+UPLOAD_SESSION_MAX_CHUNK = int(os.getenv('UPLOAD_SESSION_MAX_CHUNK', 4 * 1024 * 1024))
+
+# The cache used for the read endpoints (api/response_cache.py). Local memory by default, which is per worker process;
+# use a shared cache in production, e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://...
+# or django.core.cache.backends.filebased.FileBasedCache with a folder as the location
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+# a version bump (a write) only reaches the cache of the worker that made it when every worker has its own cache
+SHARED_CACHE = CACHE_BACKEND not in ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+        # local memory/file caches keep only 300 entries by default, too few once every post and comment has a fragment
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000))},
+    }
+}
+# how long a cached response is kept (0 turns the response cache off). Writes dont have to wait for this, they move the version on.
+# Off unless the cache is shared, with a per worker cache the other workers would keep sending the responses from before a write
+RESPONSE_CACHE_SECONDS = int(os.getenv('RESPONSE_CACHE_SECONDS', 5 * 60 if SHARED_CACHE else 0))
+# getPost/getPostComments are single flight: one request rebuilds a missing entry while the others get the previous response
+# (kept RESPONSE_STALE_SECONDS) or wait up to SINGLE_FLIGHT_WAIT seconds. The lock expires after SINGLE_FLIGHT_LOCK_SECONDS
+RESPONSE_STALE_SECONDS = int(os.getenv('RESPONSE_STALE_SECONDS', 60 * 60))
+SINGLE_FLIGHT_WAIT = float(os.getenv('SINGLE_FLIGHT_WAIT', 2))
+SINGLE_FLIGHT_LOCK_SECONDS = int(os.getenv('SINGLE_FLIGHT_LOCK_SECONDS', 30))
+
+# Responses are rendered with orjson when it is installed (api/renderers.py), set FAST_JSON_RENDERER=0 to use the json module.
+# Responses of at least COMPRESS_MIN_BYTES are sent with brotli (when installed) or gzip, whichever the client accepts
+FAST_JSON_RENDERER = os.getenv('FAST_JSON_RENDERER', '1') == '1'
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5)) # 0-11, higher is smaller but slower, 5 is close to gzip's speed
+
+# How long the serialized post/comment fragments stay in the cache (api/fast_serializers.py), 0 turns the fragment cache off.
+# The keys have the row's `updated` in them so they never go stale, this only decides when unused ones are dropped
+FRAGMENT_CACHE_SECONDS = int(os.getenv('FRAGMENT_CACHE_SECONDS', 24 * 60 * 60))
+
+# The comment tree of every post is cached for getPostComments and patched on every comment change (api/comment_tree_cache.py).
+# A patch waits up to COMMENT_TREE_LOCK_WAIT seconds for the post's lock, after that it deletes the tree instead
+COMMENT_TREE_CACHE_SECONDS = int(os.getenv('COMMENT_TREE_CACHE_SECONDS', 24 * 60 * 60))
+COMMENT_TREE_LOCK_WAIT = float(os.getenv('COMMENT_TREE_LOCK_WAIT', 1))
+
+# Username autocomplete (api/autocomplete.py) is answered from an index in the memory of every worker. Changes made by the worker
+# itself show up right away, every AUTOCOMPLETE_REBUILD_SECONDS a worker checks the users/profiles in the database and rebuilds
+# its index when they changed, and after AUTOCOMPLETE_MAX_AGE_SECONDS it rebuilds it anyway.
+# AUTOCOMPLETE_LIMIT is how many names are sent when the client doesnt ask (?limit=)
+AUTOCOMPLETE_REBUILD_SECONDS = float(os.getenv('AUTOCOMPLETE_REBUILD_SECONDS', 30))
+AUTOCOMPLETE_MAX_AGE_SECONDS = float(os.getenv('AUTOCOMPLETE_MAX_AGE_SECONDS', 10 * 60))
+AUTOCOMPLETE_LIMIT = int(os.getenv('AUTOCOMPLETE_LIMIT', 10))
+
+# How many rows the streamed list responses (?stream=1) read and serialize at a time, this is what bounds their memory
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 500))
+
+# Blob deletion queue (manage.py drain_blob_deletions) - blobs per batch call, how long a worker holds the rows it picked,
+# and the wait before a failed delete is tried again (doubles after every failure, up to the max)
+BLOB_DELETION_BATCH_SIZE = int(os.getenv('BLOB_DELETION_BATCH_SIZE', 256))
+BLOB_DELETION_LEASE_SECONDS = int(os.getenv('BLOB_DELETION_LEASE_SECONDS', 5 * 60))
+BLOB_DELETION_BACKOFF_SECONDS = int(os.getenv('BLOB_DELETION_BACKOFF_SECONDS', 30))
+BLOB_DELETION_MAX_BACKOFF_SECONDS = int(os.getenv('BLOB_DELETION_MAX_BACKOFF_SECONDS', 60 * 60))
+
+# The create post/profile uploads are streamed straight into azure by our handler, every other upload uses django's normal handlers
+FILE_UPLOAD_HANDLERS = [
+    'api.upload_handlers.BlobUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 # JWT settings 
 
 SIMPLE_JWT = {
@@ -95,6 +195,7 @@ SIMPLE_JWT = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.compression.CompressionMiddleware', # gzip/brotli, it runs last on the way out so it compresses the final body
 
     "corsheaders.middleware.CorsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",